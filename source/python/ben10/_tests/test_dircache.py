@@ -1,7 +1,9 @@
 from __future__ import unicode_literals
-from ben10.dircache import DirCache
-from ben10.filesystem import CreateDirectory, CreateFile, DeleteFile, IsDir, IsFile, IsLink
+from ben10.dircache import ContentAddressedDirCache, DirCache
+from ben10.filesystem import (CreateDirectory, CreateFile, DeleteFile, FileLock, FindFiles, IsDir,
+    IsFile, IsLink, ListFiles)
 from ben10.filesystem._filesystem import GetFileContents
+from ben10.filesystem._filesystem_exceptions import FileLockTimeoutError
 import os
 import pytest
 
@@ -148,6 +150,156 @@ class Test(object):
         assert charlie.cache_dir == embed_data.GetDataFilename('cache/charlie')
 
 
+    def testContentAddressedDirCache(self, embed_data):
+        remote_dir = embed_data['remotes']
+
+        def Create(cache_base_dir, name):
+            return ContentAddressedDirCache(
+                remote_dir + '/' + name + '.manifest',
+                None,
+                cache_base_dir,
+                objects_dir=cache_base_dir + '/.objects',
+            )
+
+        # Upload two caches sharing some files
+        for i_name, i_contents in [('alpha', 'alpha only'), ('bravo', 'bravo only')]:
+            upload_cache = Create(embed_data['upload'], i_name)
+            CreateFile(upload_cache.cache_dir + '/shared.txt', contents='shared')
+            CreateFile(upload_cache.cache_dir + '/sub/' + i_name + '.txt', contents=i_contents)
+            CreateFile(upload_cache.cache_dir + '/run.sh', contents='exit 0')
+            os.chmod(upload_cache.cache_dir + '/run.sh', 0o755)
+            CreateDirectory(upload_cache.cache_dir + '/empty')
+            upload_cache.CreateRemote()
+            assert upload_cache.RemoteExists()
+
+        # One object for each different contents (including the ".cache" tags)
+        remote_objects = [i for i in FindFiles(remote_dir + '/objects') if IsFile(i)]
+        assert len(remote_objects) == 5
+
+        alpha = Create(embed_data['cache'], 'alpha')
+        alpha.CreateCache()
+        assert alpha.CacheExists()
+        assert sorted(FindFiles(alpha.cache_dir, include_root_dir=False, standard_paths=True)) == [
+            '.cache',
+            'empty',
+            'run.sh',
+            'shared.txt',
+            'sub',
+            'sub/alpha.txt',
+        ]
+        assert GetFileContents(alpha.cache_dir + '/sub/alpha.txt') == 'alpha only'
+        assert os.access(alpha.cache_dir + '/run.sh', os.X_OK)
+        assert not os.access(alpha.cache_dir + '/shared.txt', os.X_OK)
+        assert len(FindFiles(alpha.objects_dir, ['*.x'])) == 1
+
+        # Files are hard links to the objects
+        shared_stat = os.stat(alpha.cache_dir + '/shared.txt')
+        if hasattr(os, 'link'):
+            assert shared_stat.st_nlink == 2
+
+        # Only the missing objects are downloaded: the shared ones may be removed from the remote.
+        for i_object in remote_objects:
+            if GetFileContents(i_object) in ('shared', 'exit 0', ''):
+                DeleteFile(i_object)
+        bravo = Create(embed_data['cache'], 'bravo')
+        bravo.CreateCache()
+        assert GetFileContents(bravo.cache_dir + '/sub/bravo.txt') == 'bravo only'
+        assert GetFileContents(bravo.cache_dir + '/shared.txt') == 'shared'
+        if hasattr(os, 'link'):
+            assert os.stat(bravo.cache_dir + '/shared.txt').st_ino == shared_stat.st_ino
+
+        caches = ContentAddressedDirCache.GetAllCacheDirs(remote_dir, embed_data['cache'])
+        assert [i.cache_name for i in caches] == ['alpha', 'bravo']
+
+        # Objects are checked against their hashes
+        with pytest.raises(RuntimeError):
+            Create(embed_data['other_cache'], 'alpha').CreateCache()
+        for i_object in remote_objects:
+            CreateFile(i_object, contents='corrupted')
+        with pytest.raises(RuntimeError):
+            Create(embed_data['other_cache'], 'alpha').CreateCache()
+        assert FindFiles(embed_data['other_cache'] + '/.objects', ['*.tmp']) == []
+
+
+    def testCreateCacheConcurrently(self, embed_data, monkeypatch):
+        import threading
+        import time
+
+        downloads = []
+        original_download_remote = DirCache._DownloadRemote
+        def DownloadRemote(self, target_dir):
+            downloads.append(target_dir)
+            time.sleep(0.2)
+            original_download_remote(self, target_dir)
+        monkeypatch.setattr(DirCache, '_DownloadRemote', DownloadRemote)
+
+        def Create(**kwargs):
+            return DirCache(embed_data['remotes/alpha.zip'], None, embed_data['cache_dir'], **kwargs)
+
+        # Left by a process killed while creating the cache
+        CreateFile(embed_data['cache_dir/.alpha.1234567.tmp/file.txt'], contents='')
+
+        # Only one download: the others wait for it
+        threads = [threading.Thread(target=Create().CreateCache) for _i in xrange(4)]
+        for i_thread in threads:
+            i_thread.start()
+        for i_thread in threads:
+            i_thread.join()
+        assert len(downloads) == 1
+        assert downloads[0] != embed_data['cache_dir/alpha']  # Downloaded to a staging directory
+        assert Create().CacheExists()
+        assert sorted(ListFiles(embed_data['cache_dir'])) == ['.alpha.lock', 'alpha', 'readme.txt']
+
+        # Forcing replaces the cache directory
+        Create().CreateCache(force=True)
+        assert len(downloads) == 2
+        assert Create().CacheExists()
+        assert sorted(ListFiles(embed_data['cache_dir'])) == ['.alpha.lock', 'alpha', 'readme.txt']
+
+        with FileLock(embed_data['cache_dir/.alpha.lock']):
+            with pytest.raises(FileLockTimeoutError):
+                Create(lock_timeout=0).CreateCache(force=True)
+        assert len(downloads) == 2
+
+
+    def testLockCache(self, embed_data):
+        import threading
+        import time
+
+        def Create(**kwargs):
+            return DirCache(embed_data['remotes/missing.zip'], None, embed_data['cache_dir'], **kwargs)
+
+        # Without a remote, the cache is created empty, to be filled (and tagged)
+        assert Create().CreateCache() == True
+        assert not Create().CacheExists()
+        Create().DeleteCache()
+
+        # Only one process fills the cache: the others wait until it is tagged
+        filled = []
+        def CreateAndFill():
+            dir_cache = Create()
+            with dir_cache.LockCache():
+                if dir_cache.CreateCache():
+                    filled.append(dir_cache)
+                    time.sleep(0.2)
+                    CreateFile(dir_cache.cache_dir + '/file.txt', contents='')
+                    dir_cache.TagCompleteCache()
+
+        threads = [threading.Thread(target=CreateAndFill) for _i in xrange(4)]
+        for i_thread in threads:
+            i_thread.start()
+        for i_thread in threads:
+            i_thread.join()
+        assert len(filled) == 1
+        assert Create().CacheExists()
+        assert Create().CreateCache() == False
+
+        with Create().LockCache():
+            with pytest.raises(FileLockTimeoutError):
+                Create(lock_timeout=0).DeleteCache()
+        assert Create().CacheExists()
+
+
 
 #===================================================================================================
 # dir_cache
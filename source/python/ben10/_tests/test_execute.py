@@ -1,8 +1,9 @@
 # coding: UTF-8
 from __future__ import unicode_literals
 from ben10.debug import StripDebugRefs
-from ben10.execute import (DEFAULT_ENCODING, EnvironmentContextManager, Execute, ExecuteNoWait,
-    ExecutePython, GetSubprocessOutput, GetSubprocessOutputChecked, PrintEnvironment)
+from ben10.execute import (COPY_FROM_ENVIRONMENT, DEFAULT_ENCODING, EnvironmentContextManager,
+    Execute, ExecuteMany, ExecuteNoWait, ExecutePython, GetSubprocessOutput,
+    GetSubprocessOutputChecked, IterExecute, PrintEnvironment)
 from ben10.foundation.exceptions import ExceptionToUnicode
 from ben10.foundation.string import Dedent
 from txtout.txtout import TextOutput
@@ -137,6 +138,147 @@ class Test(object):
         )
 
 
+    def testExecuteKeepEol(self):
+        output_lines = []
+        obtained = Execute(
+            [sys.executable, '-c', r'import sys; sys.stdout.write("alpha\r\nbravo\rcharlie\r\rdelta\necho")'],
+            output_callback=output_lines.append,
+            clean_eol=False,
+        )
+        assert obtained == ['alpha\r\n', 'bravo\r', 'charlie\r', '\r', 'delta\n', 'echo']
+        assert output_lines == obtained
+
+
+    def testIterExecute(self):
+        command_line = [sys.executable, '-c', r'import sys; sys.stdout.write("alpha\nbravo\n"); sys.exit(3)']
+
+        return_codes = []
+        output = IterExecute(command_line, return_code_callback=return_codes.append)
+        assert next(output) == 'alpha'
+        assert return_codes == []
+        assert list(output) == ['bravo']
+        assert return_codes == [3]
+
+        assert list(IterExecute(command_line, clean_eol=False)) == ['alpha\n', 'bravo\n']
+        assert b''.join(IterExecute(command_line, binary=True)) == b'alpha\nbravo\n'
+
+        # Closing the iterator before the end of the output kills the process.
+        command_line = [sys.executable, '-c', r'import sys; sys.stdout.write("alpha\n" * 1000000)']
+        return_codes = []
+        output = IterExecute(command_line, return_code_callback=return_codes.append)
+        assert next(output) == 'alpha'
+        output.close()
+        assert len(return_codes) == 1
+        assert return_codes[0] != 0
+
+
+    def testExecuteMany(self):
+
+        def PythonCommand(code):
+            return [sys.executable, '-c', code]
+
+        command_lines = [
+            PythonCommand('import time; time.sleep(0.5); print "job 0"'),
+            PythonCommand('import sys; print "job 1"; sys.exit(1)'),
+            PythonCommand('import os; print os.environ["MY_VAR"]; print os.environ["PATH"] != ""'),
+        ]
+        output_lines = []
+        obtained = ExecuteMany(
+            command_lines,
+            max_jobs=2,
+            environ={'PATH' : COPY_FROM_ENVIRONMENT, 'SYSTEMROOT' : COPY_FROM_ENVIRONMENT},
+            extra_environ={'MY_VAR' : 'my value'},
+            output_callback=lambda job_id, line: output_lines.append((job_id, line)),
+        )
+        assert obtained == [
+            (['job 0'], 0),
+            (['job 1'], 1),
+            (['my value', 'True'], 0),
+        ]
+        assert sorted(output_lines) == [(0, 'job 0'), (1, 'job 1'), (2, 'True'), (2, 'my value')]
+
+        # Job 0 finishes last: it runs while the other jobs go through the second process slot.
+        assert output_lines[-1] == (0, 'job 0')
+
+        assert ExecuteMany([]) == []
+
+
+    def testExecuteManyTimeout(self):
+        start = time.time()
+        obtained = ExecuteMany(
+            [
+                [sys.executable, '-c', 'import time; time.sleep(30)'],
+                [sys.executable, '-c', 'print "done"'],
+            ],
+            timeout=1,
+        )
+        assert obtained == [([], None), (['done'], 0)]
+        assert time.time() - start < 30
+
+
+    def testIterOutputLines(self):
+        from ben10.execute import _IterOutputLines
+
+        contents = 'alpha\r\nbravo\rcharlie\r\rdelta\nação\n\nçá'
+        expected = ['alpha\r\n', 'bravo\r', 'charlie\r', '\r', 'delta\n', 'ação\n', '\n', 'çá']
+
+        # Small chunks split eols and multi-byte characters between chunks.
+        for chunk_size in (1, 2, 3, 5, 1024):
+            read_fd, write_fd = os.pipe()
+            os.write(write_fd, contents.encode('utf-8'))
+            os.close(write_fd)
+            with os.fdopen(read_fd, 'rb') as stream:
+                obtained = list(_IterOutputLines(stream, 'utf-8', 'strict', chunk_size=chunk_size))
+            assert obtained == expected, 'chunk_size: %d' % chunk_size
+
+
+    def testExecuteKeepEolPerformance__flaky(self):
+        '''
+        Pipes 2 MB of output through the reader used by Execute(clean_eol=False), which reads in
+        chunks, and through the reader it replaced, which read one byte at a time.
+        '''
+        from ben10.execute import _IterOutputLines
+        from ben10.foundation.odict import odict
+
+        command_line = [
+            sys.executable,
+            '-c',
+            'import sys\n'
+            'line = b"x" * 99 + b"\\n"\n'
+            'for _i in range(20 * 1024): sys.stdout.write(line)\n'
+        ]
+
+        def IterBytes(stream, encoding, encoding_errors):
+            current_line = b''
+            for char in iter(lambda: stream.read(1), b''):
+                current_line += char
+                if char == b'\n':
+                    yield current_line.decode(encoding, errors=encoding_errors)
+                    current_line = b''
+
+        timing = odict()
+
+        def Check(name, iter_lines):
+            popen = subprocess.Popen(command_line, stdout=subprocess.PIPE)
+            try:
+                start = time.time()
+                output = list(iter_lines(popen.stdout, 'ascii', 'replace'))
+                timing[name] = time.time() - start
+            finally:
+                popen.stdout.close()
+                popen.wait()
+            assert len(output) == 20 * 1024
+
+        Check('bytes', IterBytes)
+        Check('chunks', _IterOutputLines)
+
+        PRINT_PERFORMANCE = False
+        if PRINT_PERFORMANCE:
+            print 'Reading bytes: %.2fs, reading chunks: %.2fs' % (timing['bytes'], timing['chunks'])
+
+        assert timing['chunks'] < timing['bytes']
+
+
     @pytest.mark.slow
     def testExecuteNoWait(self, embed_data):
         text_filename = embed_data['testExecuteNoWait.txt']
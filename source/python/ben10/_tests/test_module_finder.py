@@ -1,4 +1,5 @@
 from __future__ import unicode_literals
+from ben10.filesystem import FileTreeIndex
 from ben10.foundation.callback import Callback
 from ben10.module_finder import ImportToken, ModuleFinder
 import pytest
@@ -68,6 +69,10 @@ class Test:
             'sys'
         ]
 
+        file_tree_index = FileTreeIndex(embed_data.GetDataDirectory())
+        assert ModuleFinder.GetImports(embed_data.GetDataDirectory(), file_tree_index=file_tree_index) == \
+            ModuleFinder.GetImports(embed_data.GetDataDirectory())
+
 
     def testSystemPath(self, platform):
         m_finder = ModuleFinder(python_path=('/home/python/path', 'x:/project10/source/python'))
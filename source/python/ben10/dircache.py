@@ -1,11 +1,20 @@
 from __future__ import unicode_literals
 from archivist import Archivist
 from ben10.filesystem import (CopyFile, CreateDirectory, CreateFile, CreateLink,
-    CreateTemporaryDirectory, DeleteDirectory, DeleteFile, DeleteLink, Exists, IsDir, IsLink,
-    ListFiles, StandardizePath)
+    CreateTemporaryDirectory, DeleteDirectory, DeleteFile, DeleteLink, Exists, FileLock, IsDir,
+    IsLink, ListFiles, StandardizePath)
+from ben10.filesystem._filesystem import GetFileContents
 from ben10.filesystem._filesystem_exceptions import FileNotFoundError
 from ben10.foundation.decorators import Override
+import contextlib
 import os
+import threading
+
+
+
+# Default maximum number of files downloaded (or uploaded) at the same time by
+# ContentAddressedDirCache.
+DEFAULT_MAX_JOBS = 4
 
 
 
@@ -44,9 +53,19 @@ class DirCacheLocal(object):
     :ivar str cache_tag_contents:
         Contents of the '.cache' tag file. This should be something useful to determine how the
         cache was created.
+
+    :ivar float|None lock_timeout:
+        The maximum number of seconds to wait for other processes creating (or deleting) the same
+        cache. None waits forever.
+
+    Creating, tagging and deleting the cache are locked (see ben10.filesystem.FileLock, using the
+    lock file '.<cache_dirname>.lock' in `cache_base_dir`), so many processes (e.g. CI jobs in the
+    same machine) may share the cache base directory: the first one creates the cache and the
+    others wait for it. To fill the cache before other processes use it, keep it locked from its
+    creation until it is tagged (see LockCache).
     '''
 
-    def __init__(self, local_dir, cache_base_dir, cache_dirname, cache_tag_contents=''):
+    def __init__(self, local_dir, cache_base_dir, cache_dirname, cache_tag_contents='', lock_timeout=None):
         '''
         .. seealso:: class docs for params.
         '''
@@ -60,6 +79,10 @@ class DirCacheLocal(object):
         self._cache_tag_filename = self._cache_dir + '/.cache'
         self._cache_tag_contents = cache_tag_contents
 
+        self._lock_filename = self._cache_base_dir + '/.' + self._name + '.lock'
+        self._lock_timeout = lock_timeout
+        self._lock_depth = threading.local()
+
 
 
 
@@ -106,15 +129,21 @@ class DirCacheLocal(object):
         :return bool:
             True if directory was created. (self.cache_dir is now an empty dir)
             False if cache already existed. (self.cache_dir is already filled with a cache)
+
+        :raises FileLockTimeoutError:
+            If another process kept the cache locked longer than `lock_timeout`.
+
+        .. seealso:: LockCache, to fill the cache before other processes use it.
         '''
-        if self.CacheExists():
-            if not force:
-                return False
+        with self.LockCache():
+            if self.CacheExists():
+                if not force:
+                    return False
 
-            DeleteDirectory(self.cache_dir)
+                DeleteDirectory(self.cache_dir)
 
-        CreateDirectory(self.cache_dir)
-        return True
+            CreateDirectory(self.cache_dir)
+            return True
 
 
     def DeleteCache(self):
@@ -124,10 +153,11 @@ class DirCacheLocal(object):
         :return bool:
             True if cache was deleted, False if it did not exist and no change was required.
         '''
-        if Exists(self.cache_dir):
-            DeleteDirectory(self.cache_dir)
-            return True
-        return False
+        with self.LockCache():
+            if Exists(self.cache_dir):
+                DeleteDirectory(self.cache_dir)
+                return True
+            return False
 
 
     def CreateLocal(self):
@@ -173,8 +203,9 @@ class DirCacheLocal(object):
         If this file is not present, a cache is considered incomplete (i.e.,
         CacheExists will return False)
         '''
-        if not Exists(self._cache_tag_filename):
-            CreateFile(self._cache_tag_filename, self._cache_tag_contents)
+        with self.LockCache():
+            if not Exists(self._cache_tag_filename):
+                CreateFile(self._cache_tag_filename, self._cache_tag_contents)
 
 
     def LocalExists(self):
@@ -198,6 +229,80 @@ class DirCacheLocal(object):
         return Exists(self._cache_tag_filename) and len(os.listdir(self.cache_dir)) > 1
 
 
+    @contextlib.contextmanager
+    def LockCache(self):
+        '''
+        Locks the cache (see class docs), so other processes wait while it is created, filled and
+        tagged, instead of finding (and creating again) an untagged cache:
+
+            with dir_cache.LockCache():
+                if dir_cache.CreateCache():
+                    FillCache(dir_cache.cache_dir)
+                    dir_cache.TagCompleteCache()
+
+        Reentrant (in the same thread): CreateCache, TagCompleteCache and DeleteCache lock the cache
+        themselves.
+
+        :raises FileLockTimeoutError:
+            If another process kept the cache locked longer than `lock_timeout`.
+        '''
+        depth = getattr(self._lock_depth, 'value', 0)
+        if depth > 0:
+            self._lock_depth.value = depth + 1
+            try:
+                yield
+            finally:
+                self._lock_depth.value = depth
+            return
+
+        with FileLock(self._lock_filename, timeout=self._lock_timeout):
+            self._lock_depth.value = 1
+            try:
+                yield
+            finally:
+                self._lock_depth.value = 0
+
+
+    def _CreateStagingDir(self):
+        '''
+        Creates a directory (in the cache base directory) where a new cache is created before
+        replacing `cache_dir` (see _ReplaceCacheDir), so other processes never see incomplete caches.
+
+        Staging directories left by processes killed while creating the cache are removed (this
+        must be called with the cache locked, so there are no other staging directories in use).
+
+        :returns unicode:
+            The staging directory (empty).
+        '''
+        from ben10.foundation.hash import GetRandomHash
+
+        prefix = '.' + self._name + '.'
+        for i_name in ListFiles(self.cache_base_dir) or []:
+            if i_name.startswith(prefix) and i_name.endswith(('.tmp', '.old')):
+                DeleteDirectory(self.cache_base_dir + '/' + i_name, skip_on_error=True)
+
+        result = self.cache_base_dir + '/' + prefix + GetRandomHash() + '.tmp'
+        CreateDirectory(result)
+        return result
+
+
+    def _ReplaceCacheDir(self, staging_dir):
+        '''
+        Replaces `cache_dir` (if it exists) with the given staging directory, using renames (so
+        `cache_dir` is never incomplete).
+
+        :param unicode staging_dir:
+            .. seealso:: _CreateStagingDir
+        '''
+        if os.path.isdir(self.cache_dir):
+            old_dir = staging_dir[:-len('.tmp')] + '.old'
+            os.rename(self.cache_dir, old_dir)
+            os.rename(staging_dir, self.cache_dir)
+            DeleteDirectory(old_dir, skip_on_error=True)
+        else:
+            os.rename(staging_dir, self.cache_dir)
+
+
 
 #===================================================================================================
 # DirCache
@@ -253,22 +358,36 @@ class DirCache(DirCacheLocal):
 
     :ivar str cache_name:
         Basename of `cache_dir` (just the final directory_
+
+    :ivar float|None lock_timeout:
+        .. seealso:: DirCacheLocal
     '''
 
     # Cache for GetRemoteCacheDirs (list of cache dirs available in a directory)
     _REMOTE_CACHE_DIRS = {}
 
-    def __init__(self, remote, local_dir, cache_base_dir, cache_tag_contents=''):
+    # Extension of the remote files (one for each cache).
+    REMOTE_EXTENSION = '.zip'
+
+    def __init__(self, remote, local_dir, cache_base_dir, cache_tag_contents='', lock_timeout=None):
         '''
         .. seealso:: class docs for params.
         '''
-        assert remote.endswith('.zip'), 'Remote target must be a .zip file'
+        assert remote.endswith(self.REMOTE_EXTENSION), \
+            'Remote target must be a %s file' % self.REMOTE_EXTENSION
         self._remote = remote
 
         self._filename = os.path.basename(self._remote)
         cache_dirname = os.path.splitext(self._filename)[0]
 
-        DirCacheLocal.__init__(self, local_dir, cache_base_dir, cache_dirname, cache_tag_contents)
+        DirCacheLocal.__init__(
+            self,
+            local_dir,
+            cache_base_dir,
+            cache_dirname,
+            cache_tag_contents,
+            lock_timeout,
+        )
 
 
     @classmethod
@@ -281,18 +400,20 @@ class DirCache(DirCacheLocal):
             .. seealso:: class docs
 
         :return list(DirCache):
-            A list of DirCache objects, one for each directory found in `cache_base_dir`.
+            A list of DirCache objects (of this class), one for each directory found in
+            `cache_base_dir` (hidden directories, like the objects of ContentAddressedDirCache, are
+            ignored).
 
             All caches point to their mirror in `remote_dir`.
         '''
         dircaches = []
         caches = ListFiles(cache_base_dir) or []
         for dirname in sorted(caches):
-            if not os.path.isdir(cache_base_dir + '/' + dirname):
+            if dirname.startswith('.') or not os.path.isdir(cache_base_dir + '/' + dirname):
                 continue
 
-            dircaches.append(DirCache(
-                remote=remote_dir + '/' + dirname + '.zip',
+            dircaches.append(cls(
+                remote=remote_dir + '/' + dirname + cls.REMOTE_EXTENSION,
                 local_dir=None,
                 cache_base_dir=cache_base_dir,
             ))
@@ -342,15 +463,37 @@ class DirCache(DirCacheLocal):
         '''
         Overridden to download cache from remote after creating directory.
 
+        The remote is downloaded to a staging directory, which then replaces the cache directory.
+        Only one process downloads the cache: other processes wait for it (instead of downloading it
+        again).
+
         :param bool force:
             Forces the download, even if the local cache already exists.
+
+        :return bool:
+            True if the remote doesn't exist (self.cache_dir is now an empty dir, to be filled and
+            tagged, usually by CreateRemote, while the cache is locked: .. seealso:: LockCache).
+            False if the cache was downloaded, or already existed.
+
+        :raises FileLockTimeoutError:
+            .. seealso:: DirCacheLocal.CreateCache
         '''
-        created = DirCacheLocal.CreateCache(self, force=force)
-        if created:
+        with self.LockCache():
+            if self.CacheExists() and not force:
+                return False
+
+            staging_dir = self._CreateStagingDir()
             try:
-                self._DownloadRemote(self.cache_dir)
-            except FileNotFoundError:
-                pass
+                try:
+                    self._DownloadRemote(staging_dir)
+                    result = False
+                except FileNotFoundError:
+                    result = True  # No remote: an empty cache directory.
+                self._ReplaceCacheDir(staging_dir)
+            finally:
+                if Exists(staging_dir):
+                    DeleteDirectory(staging_dir, skip_on_error=True)
+            return result
 
 
     def CreateRemote(self):
@@ -421,3 +564,299 @@ class DirCache(DirCacheLocal):
             CopyFile(tmp_archive, self.remote)
             self._REMOTE_CACHE_DIRS.setdefault(self.remote_dir, []).append(self.remote_filename)
             DeleteFile(tmp_archive)
+
+
+
+#===================================================================================================
+# ContentAddressedDirCache
+#===================================================================================================
+class ContentAddressedDirCache(DirCache):
+    '''
+    A DirCache that stores files by the hash of their contents (objects), shared by all the caches
+    in the same remote directory and in the same cache base directory. Files common to many caches
+    are stored and downloaded only once.
+
+        dir_cache = ContentAddressedDirCache(
+            'ftp://.../caches/remote.manifest',
+            'local',
+            'c:/dircache',
+        )
+        dir_cache.CreateLocal()
+
+    Remote directory (c.f. DirCache for the local directory):
+        remote.manifest: The files (and directories) in the cache, with the hash of each file.
+            Uploaded after all objects, so the cache is complete when it exists.
+        objects/<first 2 chars of hash>/<hash>: The contents of the files of all caches.
+
+    Cache base directory:
+        remote: The cache directory, where each file is a hard link to its object (or a copy, where
+            hard links are not available, e.g. when the objects are in another drive).
+        .objects/<first 2 chars of hash>/<hash>[.x]: The objects downloaded (".x" for executable
+            files).
+
+    Only the objects missing in the local objects directory are downloaded, and only the objects
+    missing in the remote objects directory are uploaded. Downloaded objects are checked against
+    their hash and made read-only: since files in the cache directories share their contents with
+    other caches, they must never be changed in place. A remote object with wrong contents (e.g.
+    from an interrupted upload) makes downloads fail, and must be removed from the remote.
+
+    Objects are never removed (DeleteRemote and DeleteCache remove only the manifest and the cache
+    directory).
+
+    :ivar unicode objects_dir:
+        The local objects directory.
+
+    :ivar unicode remote_objects_dir:
+        The remote objects directory.
+    '''
+
+    REMOTE_EXTENSION = '.manifest'
+
+    # Algorithm used to hash the files (.. seealso:: ben10.foundation.hash.HashFile)
+    HASH_ALGORITHM = 'sha1'
+
+    OBJECTS_DIRNAME = 'objects'
+
+    MANIFEST_HEADER = '# ben10.dircache manifest 1'
+
+    def __init__(
+            self,
+            remote,
+            local_dir,
+            cache_base_dir,
+            cache_tag_contents='',
+            objects_dir=None,
+            max_jobs=DEFAULT_MAX_JOBS,
+            lock_timeout=None,
+        ):
+        '''
+        :param unicode objects_dir:
+            The local objects directory. Defaults to ".objects" in the cache base directory. Must
+            be in the same drive as the cache base directory to use hard links.
+
+        :param int max_jobs:
+            The maximum number of objects downloaded (or uploaded) at the same time.
+
+        .. seealso:: class docs (and DirCache) for other params.
+        '''
+        DirCache.__init__(self, remote, local_dir, cache_base_dir, cache_tag_contents, lock_timeout)
+
+        if objects_dir is None:
+            self._objects_dir = self.cache_base_dir + '/.' + self.OBJECTS_DIRNAME
+        else:
+            self._objects_dir = StandardizePath(os.path.abspath(objects_dir))
+        self._max_jobs = max_jobs
+
+
+    # Properties -----------------------------------------------------------------------------------
+    # .. seealso:: class docs for property docs
+    @property
+    def objects_dir(self):
+        return self._objects_dir
+
+
+    @property
+    def remote_objects_dir(self):
+        return self.remote_dir + '/' + self.OBJECTS_DIRNAME
+
+
+    # Functions ------------------------------------------------------------------------------------
+    @Override(DirCache._DownloadRemote)
+    def _DownloadRemote(self, target_dir):
+        '''
+        Downloads the manifest and the objects missing in the objects directory, and creates the
+        files of the cache from the objects.
+        '''
+        entries = self._ParseManifest(GetFileContents(self.remote, binary=True).decode('utf-8'))
+
+        missing = set()
+        for _path, digest, executable in entries:
+            if digest is not None and not os.path.isfile(self._GetObjectFilename(digest, executable)):
+                missing.add((digest, executable))
+        self._DownloadObjects(sorted(missing))
+
+        for path, digest, executable in entries:
+            target_filename = target_dir + '/' + path
+            if digest is None:
+                CreateDirectory(target_filename)
+            else:
+                CreateDirectory(os.path.dirname(target_filename))
+                _LinkOrCopyFile(self._GetObjectFilename(digest, executable), target_filename)
+
+
+    def _DownloadObjects(self, objects):
+        '''
+        Downloads objects from the remote objects directory.
+
+        Each object is downloaded to a temporary file (in the objects directory) and renamed only
+        after checking its hash, so other processes never see incomplete objects.
+
+        :param list(tuple(unicode,bool)) objects:
+            The (digest, executable) of each object.
+
+        :raises RuntimeError:
+            If a remote object is missing, or its contents don't match its hash.
+        '''
+        from ben10.filesystem import CopyFilesParallel
+        from ben10.foundation.hash import GetRandomHash, HashFile
+        import stat
+
+        files = []
+        for digest, executable in objects:
+            object_filename = self._GetObjectFilename(digest, executable)
+            CreateDirectory(os.path.dirname(object_filename))
+            files.append((
+                self._GetRemoteObjectFilename(digest),
+                '%s.%s.tmp' % (object_filename, GetRandomHash()),
+            ))
+
+        try:
+            try:
+                CopyFilesParallel(files, max_jobs=self._max_jobs)
+            except FileNotFoundError, e:
+                # Not a missing remote (which CreateCache ignores): the manifest exists.
+                raise RuntimeError('Object missing in the remote: %s' % e.filename)
+
+            for (digest, executable), (remote_filename, temp_filename) in zip(objects, files):
+                if HashFile(temp_filename, self.HASH_ALGORITHM) != digest:
+                    raise RuntimeError(
+                        'Contents of "%s" don\'t match its %s hash.' % (remote_filename, self.HASH_ALGORITHM)
+                    )
+
+                mode = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+                if executable:
+                    mode |= stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+                os.chmod(temp_filename, mode)
+
+                object_filename = self._GetObjectFilename(digest, executable)
+                try:
+                    os.rename(temp_filename, object_filename)
+                except OSError:
+                    # On Windows, rename fails if the target exists (downloaded by another process).
+                    if not os.path.isfile(object_filename):
+                        raise
+        finally:
+            for _remote_filename, temp_filename in files:
+                if os.path.isfile(temp_filename):
+                    os.chmod(temp_filename, stat.S_IWRITE)
+                    os.remove(temp_filename)
+
+
+    @Override(DirCache._UploadRemote)
+    def _UploadRemote(self):
+        '''
+        Uploads the objects missing in the remote objects directory, and then the manifest.
+        '''
+        from ben10.filesystem import CopyFilesParallel
+        from ben10.foundation.hash import HashTree
+        import stat
+
+        entries = []
+        for dirpath, dirnames, _filenames in os.walk(self.cache_dir):
+            for i_dirname in dirnames:
+                path = os.path.relpath(os.path.join(dirpath, i_dirname), self.cache_dir)
+                entries.append((path.replace(os.sep, '/'), None, False))
+
+        hashes = HashTree(self.cache_dir, algorithm=self.HASH_ALGORITHM, max_jobs=self._max_jobs)
+        remote_objects = {}
+        files = []
+        for path, digest in hashes.iteritems():
+            filename = self.cache_dir + '/' + path
+            executable = bool(os.stat(filename).st_mode & stat.S_IXUSR)
+            entries.append((path, digest, executable))
+
+            prefix = digest[:2]
+            if prefix not in remote_objects:
+                remote_prefix_dir = self.remote_objects_dir + '/' + prefix
+                listed = ListFiles(remote_prefix_dir)
+                if listed is None:
+                    CreateDirectory(remote_prefix_dir)
+                remote_objects[prefix] = set(listed or [])
+            if digest not in remote_objects[prefix]:
+                remote_objects[prefix].add(digest)
+                files.append((filename, self._GetRemoteObjectFilename(digest)))
+
+        CopyFilesParallel(files, max_jobs=self._max_jobs)
+
+        CreateFile(self.remote, self._CreateManifest(entries).encode('utf-8'), binary=True)
+        self._REMOTE_CACHE_DIRS.setdefault(self.remote_dir, []).append(self.remote_filename)
+
+
+    def _CreateManifest(self, entries):
+        '''
+        :param list(tuple(unicode,unicode|None,bool)) entries:
+            The (path, digest, executable) of each file in the cache (digest is None for
+            directories). Paths are relative to the cache directory, using "/" as separator.
+
+        :returns unicode:
+            The contents of the manifest file.
+        '''
+        lines = [self.MANIFEST_HEADER]
+        for path, digest, executable in sorted(entries):
+            if digest is None:
+                lines.append('d %s' % path)
+            else:
+                lines.append('%s %s %s' % ('x' if executable else 'f', digest, path))
+        return '\n'.join(lines) + '\n'
+
+
+    def _ParseManifest(self, contents):
+        '''
+        :param unicode contents:
+            The contents of the manifest file.
+
+        :rtype: list(tuple(unicode,unicode|None,bool))
+        :returns:
+            .. seealso:: _CreateManifest
+
+        :raises RuntimeError:
+            If the manifest is not valid.
+        '''
+        lines = contents.splitlines()
+        if not lines or lines[0] != self.MANIFEST_HEADER:
+            raise RuntimeError('Invalid manifest: %s' % self.remote)
+
+        result = []
+        for i_line in lines[1:]:
+            kind, _separator, rest = i_line.partition(' ')
+            if kind == 'd':
+                result.append((rest, None, False))
+            elif kind in ('f', 'x'):
+                digest, _separator, path = rest.partition(' ')
+                result.append((path, digest, kind == 'x'))
+            else:
+                raise RuntimeError('Invalid manifest: %s' % self.remote)
+        return result
+
+
+    def _GetObjectFilename(self, digest, executable):
+        result = self.objects_dir + '/' + digest[:2] + '/' + digest
+        if executable:
+            result += '.x'
+        return result
+
+
+    def _GetRemoteObjectFilename(self, digest):
+        return self.remote_objects_dir + '/' + digest[:2] + '/' + digest
+
+
+
+def _LinkOrCopyFile(source_filename, target_filename):
+    '''
+    Creates a hard link to source_filename, or copies it if hard links are not available (with
+    write permission, since a copy doesn't share its contents).
+    '''
+    import stat
+
+    if os.path.lexists(target_filename):
+        os.remove(target_filename)  # Left by an incomplete download
+
+    if hasattr(os, 'link'):
+        try:
+            os.link(source_filename, target_filename)
+            return
+        except OSError:
+            pass  # e.g. in another drive (EXDEV) or too many links to the object (EMLINK)
+
+    CopyFile(source_filename, target_filename)
+    os.chmod(target_filename, stat.S_IMODE(os.stat(target_filename).st_mode) | stat.S_IWUSR)
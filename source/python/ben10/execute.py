@@ -7,8 +7,10 @@ from ben10.foundation.uname import GetExecutableDir
 from cStringIO import StringIO
 from multiprocessing.process import current_process
 from txtout.txtout import TextOutput
+import codecs
 import locale
 import os
+import re
 import shlex
 import subprocess
 import sys
@@ -29,6 +31,9 @@ class COPY_FROM_ENVIRONMENT(object):
 DEFAULT_ENCODING = locale.getpreferredencoding()
 DEFAULT_ENCODING_ERRORS = 'replace'
 
+# Number of bytes read from the subprocess pipe at a time when streaming its output.
+OUTPUT_CHUNK_SIZE = 64 * 1024
+
 
 
 #===================================================================================================
@@ -259,6 +264,9 @@ def Execute(
     :param bool clean_eol:
         If True, output returned and passed to callback will be stripped of eols (\r \n)
 
+        If False, the output is read in big chunks and split into lines keeping the eols. A "\r"
+        not followed by "\n" also ends a line.
+
     :param bool pipe_stdout:
         If True, pipe stdout so that it can be returned as a string and passed to the output
         callback. If False, stdout will be dumped directly to the console (preserving color),
@@ -268,6 +276,65 @@ def Execute(
     :returns:
         Returns the process execution output as a list of strings.
     '''
+    result = []
+    for line in IterExecute(
+            command_line,
+            cwd=cwd,
+            environ=environ,
+            extra_environ=extra_environ,
+            input=input,
+            output_encoding=output_encoding,
+            output_encoding_errors=output_encoding_errors,
+            return_code_callback=return_code_callback,
+            shell=shell,
+            ignore_auto_quote=ignore_auto_quote,
+            clean_eol=clean_eol,
+            pipe_stdout=pipe_stdout,
+        ):
+        if output_callback:
+            output_callback(line)
+        result.append(line)
+
+    return result
+
+
+
+#===================================================================================================
+# IterExecute
+#===================================================================================================
+def IterExecute(
+        command_line,
+        cwd=None,
+        environ=None,
+        extra_environ=None,
+        input=None,  # @ReservedAssignment
+        output_encoding=None,
+        output_encoding_errors=None,
+        return_code_callback=None,
+        shell=False,
+        ignore_auto_quote=False,
+        clean_eol=True,
+        pipe_stdout=True,
+        binary=False,
+    ):
+    '''
+    Executes a shell command, yielding its output as it is generated instead of keeping it all in
+    memory.
+
+    Use the same parameters as Execute, except output_callback: handle each line as it is yielded.
+
+    The return code is passed to return_code_callback once the iteration ends. If the iteration is
+    stopped before the end of the output (the generator is closed, garbage collected or the caller
+    raises), the process is killed, and return_code_callback receives its (non-zero) return code.
+
+    :param bool binary:
+        If True yields the process output as raw chunks of bytes, without handling the encoding or
+        splitting lines (clean_eol is ignored).
+
+    :rtype: iter(unicode)|iter(bytes)
+    :returns:
+        Yields the process output lines (or chunks, if binary is True).
+    '''
     output_encoding = output_encoding or DEFAULT_ENCODING
     output_encoding_errors = output_encoding_errors or DEFAULT_ENCODING_ERRORS
 
@@ -281,8 +348,8 @@ def Execute(
         pipe_stdout=pipe_stdout,
     )
 
+    finished_output = False
     try:
-        result = []
         if popen.stdin:
             if input:
                 try:
@@ -294,50 +361,108 @@ def Execute(
             popen.stdin.close()
 
         if popen.stdout:
-            # TODO: BEN-31: Refactor System.Execute and derivates (git, scons, etc)
-            if clean_eol:  # Read one line at the time, and remove EOLs
-                for line in iter(popen.stdout.readline, b""):
-                    line = line.rstrip(b'\n\r')
-                    line = line.decode(output_encoding, errors=output_encoding_errors)
-                    if output_callback:
-                        output_callback(line)
-                    result.append(line)
-            else:  # Read one char at a time, to keep \r and \n
-                current_line = b''
-                carriage = False
-                for char in iter(lambda: popen.stdout.read(1), b""):
-
-                    # Check if last line was \r, if not, print what we have
-                    if char != b'\n' and carriage:
-                        carriage = False
-                        current_line = current_line.decode(output_encoding, errors=output_encoding_errors)
-                        if output_callback:
-                            output_callback(current_line)
-                        result.append(current_line)
-                        current_line = b''
-
-                    current_line += char
-
-                    if char == b'\r':
-                        carriage = True
-
-                    if char == b'\n':
-                        current_line = current_line.decode(output_encoding, errors=output_encoding_errors)
-                        if output_callback:
-                            output_callback(current_line)
-                        result.append(current_line)
-                        carriage = False
-                        current_line = b''
+            if binary:
+                fileno = popen.stdout.fileno()
+                for chunk in iter(lambda: os.read(fileno, OUTPUT_CHUNK_SIZE), b""):
+                    yield chunk
+            else:
+                for line in _IterProcessOutput(
+                        popen.stdout, output_encoding, output_encoding_errors, clean_eol):
+                    yield line
+        finished_output = True
 
     finally:
         if popen.stdout:
             popen.stdout.close()
 
-    popen.wait()
-    if return_code_callback:
-        return_code_callback(popen.returncode)
+        # Stopped before the end of the output: the process would block writing the rest of it.
+        if not finished_output and popen.poll() is None:
+            try:
+                popen.kill()
+            except OSError:
+                pass  # The process has just finished.
 
-    return result
+        popen.wait()
+        if return_code_callback:
+            return_code_callback(popen.returncode)
+
+
+
+def _IterProcessOutput(stream, encoding, encoding_errors, clean_eol):
+    '''
+    Yields the decoded lines read from the output of a process.
+
+    .. seealso:: Execute for the parameters.
+
+    :rtype: iter(unicode)
+    '''
+    # TODO: BEN-31: Refactor System.Execute and derivates (git, scons, etc)
+    if clean_eol:  # Read one line at the time, and remove EOLs
+        for line in iter(stream.readline, b""):
+            line = line.rstrip(b'\n\r')
+            yield line.decode(encoding, errors=encoding_errors)
+    else:  # Read big chunks, splitting lines but keeping \r and \n
+        for line in _IterOutputLines(stream, encoding, encoding_errors):
+            yield line
+
+
+_EOL_RE = re.compile('\r\n|\r|\n')
+
+
+def _IterOutputLines(stream, encoding, encoding_errors, chunk_size=OUTPUT_CHUNK_SIZE):
+    '''
+    Reads the given stream in chunks, yielding its lines as they are generated.
+
+    Lines keep their eols: a line ends on "\\n", "\\r\\n" or on a "\\r" not followed by "\\n" (used
+    by progress reports to rewrite the current line). A last line without eol is also yielded.
+
+    :param file stream:
+        The stream to read from, usually the stdout of a subprocess. It is read directly from its
+        file descriptor, so a chunk is returned as soon as any output is available.
+
+    :param unicode encoding:
+        Encoding used to decode the output. Uses an incremental decoder, so multi-byte characters
+        split between chunks are handled.
+
+    :param unicode encoding_errors:
+        Error handler for output decoding (strict, ignore, replace, etc)
+
+    :param int chunk_size:
+        The maximum number of bytes read at a time.
+
+    :rtype: iter(unicode)
+    '''
+    decoder = codecs.getincrementaldecoder(encoding)(errors=encoding_errors)
+    fileno = stream.fileno()
+    partial = []
+    carriage = ''
+    while True:
+        chunk = os.read(fileno, chunk_size)
+        text = carriage + decoder.decode(chunk, final=not chunk)
+        carriage = ''
+        if chunk and text.endswith('\r'):
+            # Wait for the next chunk to know if this is a "\r\n".
+            carriage = '\r'
+            text = text[:-1]
+
+        pos = 0
+        for i_match in _EOL_RE.finditer(text):
+            end = i_match.end()
+            if partial:
+                partial.append(text[pos:end])
+                yield ''.join(partial)
+                partial = []
+            else:
+                yield text[pos:end]
+            pos = end
+        if pos < len(text):
+            partial.append(text[pos:])
+
+        if not chunk:
+            break
+
+    if partial:
+        yield ''.join(partial)
 
 
 
@@ -393,6 +518,109 @@ def Execute2(
 
 
 
+#===================================================================================================
+# ExecuteMany
+#===================================================================================================
+def ExecuteMany(
+        command_lines,
+        max_jobs=None,
+        timeout=None,
+        cwd=None,
+        environ=None,
+        extra_environ=None,
+        output_callback=None,
+        output_encoding=None,
+        output_encoding_errors=None,
+        shell=False,
+        ignore_auto_quote=False,
+        clean_eol=True,
+    ):
+    '''
+    Executes many command lines, running up to max_jobs processes at the same time.
+
+    Use the same parameters as Execute, applied to all command lines, except for the ones below.
+
+    :param list(list(unicode)|unicode) command_lines:
+        The command lines to execute. The job id of each command line is its index in this list.
+
+    :param int|None max_jobs:
+        The maximum number of processes running at the same time. If None, uses the number of
+        cpus.
+
+    :param float|None timeout:
+        If given, the maximum number of seconds for each process: processes running for longer are
+        killed.
+
+    :param callback(int, unicode) output_callback:
+        A optional callback called with the job id and the process output as it is generated.
+        Calls are serialized, so the callback doesn't have to be thread-safe.
+
+    :rtype: list(tuple(list(unicode), int|None))
+    :returns:
+        Returns a 2-tuple for each command line, in the same order as command_lines:
+            [0]: List of string printed by the process
+            [1]: The execution return code, or None if the process was killed because of the timeout
+    '''
+    from ben10.foundation.thread_pool import RunInThreads
+    import threading
+
+    if max_jobs is None:
+        import multiprocessing
+        max_jobs = multiprocessing.cpu_count()
+
+    output_encoding = output_encoding or DEFAULT_ENCODING
+    output_encoding_errors = output_encoding_errors or DEFAULT_ENCODING_ERRORS
+
+    # Resolves the environment only once, shared by all processes.
+    environ = _GetEnviron(environ, extra_environ)
+
+    results = [None] * len(command_lines)
+    output_lock = threading.Lock()
+
+    def RunJob(job_id):
+        popen = ProcessOpen(
+            command_lines[job_id],
+            cwd=cwd,
+            environ=environ,
+            shell=shell,
+            ignore_auto_quote=ignore_auto_quote,
+        )
+        popen.stdin.close()
+
+        timed_out = []
+        def Kill():
+            timed_out.append(True)
+            try:
+                popen.kill()
+            except OSError:
+                pass  # The process has just finished.
+
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, Kill)
+            timer.start()
+
+        output = []
+        try:
+            for line in _IterProcessOutput(
+                    popen.stdout, output_encoding, output_encoding_errors, clean_eol):
+                if output_callback:
+                    with output_lock:
+                        output_callback(job_id, line)
+                output.append(line)
+        finally:
+            popen.stdout.close()
+            popen.wait()
+            if timer is not None:
+                timer.cancel()
+
+        results[job_id] = (output, None if timed_out else popen.returncode)
+
+    RunInThreads(RunJob, [(i,) for i in xrange(len(command_lines))], max_jobs)
+    return results
+
+
+
 #===================================================================================================
 # ExecuteNoWait
 #===================================================================================================
@@ -1,4 +1,6 @@
 from __future__ import unicode_literals
 from _filesystem import *
 from _filesystem_exceptions import *
+from _file_tree_index import FileTreeIndex
+from _filelock import FileLock
 from _fileutils import OpenReadOnlyFile
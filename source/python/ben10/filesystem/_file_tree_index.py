@@ -0,0 +1,375 @@
+from __future__ import unicode_literals
+'''
+An in-memory index of the names in a directory tree, to answer many FindFiles queries for the same
+tree without walking the disk each time.
+'''
+from ben10.filesystem._filesystem import (CreateFileAtomically, ExtendedPathMask, _CompileMasks,
+    _GetScandir)
+import os
+import time
+
+
+
+# Kinds of the entries in a directory.
+_FILE = 0
+_DIR = 1
+_DIR_LINK = 2  # Link to a directory: listed as a directory, but not visited (like os.walk)
+
+
+
+#===================================================================================================
+# FileTreeIndex
+#===================================================================================================
+class FileTreeIndex(object):
+    '''
+    Usage:
+        index = FileTreeIndex.Load('/home/user/.cache/source.index', '/home/user/project/source')
+
+        python_files = index.FindFiles(in_filters=['*.py'], out_filters=['.git'])
+        data_files = index.FindFilesX('+/home/user/project/source/data/*.csv;!_*')
+
+        index.Refresh()  # After changing files in the tree.
+        index.Save('/home/user/.cache/source.index')
+
+    Only names are indexed (not sizes or contents). The directories are listed once; Refresh lists
+    again only the directories whose modification time changed (which happens when entries are
+    added, removed or renamed), so it only needs a stat for each directory.
+
+    Directories changed less than RACY_SECONDS before being listed are always listed again by
+    Refresh, since changes made in the same second would not change their modification time in
+    filesystems with coarse timestamps.
+    '''
+
+    # Format of the file written by Save: files with other versions are ignored by Load.
+    FORMAT_VERSION = 1
+
+    RACY_SECONDS = 2
+
+    def __init__(self, directory):
+        '''
+        Indexes the given directory.
+
+        :param unicode directory:
+            The root of the tree.
+        '''
+        self.directory = os.path.abspath(directory)
+
+        # For each directory (relative to the root, using "/" as separator): its modification time
+        # (None for racy directories) and its entries, as a list of (name, kind), in the order listed.
+        self._directories = {}
+
+        self.Refresh()
+
+
+    def Refresh(self):
+        '''
+        Updates the index with the changes in the tree.
+
+        :returns int:
+            The number of directories listed.
+        '''
+        scan_time = time.time()
+        scandir = _GetScandir()
+
+        directories = {}
+        listed = 0
+        pending = ['']
+        while pending:
+            path = pending.pop()
+            full_path = self._GetFullPath(path)
+            try:
+                mtime = os.stat(full_path).st_mtime
+            except OSError:
+                continue
+
+            entry = self._directories.get(path)
+            if entry is None or entry[0] is None or entry[0] != mtime:
+                try:
+                    entries = [(i.name, _GetKind(i)) for i in scandir(full_path)]
+                except OSError:
+                    continue
+                listed += 1
+                if mtime >= scan_time - self.RACY_SECONDS:
+                    mtime = None
+                entry = (mtime, entries)
+            directories[path] = entry
+
+            prefix = path + '/' if path else ''
+            pending.extend(prefix + name for name, kind in reversed(entry[1]) if kind == _DIR)
+
+        self._directories = directories
+        return listed
+
+
+    def FindFiles(
+            self,
+            dir_=None,
+            in_filters=None,
+            out_filters=None,
+            recursive=True,
+            include_root_dir=True,
+            standard_paths=False,
+        ):
+        '''
+        Same as ben10.filesystem.FindFiles, but using the index (as of the last Refresh).
+
+        :param unicode|None dir_:
+            The directory to search: the root of the index or one of its sub-directories. If None,
+            the root of the index.
+
+        :raises ValueError:
+            If dir_ is not in the tree.
+
+        .. seealso:: ben10.filesystem.FindFiles for the other parameters.
+        '''
+        return list(
+            self.IterFindFiles(dir_, in_filters, out_filters, recursive, include_root_dir, standard_paths)
+        )
+
+
+    def IterFindFiles(
+            self,
+            dir_=None,
+            in_filters=None,
+            out_filters=None,
+            recursive=True,
+            include_root_dir=True,
+            standard_paths=False,
+        ):
+        '''
+        Same as FindFiles, but returns a generator.
+
+        .. seealso:: FindFiles
+        '''
+        return self._IterFindFiles(
+            dir_,
+            in_filters,
+            out_filters,
+            recursive,
+            include_root_dir,
+            standard_paths,
+        )
+
+
+    def _IterFindFiles(
+            self,
+            dir_,
+            in_filters,
+            out_filters,
+            recursive,
+            include_root_dir,
+            standard_paths,
+            include_dirs=True,
+        ):
+        if dir_ is None:
+            dir_ = self.directory
+
+        # all files
+        if in_filters is None:
+            in_filters = ['*']
+
+        if out_filters is None:
+            out_filters = []
+
+        match_in = _CompileMasks(in_filters)
+        match_out = _CompileMasks(out_filters)
+
+        if include_root_dir:
+            dir_prefix = 0
+        else:
+            # Remove root dir from all paths
+            dir_prefix = len(dir_) + 1
+
+        if standard_paths:
+            from ben10.filesystem import StandardizePath
+
+        # Same order as ben10.filesystem.FindFiles
+        pending = [(self._GetRelativePath(dir_), dir_)]
+        while pending:
+            path, dir_root = pending.pop()
+            entry = self._directories.get(path)
+            if entry is None:
+                continue
+
+            # maintain just directories that don't have a pattern that match with out_filters
+            directories = [
+                (name, kind)
+                for name, kind in entry[1]
+                if kind != _FILE and not match_out(name)
+            ]
+            filenames = [name for name, kind in entry[1] if kind == _FILE]
+
+            if include_dirs:
+                filenames = [name for name, _kind in directories] + filenames
+            for filename in filenames:
+                if match_in(filename) and not match_out(filename):
+                    result = os.path.join(dir_root, filename)[dir_prefix:]
+                    if standard_paths:
+                        result = StandardizePath(result)
+                    yield result
+
+            if recursive:
+                prefix = path + '/' if path else ''
+                pending.extend(
+                    (prefix + name, os.path.join(dir_root, name))
+                    for name, kind in reversed(directories)
+                    if kind == _DIR
+                )
+
+
+    def FindFilesX(self, extended_path_mask):
+        '''
+        Finds the files (not directories) matching an extended path mask, as CopyFilesX does.
+
+        :param unicode extended_path_mask:
+            .. seealso:: ExtendedPathMask
+
+        :rtype: list(unicode)
+
+        :raises ValueError:
+            If the directory of the mask is not in the tree.
+        '''
+        tree_recurse, _flat_recurse, dirname, in_filters, out_filters = \
+            ExtendedPathMask.Split(extended_path_mask)
+
+        return list(self._IterFindFiles(
+            dirname,
+            in_filters,
+            out_filters,
+            tree_recurse,
+            include_root_dir=True,
+            standard_paths=False,
+            include_dirs=False,
+        ))
+
+
+    def ListFiles(self, directory):
+        '''
+        Same as ben10.filesystem.ListFiles, but using the index (as of the last Refresh).
+
+        :param unicode directory:
+            The root of the index or one of its sub-directories.
+
+        :rtype: list(unicode)|None
+        :returns:
+            The names of the files and directories in the directory, or None if it's not in the
+            index.
+
+        :raises ValueError:
+            If directory is not in the tree.
+        '''
+        entry = self._directories.get(self._GetRelativePath(directory))
+        if entry is None:
+            return None
+        return [name for name, _kind in entry[1]]
+
+
+    def IsDir(self, path):
+        '''
+        :param unicode path:
+            A path in the tree.
+
+        :returns bool:
+            True if path is a directory (or a link to a directory) in the index.
+
+        :raises ValueError:
+            If path is not in the tree.
+        '''
+        relative_path = self._GetRelativePath(path)
+        if not relative_path:
+            return '' in self._directories
+        parent, _separator, name = relative_path.rpartition('/')
+        entry = self._directories.get(parent)
+        if entry is None:
+            return False
+        for i_name, i_kind in entry[1]:
+            if i_name == name:
+                return i_kind != _FILE
+        return False
+
+
+    def Save(self, filename):
+        '''
+        Writes the index to a file (atomically, replacing it if it exists).
+
+        :param unicode filename:
+        '''
+        import cPickle
+
+        contents = cPickle.dumps(
+            (self.FORMAT_VERSION, self.directory, self._directories),
+            cPickle.HIGHEST_PROTOCOL
+        )
+        CreateFileAtomically(filename, contents)
+
+
+    @classmethod
+    def Load(cls, filename, directory, refresh=True):
+        '''
+        Reads an index written by Save.
+
+        :param unicode filename:
+            The file written by Save.
+
+        :param unicode directory:
+            The root of the tree. If the file doesn't exist, can't be read or is for another
+            directory, indexes the directory again.
+
+        :param bool refresh:
+            If True, refreshes the index read (see Refresh).
+
+        :rtype: FileTreeIndex
+        '''
+        import cPickle
+
+        directory = os.path.abspath(directory)
+        try:
+            with open(filename, 'rb') as stream:
+                version, stored_directory, directories = cPickle.load(stream)
+        except Exception:
+            return cls(directory)
+
+        if version != cls.FORMAT_VERSION or stored_directory != directory:
+            return cls(directory)
+
+        result = cls.__new__(cls)
+        result.directory = directory
+        result._directories = directories
+        if refresh:
+            result.Refresh()
+        return result
+
+
+    def _GetFullPath(self, path):
+        if not path:
+            return self.directory
+        return os.path.join(self.directory, *path.split('/'))
+
+
+    def _GetRelativePath(self, path):
+        '''
+        :returns unicode:
+            The path relative to the root of the index, using "/" as separator ('' for the root).
+
+        :raises ValueError:
+            If path is not in the tree.
+        '''
+        result = os.path.relpath(os.path.abspath(path), self.directory)
+        if result == os.curdir:
+            return ''
+        result = result.replace(os.sep, '/')
+        if result == os.pardir or result.startswith(os.pardir + '/') or os.path.isabs(result):
+            raise ValueError('Path "%s" is not in the tree "%s".' % (path, self.directory))
+        return result
+
+
+
+def _GetKind(dir_entry):
+    try:
+        if not dir_entry.is_dir():
+            return _FILE
+        if dir_entry.is_symlink():
+            return _DIR_LINK
+    except OSError:
+        return _FILE
+    return _DIR
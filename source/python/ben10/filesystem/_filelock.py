@@ -0,0 +1,172 @@
+from __future__ import unicode_literals
+'''
+Locks shared by processes (and threads), using the operating system locks on a lock file.
+'''
+import os
+import sys
+import threading
+import time
+
+
+
+#===================================================================================================
+# FileLock
+#===================================================================================================
+class FileLock(object):
+    '''
+    An exclusive lock on a file, shared by all processes using the same lock file (e.g. CI jobs
+    running in the same machine). Uses fcntl.flock on posix and msvcrt.locking on Windows, so the
+    lock is released by the operating system if the process dies.
+
+    Usage:
+        with FileLock('/cache/data.lock', timeout=60):
+            ...  # Only one process at a time here.
+
+        lock = FileLock('/cache/data.lock')
+        if lock.Acquire(blocking=False):
+            try:
+                ...
+            finally:
+                lock.Release()
+
+    With shared=True, many processes may hold the lock at the same time (but not while another
+    process holds it exclusively), e.g. readers of data updated by processes holding the exclusive
+    lock. On Windows (msvcrt.locking), shared locks are exclusive too.
+
+    The lock is not reentrant. The lock file is created when needed and is never removed (removing it
+    could let two processes lock different files with the same name).
+    '''
+
+    # Interval (in seconds) between attempts to get the lock when waiting for it.
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, filename, timeout=None, shared=False):
+        '''
+        :param unicode filename:
+            The lock file.
+
+        :param float|None timeout:
+            The maximum number of seconds to wait for the lock when used as a context manager (None
+            waits forever).
+
+        :param bool shared:
+            If True, a shared lock (see class docs).
+        '''
+        self.filename = filename
+        self.timeout = timeout
+        self.shared = shared
+        self._file_descriptor = None
+        self._thread_lock = threading.Lock()
+
+
+    def Acquire(self, blocking=True, timeout=None):
+        '''
+        :param bool blocking:
+            If False, returns immediately if the lock is held by another process.
+
+        :param float|None timeout:
+            If blocking, the maximum number of seconds to wait for the lock (None waits forever).
+
+        :returns bool:
+            True if the lock was acquired.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        def Expired():
+            return not blocking or (deadline is not None and time.time() >= deadline)
+
+        # Other threads using this same instance wait here.
+        while not self._thread_lock.acquire(blocking and deadline is None):
+            if Expired():
+                return False
+            time.sleep(self.POLL_INTERVAL)
+
+        try:
+            from ben10.filesystem import CreateDirectory
+            CreateDirectory(os.path.dirname(os.path.abspath(self.filename)))
+            file_descriptor = os.open(self.filename, os.O_RDWR | os.O_CREAT)
+            try:
+                while not _TryLock(file_descriptor, self.shared):
+                    if Expired():
+                        os.close(file_descriptor)
+                        self._thread_lock.release()
+                        return False
+                    time.sleep(self.POLL_INTERVAL)
+            except:
+                os.close(file_descriptor)
+                raise
+        except:
+            self._thread_lock.release()
+            raise
+
+        self._file_descriptor = file_descriptor
+        return True
+
+
+    def Release(self):
+        '''
+        Releases the lock acquired by Acquire.
+        '''
+        assert self._file_descriptor is not None, 'FileLock not acquired: %s' % self.filename
+        file_descriptor, self._file_descriptor = self._file_descriptor, None
+        try:
+            _Unlock(file_descriptor)
+        finally:
+            os.close(file_descriptor)
+            self._thread_lock.release()
+
+
+    def IsLocked(self):
+        '''
+        :returns bool:
+            True if this instance holds the lock.
+        '''
+        return self._file_descriptor is not None
+
+
+    def __enter__(self):
+        if not self.Acquire(timeout=self.timeout):
+            from ben10.filesystem._filesystem_exceptions import FileLockTimeoutError
+            raise FileLockTimeoutError(self.filename)
+        return self
+
+
+    def __exit__(self, *args):
+        self.Release()
+
+
+
+if sys.platform == 'win32':
+
+    def _TryLock(file_descriptor, _shared):
+        import msvcrt
+        os.lseek(file_descriptor, 0, os.SEEK_SET)
+        try:
+            msvcrt.locking(file_descriptor, msvcrt.LK_NBLCK, 1)
+        except IOError:
+            return False
+        return True
+
+
+    def _Unlock(file_descriptor):
+        import msvcrt
+        os.lseek(file_descriptor, 0, os.SEEK_SET)
+        msvcrt.locking(file_descriptor, msvcrt.LK_UNLCK, 1)
+
+else:
+
+    def _TryLock(file_descriptor, shared):
+        import errno
+        import fcntl
+        try:
+            fcntl.flock(file_descriptor, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        except IOError, e:
+            if e.errno in (errno.EACCES, errno.EAGAIN):
+                return False
+            raise
+        return True
+
+
+    def _Unlock(file_descriptor):
+        import fcntl
+        fcntl.flock(file_descriptor, fcntl.LOCK_UN)
+
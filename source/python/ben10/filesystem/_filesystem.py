@@ -196,7 +196,7 @@ def NormStandardPath(path):
 #===================================================================================================
 # CreateMD5
 #===================================================================================================
-def CreateMD5(source_filename, target_filename=None):
+def CreateMD5(source_filename, target_filename=None, download_filename=None):
     '''
     Creates a md5 file from a source file (contents are the md5 hash of source file)
 
@@ -208,8 +208,12 @@ def CreateMD5(source_filename, target_filename=None):
         Name of the target file with the md5 contents
 
         If None, defaults to source_filename + '.md5'
+
+    :param unicode|None download_filename:
+        If given, the contents of the source file are also written to this local file while
+        computing the md5 (e.g.: to download a remote file and check it reading it only once).
     '''
-    from ben10.foundation.hash import Md5Hex
+    from ben10.foundation.hash import HashStream, Md5Hex
 
     if target_filename is None:
         target_filename = source_filename + '.md5'
@@ -218,12 +222,28 @@ def CreateMD5(source_filename, target_filename=None):
     source_url = urlparse(source_filename)
 
     # Obtain MD5 hex
-    if _UrlIsLocal(source_url):
+    if _UrlIsLocal(source_url) and download_filename is None:
         # If using a local file, we can give Md5Hex the filename
         md5_contents = Md5Hex(filename=source_filename)
     else:
-        # Md5Hex can't handle remote files, we open it and pray we won't run out of memory.
-        md5_contents = Md5Hex(contents=GetFileContents(source_filename, binary=True))
+        # Remote files are hashed while read (in chunks), so they're never fully loaded in memory.
+        stream = OpenFile(source_filename, binary=True)
+        try:
+            if download_filename is None:
+                md5_contents = HashStream(stream, 'md5')
+            else:
+                _AssertIsLocal(download_filename)
+                CreateDirectory(os.path.dirname(os.path.abspath(download_filename)))
+                try:
+                    with io.open(download_filename, 'wb') as download_file:
+                        md5_contents = HashStream(stream, 'md5', tee=download_file)
+                except:
+                    # Don't leave partial downloads behind
+                    if os.path.isfile(download_filename):
+                        os.remove(download_filename)
+                    raise
+        finally:
+            stream.close()
 
     # Write MD5 hash to a file
     CreateFile(target_filename, md5_contents)
@@ -234,7 +254,14 @@ MD5_SKIP = 'md5_skip'  # Returned to show that a file copy was skipped because i
 #===================================================================================================
 # CopyFile
 #===================================================================================================
-def CopyFile(source_filename, target_filename, override=True, md5_check=False, copy_symlink=True):
+def CopyFile(
+        source_filename,
+        target_filename,
+        override=True,
+        md5_check=False,
+        copy_symlink=True,
+        compute_md5=False,
+    ):
     '''
     Copy a file from source to target.
 
@@ -255,9 +282,20 @@ def CopyFile(source_filename, target_filename, override=True, md5_check=False, c
     :param  copy_symlink:
         @see _DoCopyFile
 
+    :param bool compute_md5:
+        If True (and md5_check is True), computes the md5 of the contents while copying them (so the
+        file is not read again for that) and, if there's a source md5 file, checks the copied
+        contents against it. Without a source md5 file, no target md5 file is created.
+
+        Only for local copies: ignored for remote source or target files.
+
     :raises FileAlreadyExistsError:
         If target_filename already exists, and override is False
 
+    :raises Md5MismatchError:
+        If compute_md5 is True and the copied contents don't match the source md5 file (the target
+        md5 file is removed, so the file is copied again by the next md5_check).
+
     :raises NotImplementedProtocol:
         If file protocol is not accepted
 
@@ -301,14 +339,28 @@ def CopyFile(source_filename, target_filename, override=True, md5_check=False, c
             return MD5_SKIP
 
     # Copy source file
-    _DoCopyFile(source_filename, target_filename, copy_symlink=copy_symlink)
+    compute_md5 = md5_check and compute_md5
+    copied_md5 = _DoCopyFile(
+        source_filename,
+        target_filename,
+        copy_symlink=copy_symlink,
+        compute_md5=compute_md5,
+    )
+
+    # Check the md5 computed while copying
+    if compute_md5 and copied_md5 is not None and source_md5_contents is not None:
+        if copied_md5 != source_md5_contents.strip().lower():
+            if Exists(target_md5_filename):
+                DeleteFile(target_md5_filename)
+            from ._filesystem_exceptions import Md5MismatchError
+            raise Md5MismatchError(target_filename)
 
     # If we have a source_md5, but no target_md5, create the target_md5 file
     if md5_check and source_md5_contents is not None and source_md5_contents != target_md5_contents:
         CreateFile(target_md5_filename, source_md5_contents)
 
 
-def _DoCopyFile(source_filename, target_filename, copy_symlink=True):
+def _DoCopyFile(source_filename, target_filename, copy_symlink=True, compute_md5=False):
     '''
     :param unicode source_filename:
         The source filename.
@@ -321,6 +373,12 @@ def _DoCopyFile(source_filename, target_filename, copy_symlink=True):
     :param  copy_symlink:
         @see _CopyFileLocal
 
+    :param  compute_md5:
+        @see _CopyFileLocal
+
+    :returns unicode|None:
+        The md5 of the copied contents, if compute_md5 is True and the file was copied locally.
+
     :raises FileNotFoundError:
         If source_filename does not exist
     '''
@@ -336,7 +394,12 @@ def _DoCopyFile(source_filename, target_filename, copy_symlink=True):
 
         if _UrlIsLocal(target_url):
             # local to local
-            _CopyFileLocal(source_filename, target_filename, copy_symlink=copy_symlink)
+            return _CopyFileLocal(
+                source_filename,
+                target_filename,
+                copy_symlink=copy_symlink,
+                compute_md5=compute_md5,
+            )
         elif target_url.scheme in ['ftp']:
             # local to remote
             from _filesystem_remote import FTPUploadFileToUrl
@@ -359,7 +422,7 @@ def _DoCopyFile(source_filename, target_filename, copy_symlink=True):
         raise NotImplementedProtocol(source_url.scheme)
 
 
-def _CopyFileLocal(source_filename, target_filename, copy_symlink=True):
+def _CopyFileLocal(source_filename, target_filename, copy_symlink=True, compute_md5=False):
     '''
     Copy a file locally to a directory.
 
@@ -374,8 +437,16 @@ def _CopyFileLocal(source_filename, target_filename, copy_symlink=True):
         a symlink.
 
         If False, the file being linked will be copied instead.
+
+    :param bool compute_md5:
+        If True, computes the md5 of the contents while copying them.
+
+    :returns unicode|None:
+        The md5 of the copied contents, if compute_md5 is True and the file was copied (not created
+        as a symlink).
     '''
     import shutil
+    md5 = None
     try:
         # >>> Create the target_filename directory if necessary
         dir_name = os.path.dirname(target_filename)
@@ -400,17 +471,60 @@ def _CopyFileLocal(source_filename, target_filename, copy_symlink=True):
                     else:
                         source_filename = os.path.join(os.path.dirname(source_filename), link)
 
-            shutil.copyfile(source_filename, target_filename)
+            if compute_md5:
+                import hashlib
+                md5 = hashlib.md5()
+            _CopyFileContents(source_filename, target_filename, md5)
             shutil.copymode(source_filename, target_filename)
     except Exception, e:
         Reraise(e, 'While executiong _filesystem._CopyFileLocal(%s, %s)' % (source_filename, target_filename))
 
+    if md5 is not None:
+        return unicode(md5.hexdigest())
+
+
+# Size of the buffer used to copy files. Much bigger than the one used by shutil.copyfile, since
+# copying big files is mostly waiting for the disk (or the network, with shared drives).
+COPY_BUFFER_SIZE = 1024 * 1024
+
+def _CopyFileContents(source_filename, target_filename, md5=None):
+    '''
+    Copies the contents of a local file, reusing a single (big) buffer for all the contents.
+
+    :param unicode source_filename:
+        The filename to copy from.
+
+    :param unicode target_filename:
+        The filename to copy to.
+
+    :param hashlib.md5|None md5:
+        If given, updated with the contents while copying.
+    '''
+    if hasattr(os.path, 'samefile') and os.path.exists(target_filename) and \
+       os.path.samefile(source_filename, target_filename):
+        import shutil
+        raise shutil.Error('`%s` and `%s` are the same file' % (source_filename, target_filename))
+
+    buffer_ = bytearray(COPY_BUFFER_SIZE)
+    view = memoryview(buffer_)
+    with io.open(source_filename, 'rb', buffering=0) as source_file:
+        with io.open(target_filename, 'wb', buffering=0) as target_file:
+            while True:
+                size = source_file.readinto(buffer_)
+                if not size:
+                    break
+                if md5 is not None:
+                    md5.update(view[:size])
+                written = 0
+                while written < size:
+                    written += target_file.write(view[written:size])
+
 
 
 #===================================================================================================
 # CopyFiles
 #===================================================================================================
-def CopyFiles(source_dir, target_dir, create_target_dir=False, md5_check=False):
+def CopyFiles(source_dir, target_dir, create_target_dir=False, md5_check=False, compute_md5=False, max_jobs=1):
     '''
     Copy files from the given source to the target.
 
@@ -435,6 +549,14 @@ def CopyFiles(source_dir, target_dir, create_target_dir=False, md5_check=False):
     :param bool md5_check:
         .. seealso:: CopyFile
 
+    :param bool compute_md5:
+        .. seealso:: CopyFile
+
+    :param int max_jobs:
+        The maximum number of files copied at the same time.
+
+        .. seealso:: CopyFilesParallel
+
     :raises DirectoryNotFoundError:
         If target_dir does not exist, and create_target_dir is False
 
@@ -442,6 +564,18 @@ def CopyFiles(source_dir, target_dir, create_target_dir=False, md5_check=False):
 
     .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
     '''
+    files = []
+    _ListFilesToCopy(source_dir, target_dir, create_target_dir, md5_check, files)
+    CopyFilesParallel(files, max_jobs=max_jobs, md5_check=md5_check, compute_md5=compute_md5)
+
+
+def _ListFilesToCopy(source_dir, target_dir, create_target_dir, md5_check, files):
+    '''
+    Lists the files copied by CopyFiles (creating the target directories).
+
+    :param list(tuple(unicode,unicode)) files:
+        The (source_filename, target_filename) pairs are appended to this list.
+    '''
     import fnmatch
 
     # Check if we were given a directory or a directory with mask
@@ -478,16 +612,60 @@ def CopyFiles(source_dir, target_dir, create_target_dir=False, md5_check=False):
 
             if IsDir(source_path):
                 # If we found a directory, copy it recursively
-                CopyFiles(source_path, target_path, create_target_dir=True, md5_check=md5_check)
+                _ListFilesToCopy(source_path, target_path, True, md5_check, files)
             else:
-                CopyFile(source_path, target_path, md5_check=md5_check)
+                files.append((source_path, target_path))
+
+
+
+#===================================================================================================
+# CopyFilesParallel
+#===================================================================================================
+def CopyFilesParallel(files, max_jobs=1, **kwargs):
+    '''
+    Copies files with CopyFile, using up to max_jobs threads.
+
+    Copying many files is mostly waiting for the disk or the network (specially with shared drives),
+    so copying many files at the same time is usually much faster, even with a single cpu.
+
+    :param list(tuple(unicode,unicode)) files:
+        The (source_filename, target_filename) pairs to copy. Target directories must exist.
+
+    :param int max_jobs:
+        The maximum number of files copied at the same time.
+
+    :param kwargs:
+        Other parameters passed to CopyFile.
+
+    :raises Exception:
+        The first error raised by CopyFile (after running copies finish, and without starting new
+        ones).
+
+    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+    '''
+    from ben10.foundation.thread_pool import RunInThreads
+
+    if kwargs.get('md5_check'):
+        # CopyFile already copies the md5 file of each copied file: copying it again (possibly at the
+        # same time, in another thread) would write the same target md5 file twice.
+        target_filenames = set(target for _source, target in files)
+        files = [
+            (source, target)
+            for source, target in files
+            if not (target.endswith('.md5') and target[:-len('.md5')] in target_filenames)
+        ]
+
+    def Copy(source_filename, target_filename):
+        CopyFile(source_filename, target_filename, **kwargs)
+
+    RunInThreads(Copy, files, max_jobs)
 
 
 
 #===================================================================================================
 # CopyFilesX
 #===================================================================================================
-def CopyFilesX(file_mapping):
+def CopyFilesX(file_mapping, max_jobs=1):
     '''
     Copies files into directories, according to a file mapping
 
@@ -495,6 +673,11 @@ def CopyFilesX(file_mapping):
         A list of mappings between the directory in the target and the source.
         For syntax, @see: ExtendedPathMask
 
+    :param int max_jobs:
+        The maximum number of files copied at the same time.
+
+        .. seealso:: CopyFilesParallel
+
     :rtype: list(tuple(unicode,unicode))
     :returns:
         List of files copied. (source_filename, target_filename)
@@ -523,13 +706,12 @@ def CopyFilesX(file_mapping):
                 StandardizePath(i_target_filename)
             ))
 
-    # Copy files
-    for i_source_filename, i_target_filename in files:
-        # Create target dir if necessary
-        target_dir = os.path.dirname(i_target_filename)
-        CreateDirectory(target_dir)
+    # Create target dirs if necessary
+    for i_target_dir in sorted(set(os.path.dirname(i_target) for _source, i_target in files)):
+        CreateDirectory(i_target_dir)
 
-        CopyFile(i_source_filename, i_target_filename)
+    # Copy files
+    CopyFilesParallel(files, max_jobs=max_jobs)
 
     return files
 
@@ -695,6 +877,235 @@ def CopyDirectory(source_dir, target_dir, override=False):
 
 
 
+#===================================================================================================
+# SyncDirectory
+#===================================================================================================
+def SyncDirectory(
+        source_dir,
+        target_dir,
+        in_filters=None,
+        out_filters=None,
+        delete=False,
+        compare_contents=False,
+        max_jobs=1,
+    ):
+    '''
+    Updates target_dir with the contents of source_dir (like rsync), copying only new and changed
+    files, so that updating a mostly unchanged tree is fast.
+
+    A file is considered unchanged if it has the same size and modification time (in seconds) in
+    both directories: the modification time of copied files is set to the one of the source file.
+
+    Links in source_dir are followed: linked files and directories are copied as real files and
+    directories (links to their own parent directories are ignored). Links in target_dir are
+    replaced by the source contents (never written through).
+
+    :param unicode source_dir:
+        Where files will come from
+
+    :param unicode target_dir:
+        Where files will go to (created if necessary)
+
+    :param list(unicode) in_filters:
+        Only files that match these masks are synchronized (default = all). E.g.: ['*.py']
+
+    :param list(unicode) out_filters:
+        Files and directories that match these masks are ignored, in both directories (default =
+        none). E.g.: ['*.pyc', '.svn']
+
+        .. seealso:: ExtendedPathMask.Split to obtain filters from an extended path mask.
+
+    :param bool delete:
+        If True, deletes files (and empty directories) from target_dir that are not in source_dir.
+        Files ignored by the filters are never deleted.
+
+    :param bool compare_contents:
+        If True, files with the same size are compared by their md5 instead of their modification
+        time (much slower, but finds changes that keep both size and modification time).
+
+    :param int max_jobs:
+        The maximum number of files copied at the same time.
+
+        .. seealso:: CopyFilesParallel
+
+    :rtype: SyncDirectoryResult
+
+    :raises DirectoryNotFoundError:
+        If source_dir does not exist
+
+    :raises NotImplementedForRemotePathError:
+        If trying to sync to/from remote directories
+    '''
+    from ben10.foundation.hash import Md5Hex
+
+    _AssertIsLocal(source_dir)
+    _AssertIsLocal(target_dir)
+
+    if not os.path.isdir(source_dir):
+        from ._filesystem_exceptions import DirectoryNotFoundError
+        raise DirectoryNotFoundError(source_dir)
+
+    if in_filters is None:
+        in_filters = ['*']
+    if out_filters is None:
+        out_filters = []
+
+    def SourcePath(path):
+        return os.path.join(source_dir, *path.split('/'))
+
+    def TargetPath(path):
+        return os.path.join(target_dir, *path.split('/'))
+
+    source_dirs, source_files = _GetSyncManifest(source_dir, in_filters, out_filters, True)
+    target_dirs, target_files = _GetSyncManifest(target_dir, in_filters, out_filters, False)
+
+    result = SyncDirectoryResult()
+
+    # Directories replaced by files (and files replaced by directories) are always deleted
+    for i_path in sorted(source_files.viewkeys() & target_dirs):
+        DeleteDirectory(TargetPath(i_path))
+        prefix = i_path + '/'
+        target_dirs = set(i for i in target_dirs if i != i_path and not i.startswith(prefix))
+        for j_path in [j for j in target_files if j.startswith(prefix)]:
+            del target_files[j_path]
+    for i_path in sorted(source_dirs.intersection(target_files)):
+        DeleteFile(TargetPath(i_path))
+        del target_files[i_path]
+
+    # Links are replaced by the copied files
+    for i_path in sorted(source_files.viewkeys() & target_files.viewkeys()):
+        if target_files[i_path] is None:
+            DeleteFile(TargetPath(i_path))
+
+    if delete:
+        for i_path in sorted(target_files.viewkeys() - source_files.viewkeys()):
+            DeleteFile(TargetPath(i_path))
+            result.deleted_files.append(i_path)
+        # Sub directories first
+        for i_path in sorted(target_dirs - source_dirs, reverse=True):
+            try:
+                os.rmdir(TargetPath(i_path))
+            except OSError:
+                continue  # Not empty (contains files ignored by the filters)
+            result.deleted_dirs.append(i_path)
+
+    CreateDirectory(target_dir)
+    for i_path in sorted(source_dirs - target_dirs):
+        CreateDirectory(TargetPath(i_path))
+
+    files = []
+    touched_files = []
+    for i_path, (size, mtime) in sorted(source_files.iteritems()):
+        target_state = target_files.get(i_path)
+        if target_state == (size, mtime):
+            if not compare_contents:
+                result.unchanged_count += 1
+                continue
+        if compare_contents and target_state is not None and target_state[0] == size:
+            source_filename, target_filename = SourcePath(i_path), TargetPath(i_path)
+            if Md5Hex(filename=source_filename) == Md5Hex(filename=target_filename):
+                if target_state[1] != mtime:
+                    touched_files.append((source_filename, target_filename))
+                result.unchanged_count += 1
+                continue
+
+        files.append((SourcePath(i_path), TargetPath(i_path)))
+        result.copied_files.append(i_path)
+        result.bytes_copied += size
+
+    CopyFilesParallel(files, max_jobs=max_jobs, copy_symlink=False)
+
+    for i_source_filename, i_target_filename in files + touched_files:
+        source_stat = os.stat(i_source_filename)
+        os.utime(i_target_filename, (source_stat.st_atime, source_stat.st_mtime))
+
+    return result
+
+
+def _GetSyncManifest(directory, in_filters, out_filters, follow_links):
+    '''
+    :param bool follow_links:
+        If True, linked directories are listed (and walked) as real directories, except links to
+        their own parent directories (which are ignored). Otherwise, links (to files or directories)
+        are listed as files with a None state.
+
+    :rtype: tuple(set(unicode),dict(unicode,tuple(int,int)|None))
+    :returns:
+        The relative paths (using "/" as separator) of the directories, and the (size, mtime) of each
+        file, that match the filters in the given directory.
+    '''
+    directories = set()
+    files = {}
+    for dir_root, dirnames, filenames in os.walk(directory, followlinks=follow_links):
+        relative_root = os.path.relpath(dir_root, directory).replace(os.sep, '/')
+        prefix = '' if relative_root == '.' else relative_root + '/'
+
+        for i_dirname in dirnames[:]:
+            dirname = os.path.join(dir_root, i_dirname)
+            if MatchMasks(i_dirname, out_filters):
+                dirnames.remove(i_dirname)
+            elif not os.path.islink(dirname):
+                directories.add(prefix + i_dirname)
+            elif not follow_links:
+                dirnames.remove(i_dirname)
+                files[prefix + i_dirname] = None
+            else:
+                real_dirname = os.path.realpath(dirname)
+                real_root = os.path.realpath(dir_root)
+                if real_root == real_dirname or real_root.startswith(real_dirname + os.sep):
+                    dirnames.remove(i_dirname)  # Walking it would never end
+                else:
+                    directories.add(prefix + i_dirname)
+
+        for i_filename in filenames:
+            if MatchMasks(i_filename, in_filters) and not MatchMasks(i_filename, out_filters):
+                if not follow_links and os.path.islink(os.path.join(dir_root, i_filename)):
+                    files[prefix + i_filename] = None
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dir_root, i_filename))
+                except OSError:
+                    continue  # Broken link or removed while walking
+                files[prefix + i_filename] = (stat.st_size, int(stat.st_mtime))
+
+    return directories, files
+
+
+
+#===================================================================================================
+# SyncDirectoryResult
+#===================================================================================================
+class SyncDirectoryResult(object):
+    '''
+    Results of SyncDirectory.
+
+    All paths are relative to the synchronized directories, using "/" as separator.
+
+    :ivar list(unicode) copied_files:
+        The files copied (new or changed).
+
+    :ivar list(unicode) deleted_files:
+        The files deleted from the target directory.
+
+    :ivar list(unicode) deleted_dirs:
+        The directories deleted from the target directory.
+
+    :ivar int unchanged_count:
+        The number of files not copied, because they were unchanged.
+
+    :ivar int bytes_copied:
+        The total size of the copied files.
+    '''
+
+    def __init__(self):
+        self.copied_files = []
+        self.deleted_files = []
+        self.deleted_dirs = []
+        self.unchanged_count = 0
+        self.bytes_copied = 0
+
+
+
 #===================================================================================================
 # DeleteFile
 #===================================================================================================
@@ -1123,6 +1534,54 @@ def CreateFile(filename, contents, eol_style=EOL_STYLE_NATIVE, create_dir=True,
 
 
 
+#===================================================================================================
+# CreateFileAtomically
+#===================================================================================================
+def CreateFileAtomically(filename, contents):
+    '''
+    Creates (or replaces) a local file, writing the contents to a temporary file in the same
+    directory and renaming it, so other processes never read partially written contents.
+
+    :param unicode filename:
+        The local file. Missing directories are created.
+
+    :param str contents:
+        The file contents (bytes).
+
+    :return unicode:
+        Returns the name of the file created.
+    '''
+    import tempfile
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):  # Created by another process?
+                raise
+
+    fd, temp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as stream:
+            stream.write(contents)
+        try:
+            os.rename(temp_filename, filename)
+        except OSError:
+            # On Windows, rename fails if the target exists.
+            if not os.path.exists(filename):
+                raise
+            os.remove(filename)
+            os.rename(temp_filename, filename)
+    except:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+    return filename
+
+
+
 def ReplaceInFile(filename, old, new, encoding=None):
     '''
     Replaces all occurrences of "old" by "new" in the given file.
@@ -1735,15 +2194,48 @@ def MatchMasks(filename, masks):
     :return bool:
         True if the filename has matched with one pattern, False otherwise.
     '''
-    import fnmatch
+    return _CompileMasks(masks)(filename)
+
+
+_compiled_masks = {}
+
+def _CompileMasks(masks):
+    '''
+    Compiles all the masks into a single regular expression (cached), instead of matching each mask
+    with fnmatch.fnmatch, which normalizes the filename and looks for the mask regular expression for
+    each mask.
+
+    :param list(str)|str masks:
+        The patterns to match (as in MatchMasks).
 
+    :rtype: callable
+    :returns:
+        A function that receives a filename and returns True if it matches one of the masks (same
+        results as fnmatch.fnmatch: both masks and filenames are normalized with
+        os.path.normcase, so on Windows "/" matches "\\" and matches are case insensitive).
+    '''
     if not isinstance(masks, (list, tuple)):
         masks = [masks]
+    key = tuple(masks)
 
-    for i_mask in masks:
-        if fnmatch.fnmatch(filename, i_mask):
-            return True
-    return False
+    result = _compiled_masks.get(key)
+    if result is None:
+        if not masks:
+            result = lambda filename: False
+        else:
+            import fnmatch
+            normcase = os.path.normcase
+            pattern = '|'.join('(?:%s)' % fnmatch.translate(normcase(i)) for i in masks)
+            match = re.compile(pattern).match
+            if normcase('A/') == 'A/':
+                result = lambda filename: match(filename) is not None
+            else:
+                result = lambda filename: match(normcase(filename)) is not None
+
+        if len(_compiled_masks) >= 100:
+            _compiled_masks.clear()
+        _compiled_masks[key] = result
+    return result
 
 
 
@@ -1762,6 +2254,22 @@ def FindFiles(dir_, in_filters=None, out_filters=None, recursive=True, include_r
     :param bool standard_paths: if True, always uses unix path separators "/"
     :return list(str):
         A list of strings with the files that matched (with the full path in the filesystem).
+
+    .. seealso:: IterFindFiles to obtain the files as they are found.
+    '''
+    return list(IterFindFiles(dir_, in_filters, out_filters, recursive, include_root_dir, standard_paths))
+
+
+def IterFindFiles(dir_, in_filters=None, out_filters=None, recursive=True, include_root_dir=True, standard_paths=False):
+    '''
+    Same as FindFiles, but returns a generator, yielding the files as they are found (in the same
+    order as FindFiles).
+
+    Directories are listed with scandir (which usually gets the type of the entries without an extra
+    system call for each one), directories matching out_filters are not visited at all, and all the
+    masks are matched with a single regular expression.
+
+    .. seealso:: FindFiles for the parameters.
     '''
     # all files
     if in_filters is None:
@@ -1770,33 +2278,105 @@ def FindFiles(dir_, in_filters=None, out_filters=None, recursive=True, include_r
     if out_filters is None:
         out_filters = []
 
-    result = []
-
-    # maintain just files that don't have a pattern that match with out_filters
-    # walk through all directories based on dir
-    for dir_root, directories, filenames in os.walk(dir_):
-
-        for i_directory in directories[:]:
-            if MatchMasks(i_directory, out_filters):
-                directories.remove(i_directory)
-
-        for filename in directories + filenames:
-            if MatchMasks(filename, in_filters) and not MatchMasks(filename, out_filters):
-                result.append(os.path.join(dir_root, filename))
-
-        if not recursive:
-            break
+    match_in = _CompileMasks(in_filters)
+    match_out = _CompileMasks(out_filters)
 
-    if not include_root_dir:
+    if include_root_dir:
+        dir_prefix = 0
+    else:
         # Remove root dir from all paths
         dir_prefix = len(dir_) + 1
-        result = [file[dir_prefix:] for file in result]
 
     if standard_paths:
         from ben10.filesystem import StandardizePath
-        result = map(StandardizePath, result)
 
-    return result
+    scandir = _GetScandir()
+
+    # Walks like os.walk (top-down, without following links to directories)
+    pending = [dir_]
+    while pending:
+        dir_root = pending.pop()
+        try:
+            entries = list(scandir(dir_root))
+        except OSError:
+            continue
+
+        directories = []
+        filenames = []
+        for i_entry in entries:
+            try:
+                is_dir = i_entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                # maintain just directories that don't have a pattern that match with out_filters
+                if not match_out(i_entry.name):
+                    directories.append(i_entry)
+            else:
+                filenames.append(i_entry.name)
+
+        for filename in [i.name for i in directories] + filenames:
+            if match_in(filename) and not match_out(filename):
+                path = os.path.join(dir_root, filename)[dir_prefix:]
+                if standard_paths:
+                    path = StandardizePath(path)
+                yield path
+
+        if recursive:
+            pending.extend(
+                os.path.join(dir_root, i.name)
+                for i in reversed(directories)
+                if not _IsSymlinkEntry(i)
+            )
+
+
+def _GetScandir():
+    '''
+    :rtype: callable
+    :returns:
+        os.scandir (Python 3.5+), scandir.scandir (from the "scandir" package) or, if not available,
+        an equivalent implementation using os.listdir.
+    '''
+    try:
+        return os.scandir
+    except AttributeError:
+        pass
+    try:
+        import scandir
+        return scandir.scandir
+    except ImportError:
+        # Fallback to os.listdir (slower: each entry needs a stat)
+        return _ListDirEntries
+
+
+def _IsSymlinkEntry(entry):
+    try:
+        return entry.is_symlink()
+    except OSError:
+        return False
+
+
+def _ListDirEntries(directory):
+    '''
+    Implementation of scandir using os.listdir.
+    '''
+    return [_DirEntry(directory, i) for i in os.listdir(directory)]
+
+
+class _DirEntry(object):
+    '''
+    The parts of scandir.DirEntry used by IterFindFiles.
+    '''
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
 
 
 
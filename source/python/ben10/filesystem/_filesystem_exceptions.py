@@ -104,6 +104,25 @@ class FileOnlyActionError(FileError):
         return 'Action performed over "%s" only possible with a file.' % filename
 
 
+
+#===================================================================================================
+# FileLockTimeoutError
+#===================================================================================================
+class FileLockTimeoutError(FileError):
+    def GetMessage(self, filename):
+        return 'Timeout waiting for lock file "%s".' % filename
+
+
+
+#===================================================================================================
+# Md5MismatchError
+#===================================================================================================
+class Md5MismatchError(FileError):
+    def GetMessage(self, filename):
+        return 'Contents of file "%s" don\'t match the md5 file.' % filename
+
+
+
 #===================================================================================================
 # MultipleFilesNotFound
 #===================================================================================================
@@ -0,0 +1,83 @@
+from __future__ import unicode_literals
+from ben10.filesystem import (CreateDirectory, CreateFile, DeleteDirectory, DeleteFile, FileTreeIndex,
+    FindFiles, ListFiles)
+import os
+import pytest
+
+
+
+#===================================================================================================
+# Test
+#===================================================================================================
+class Test(object):
+
+    def testFileTreeIndex(self, embed_data):
+        base_dir = embed_data['tree']
+        CreateFile(embed_data['tree/alpha.py'], contents='')
+        CreateFile(embed_data['tree/alpha.pyc'], contents='')
+        CreateFile(embed_data['tree/A/bravo.py'], contents='')
+        CreateFile(embed_data['tree/A/B/charlie.txt'], contents='')
+        CreateFile(embed_data['tree/.git/HEAD'], contents='')
+
+        index = FileTreeIndex(base_dir)
+
+        def CheckSameAsDisk():
+            for i_args, i_kwargs in [
+                    ((base_dir,), {}),
+                    ((base_dir, ['*.py']), {}),
+                    ((base_dir, ['*'], ['.git', '*.pyc']), {}),
+                    ((embed_data['tree/A'], ['*.py', '*.txt']), {'recursive': False}),
+                    ((base_dir,), {'include_root_dir': False, 'standard_paths': True}),
+                ]:
+                assert index.FindFiles(*i_args, **i_kwargs) == FindFiles(*i_args, **i_kwargs)
+            for i_directory in [base_dir, embed_data['tree/A'], embed_data['tree/missing']]:
+                assert index.ListFiles(i_directory) == ListFiles(i_directory)
+
+        CheckSameAsDisk()
+        found_files = index.FindFiles(in_filters=['*.py'], include_root_dir=False, standard_paths=True)
+        assert sorted(found_files) == [
+            'A/bravo.py',
+            'alpha.py',
+        ]
+        assert index.FindFilesX('+' + base_dir + '/*.py;*.txt;!b*') == [
+            os.path.join(base_dir, 'alpha.py'),
+            os.path.join(base_dir, 'A', 'B', 'charlie.txt'),
+        ]
+        assert index.IsDir(embed_data['tree/A'])
+        assert not index.IsDir(embed_data['tree/alpha.py'])
+        assert not index.IsDir(embed_data['tree/missing'])
+
+        with pytest.raises(ValueError):
+            index.FindFiles(embed_data['other'])
+
+        # Only changed (and racy) directories are listed again
+        index.RACY_SECONDS = -1
+        assert index.Refresh() == 4
+        assert index.Refresh() == 0
+        CreateFile(embed_data['tree/A/B/delta.py'], contents='')
+        DeleteFile(embed_data['tree/alpha.pyc'])
+        CreateDirectory(embed_data['tree/C/D'])
+        DeleteDirectory(embed_data['tree/.git'])
+        os.utime(embed_data['tree/A/B'], (0, 1000))
+        os.utime(base_dir, (0, 1000))
+        assert index.Refresh() == 4  # tree, tree/A/B, tree/C and tree/C/D
+        CheckSameAsDisk()
+
+        # Stored on disk
+        index_filename = embed_data['index/tree.index']
+        index.Save(index_filename)
+        index.Save(index_filename)
+        CreateFile(embed_data['tree/C/echo.py'], contents='')
+        os.utime(embed_data['tree/C'], (0, 1000))
+        loaded = FileTreeIndex.Load(index_filename, base_dir, refresh=False)
+        assert loaded.FindFiles() == index.FindFiles()
+        loaded.RACY_SECONDS = -1
+        assert loaded.Refresh() == 1
+        assert embed_data['tree/C/echo.py'] in loaded.FindFiles()
+
+        # Invalid files (or other directories) index the directory again
+        loaded = FileTreeIndex.Load(index_filename, embed_data['tree/A'])
+        assert loaded.FindFiles() == FindFiles(embed_data['tree/A'])
+        CreateFile(index_filename, contents='invalid')
+        loaded = FileTreeIndex.Load(index_filename, base_dir)
+        assert loaded.FindFiles() == FindFiles(base_dir)
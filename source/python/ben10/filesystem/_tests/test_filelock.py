@@ -0,0 +1,82 @@
+from __future__ import unicode_literals
+from ben10.filesystem import FileLock, FileLockTimeoutError
+import os
+import pytest
+import subprocess
+import sys
+import threading
+
+
+
+#===================================================================================================
+# Test
+#===================================================================================================
+class Test(object):
+
+    def testFileLock(self, embed_data):
+        filename = embed_data['locks/alpha.lock']
+        lock = FileLock(filename)
+        other_lock = FileLock(filename, timeout=0.1)
+
+        assert lock.Acquire()
+        assert lock.IsLocked()
+        assert os.path.isfile(filename)
+
+        assert not other_lock.Acquire(blocking=False)
+        assert not other_lock.Acquire(timeout=0.1)
+        with pytest.raises(FileLockTimeoutError):
+            with other_lock:
+                pass
+
+        # Other processes
+        def IsLockedByOtherProcess():
+            return subprocess.call([
+                sys.executable,
+                '-c',
+                'import sys;from ben10.filesystem import FileLock;'
+                'sys.exit(0 if FileLock(sys.argv[1]).Acquire(blocking=False) else 1)',
+                filename,
+            ]) == 1
+
+        assert IsLockedByOtherProcess()
+        lock.Release()
+        assert not lock.IsLocked()
+        assert not IsLockedByOtherProcess()
+
+        with other_lock:
+            assert other_lock.IsLocked()
+            assert not lock.Acquire(blocking=False)
+        assert not other_lock.IsLocked()
+
+        # Threads using the same instance
+        acquired = []
+        def Acquire():
+            with lock:
+                acquired.append(True)
+
+        with lock:
+            thread = threading.Thread(target=Acquire)
+            thread.start()
+            thread.join(0.2)
+            assert acquired == []
+        thread.join()
+        assert acquired == [True]
+
+
+    @pytest.mark.skipif(sys.platform == 'win32', reason='Shared locks are exclusive on Windows')
+    def testSharedFileLock(self, embed_data):
+        filename = embed_data['locks/alpha.lock']
+        reader = FileLock(filename, shared=True)
+        other_reader = FileLock(filename, shared=True)
+        writer = FileLock(filename)
+
+        assert reader.Acquire()
+        assert other_reader.Acquire(blocking=False)
+        assert not writer.Acquire(blocking=False)
+        reader.Release()
+        assert not writer.Acquire(blocking=False)
+        other_reader.Release()
+
+        assert writer.Acquire(blocking=False)
+        assert not reader.Acquire(blocking=False)
+        writer.Release()
@@ -1,15 +1,16 @@
 # coding: UTF-8
 from __future__ import unicode_literals
 from ben10.filesystem import (AppendToFile, CanonicalPath, CheckIsDir, CheckIsFile, CopyDirectory,
-    CopyFile, CopyFiles, CopyFilesX, CreateDirectory, CreateFile, CreateLink, CreateMD5,
-    CreateTemporaryDirectory, Cwd, DRIVE_FIXED, DRIVE_NO_ROOT_DIR, DRIVE_REMOTE, DeleteDirectory,
-    DeleteFile, DeleteLink, DirectoryAlreadyExistsError, DirectoryNotFoundError, EOL_STYLE_MAC,
-    EOL_STYLE_NONE, EOL_STYLE_UNIX, EOL_STYLE_WINDOWS, ExpandUser, FileAlreadyExistsError,
-    FileError, FileNotFoundError, FileOnlyActionError, GetDriveType, GetFileContents, GetFileLines,
-    GetMTime, IsDir, IsFile, IsLink, ListFiles, ListMappedNetworkDrives, MD5_SKIP, MoveDirectory,
-    MoveFile, NormStandardPath, NormalizePath, NotImplementedForRemotePathError,
-    NotImplementedProtocol, OpenFile, ReadLink, ReplaceInFile, ServerTimeoutError, StandardizePath)
-from ben10.filesystem._filesystem import CreateTemporaryFile, FindFiles
+    CopyFile, CopyFiles, CopyFilesParallel, CopyFilesX, CreateDirectory, CreateFile, CreateLink,
+    CreateMD5, CreateTemporaryDirectory, Cwd, DRIVE_FIXED, DRIVE_NO_ROOT_DIR, DRIVE_REMOTE,
+    DeleteDirectory, DeleteFile, DeleteLink, DirectoryAlreadyExistsError, DirectoryNotFoundError,
+    EOL_STYLE_MAC, EOL_STYLE_NONE, EOL_STYLE_UNIX, EOL_STYLE_WINDOWS, ExpandUser,
+    FileAlreadyExistsError, FileError, FileNotFoundError, FileOnlyActionError, GetDriveType,
+    GetFileContents, GetFileLines, GetMTime, IsDir, IsFile, IsLink, ListFiles,
+    ListMappedNetworkDrives, MD5_SKIP, Md5MismatchError, MoveDirectory, MoveFile, NormStandardPath,
+    NormalizePath, NotImplementedForRemotePathError, NotImplementedProtocol, OpenFile, ReadLink,
+    ReplaceInFile, ServerTimeoutError, StandardizePath, SyncDirectory)
+from ben10.filesystem._filesystem import CreateTemporaryFile, FindFiles, IterFindFiles, MatchMasks
 from ben10.foundation.pushpop import PushPopAttr, PushPopItem
 from mock import patch
 import errno
@@ -132,6 +133,12 @@ class Test:
         CreateMD5(filename)
         assert GetFileContents(filename + '.md5') == '098f6bcd4621d373cade4e832627b4f6'
 
+        # The contents can be written to another file while computing the md5
+        download_filename = embed_data['files/downloaded/ação.txt']
+        CreateMD5(filename, target_filename=download_filename + '.md5', download_filename=download_filename)
+        assert GetFileContents(download_filename) == 'test'
+        assert GetFileContents(download_filename + '.md5') == '098f6bcd4621d373cade4e832627b4f6'
+
 
     def testCopyFileWithMd5(self, embed_data):
         source_filename = embed_data['md5/file']
@@ -194,6 +201,87 @@ class Test:
         assert not os.path.isfile(target_filename_md5)
 
 
+    def testCopyFileComputeMd5(self, embed_data):
+        source_filename = embed_data['md5/file']
+        source_filename_md5 = embed_data['md5/file.md5']
+        target_filename = embed_data['md5/copied_file']
+        target_filename_md5 = embed_data['md5/copied_file.md5']
+
+        def Copy():
+            return CopyFile(source_filename, target_filename, md5_check=True, compute_md5=True)
+
+        # The copied contents match the source md5
+        assert Copy() is None
+        assert GetFileContents(target_filename_md5) == '65fa244213983bd017d7d447bb534248'
+        assert Copy() == MD5_SKIP
+
+        # Without a source md5, no target md5 is created
+        DeleteFile(source_filename_md5)
+        DeleteFile(target_filename_md5)
+        assert Copy() is None
+        assert not os.path.isfile(source_filename_md5)
+        assert not os.path.isfile(target_filename_md5)
+
+        # The contents don't match the source md5: the target md5 is removed, so it's copied again
+        CreateFile(source_filename_md5, contents='00000000000000000000000000000000')
+        with pytest.raises(Md5MismatchError):
+            Copy()
+        assert not os.path.isfile(target_filename_md5)
+
+        # Big files (more than one buffer)
+        big_contents = b''.join(chr(i % 256) for i in xrange(1000)) * 3000
+        big_filename = embed_data['md5/big_file']
+        CreateFile(big_filename, big_contents, binary=True)
+        CreateMD5(big_filename)
+        CopyFile(big_filename, embed_data['md5/big_file_copy'], md5_check=True, compute_md5=True)
+        assert GetFileContents(embed_data['md5/big_file_copy'], binary=True) == big_contents
+
+
+    def testCopyFilesParallel(self, embed_data, monkeypatch):
+        source_dir = embed_data['complex_tree']
+        target_dir = embed_data['target_dir']
+
+        CopyFiles(source_dir, target_dir, create_target_dir=True, max_jobs=4)
+        assert FindFiles(target_dir, standard_paths=True) == [
+            i.replace(source_dir, target_dir) for i in FindFiles(source_dir, standard_paths=True)
+        ]
+
+        copied_files = CopyFilesX([(embed_data['target_x'], '+' + source_dir + '/*')], max_jobs=4)
+        assert len(copied_files) == 5
+        for i_source_filename, i_target_filename in copied_files:
+            embed_data.AssertEqualFiles(i_source_filename, i_target_filename)
+
+        # With md5_check, md5 files listed together with their files are copied only once (by the
+        # copy of the file)
+        CreateFile(embed_data['md5_pair/file'], 'contents')
+        CreateMD5(embed_data['md5_pair/file'])
+        CreateDirectory(embed_data['md5_pair_copy'])
+        copied = []
+        original_copy_file = CopyFile
+        def RecordingCopyFile(source_filename, target_filename, **kwargs):
+            copied.append(os.path.basename(target_filename))
+            return original_copy_file(source_filename, target_filename, **kwargs)
+        files = [
+            (embed_data['md5_pair/file'], embed_data['md5_pair_copy/file']),
+            (embed_data['md5_pair/file.md5'], embed_data['md5_pair_copy/file.md5']),
+        ]
+        import ben10.filesystem._filesystem
+        monkeypatch.setattr(ben10.filesystem._filesystem, 'CopyFile', RecordingCopyFile)
+        CopyFilesParallel(files, max_jobs=2, md5_check=True)
+        monkeypatch.undo()
+        assert copied == ['file']
+        embed_data.AssertEqualFiles(embed_data['md5_pair/file.md5'], embed_data['md5_pair_copy/file.md5'])
+
+        # Errors are raised after the running copies finish
+        files = [
+            (embed_data['complex_tree/subdir_1/subsubdir_1/1.1.1'], embed_data['parallel/1']),
+            (embed_data['INEXISTENT_FILE'], embed_data['parallel/2']),
+        ]
+        CreateDirectory(embed_data['parallel'])
+        with pytest.raises(FileNotFoundError):
+            CopyFilesParallel(files, max_jobs=2)
+
+
     def testCopyFilesX(self, embed_data):
         base_dir = embed_data['complex_tree'] + '/'
 
@@ -342,6 +430,123 @@ class Test:
             CopyFiles(embed_data['source'], 'ERROR://target')
 
 
+    def testSyncDirectory(self, embed_data):
+        source_dir = embed_data['complex_tree']
+        target_dir = embed_data['sync']
+
+        def Sync(**kwargs):
+            result = SyncDirectory(source_dir, target_dir, **kwargs)
+            return (
+                result.copied_files,
+                result.deleted_files,
+                result.deleted_dirs,
+                result.unchanged_count,
+                result.bytes_copied,
+            )
+
+        all_files = [
+            '1',
+            '2',
+            'subdir_1/subsubdir_1/1.1.1',
+            'subdir_1/subsubdir_1/1.1.2',
+            'subdir_2/2.1',
+        ]
+        all_bytes = sum(os.path.getsize(embed_data['complex_tree/' + i]) for i in all_files)
+        assert Sync() == (all_files, [], [], 0, all_bytes)
+        assert FindFiles(target_dir, include_root_dir=False, standard_paths=True) == \
+            FindFiles(source_dir, include_root_dir=False, standard_paths=True)
+
+        # Nothing changed
+        assert Sync() == ([], [], [], 5, 0)
+
+        # Changed, new and extra files
+        CreateFile(embed_data['complex_tree/2'], contents='changed')
+        os.utime(embed_data['complex_tree/2'], (0, 1000))
+        CreateFile(embed_data['complex_tree/subdir_2/new'], contents='new')
+        CreateFile(embed_data['sync/extra'], contents='extra')
+        CreateFile(embed_data['sync/extra_dir/extra.pyc'], contents='extra')
+        assert Sync() == (['2', 'subdir_2/new'], [], [], 4, len('changed') + len('new'))
+        assert GetFileContents(embed_data['sync/2']) == 'changed'
+        assert os.path.getmtime(embed_data['sync/2']) == 1000
+
+        # Extra files are deleted (except the ones ignored by the filters)
+        assert Sync(delete=True, out_filters=['*.pyc']) == ([], ['extra'], [], 6, 0)
+        assert os.path.isfile(embed_data['sync/extra_dir/extra.pyc'])
+        assert Sync(delete=True) == ([], ['extra_dir/extra.pyc'], ['extra_dir'], 6, 0)
+        assert not os.path.isdir(embed_data['sync/extra_dir'])
+
+        # Only files matching the filters
+        CreateFile(embed_data['complex_tree/1'], contents='changed')
+        CreateFile(embed_data['complex_tree/subdir_2/2.1'], contents='changed')
+        assert Sync(in_filters=['2.*'])[0] == ['subdir_2/2.1']
+        assert Sync()[0] == ['1']
+
+        # Same size and modification time: only found comparing the contents
+        stat = os.stat(embed_data['complex_tree/1'])
+        CreateFile(embed_data['complex_tree/1'], contents='CHANGED')
+        os.utime(embed_data['complex_tree/1'], (stat.st_atime, stat.st_mtime))
+        assert Sync()[0] == []
+        assert Sync(compare_contents=True, max_jobs=2)[0] == ['1']
+        assert GetFileContents(embed_data['sync/1']) == 'CHANGED'
+
+        # Files replaced by directories (and the other way around)
+        DeleteDirectory(embed_data['complex_tree/subdir_2'])
+        CreateFile(embed_data['complex_tree/subdir_2'], contents='file')
+        DeleteFile(embed_data['complex_tree/1'])
+        CreateFile(embed_data['complex_tree/1/file'], contents='file')
+        assert Sync()[0] == ['1/file', 'subdir_2']
+        assert GetFileContents(embed_data['sync/subdir_2']) == 'file'
+
+        with pytest.raises(DirectoryNotFoundError):
+            SyncDirectory(embed_data['INEXISTENT_DIR'], target_dir)
+
+
+    @pytest.mark.symlink
+    def testSyncDirectoryLinks(self, embed_data):
+        source_dir = embed_data['complex_tree']
+        target_dir = embed_data['sync']
+
+        # Linked directories in the source are copied as real directories
+        CreateLink('subdir_2', embed_data['complex_tree/linked_dir'])
+        CreateLink('..', embed_data['complex_tree/subdir_2/parent'])
+        result = SyncDirectory(source_dir, target_dir)
+        assert result.copied_files == [
+            '1',
+            '2',
+            'linked_dir/2.1',
+            'subdir_1/subsubdir_1/1.1.1',
+            'subdir_1/subsubdir_1/1.1.2',
+            'subdir_2/2.1',
+        ]
+        assert not IsLink(embed_data['sync/linked_dir'])
+        embed_data.AssertEqualFiles(
+            embed_data['complex_tree/subdir_2/2.1'],
+            embed_data['sync/linked_dir/2.1'],
+        )
+        assert not os.path.exists(embed_data['sync/subdir_2/parent'])
+
+        # Changes in linked directories are synchronized
+        CreateFile(embed_data['complex_tree/subdir_2/new'], contents='new')
+        assert SyncDirectory(source_dir, target_dir).copied_files == ['linked_dir/new', 'subdir_2/new']
+
+        # Links in the target are replaced, instead of copying files into the linked directory
+        DeleteDirectory(embed_data['sync/subdir_1'])
+        CreateDirectory(embed_data['outside'])
+        CreateLink(embed_data['outside'], embed_data['sync/subdir_1'])
+        CreateFile(embed_data['outside/2'], contents='outside')
+        DeleteFile(embed_data['sync/2'])
+        CreateLink(embed_data['outside/2'], embed_data['sync/2'])
+        assert SyncDirectory(source_dir, target_dir).copied_files == [
+            '2',
+            'subdir_1/subsubdir_1/1.1.1',
+            'subdir_1/subsubdir_1/1.1.2',
+        ]
+        assert not IsLink(embed_data['sync/subdir_1'])
+        assert not IsLink(embed_data['sync/2'])
+        assert os.listdir(embed_data['outside']) == ['2']
+        assert GetFileContents(embed_data['outside/2']) == 'outside'
+
+
     @pytest.mark.symlink
     def testCopyFileSymlink(self, embed_data):
         # Create a file
@@ -995,6 +1200,27 @@ class Test:
         assert GetFileContents(filename) == 'Hello, world!'
 
 
+    def testCreateMD5FromUrl(self, embed_data):
+        import hashlib
+
+        # A "file:" url is read through urllib, like the other remote files (in chunks).
+        source_filename = embed_data['testCreateMD5FromUrl_source.txt']
+        contents = b''.join(b'%07d\n' % i for i in xrange(300000))  # Larger than a chunk
+        CreateFile(source_filename, contents, binary=True)
+        source_url = 'file:' + urllib.pathname2url(os.path.abspath(source_filename))
+
+        filename = embed_data['testCreateMD5FromUrl.txt']
+        CreateMD5(source_url, target_filename=filename + '.md5', download_filename=filename)
+        assert GetFileContents(filename, binary=True) == contents
+        assert GetFileContents(filename + '.md5') == hashlib.md5(contents).hexdigest()
+
+        # Without download_filename, only the md5 file is written.
+        other_filename = embed_data['testCreateMD5FromUrl_other.txt']
+        CreateMD5(source_url, target_filename=other_filename + '.md5')
+        assert not os.path.exists(other_filename)
+        assert GetFileContents(other_filename + '.md5') == hashlib.md5(contents).hexdigest()
+
+
     def testListMappedNetworkDrives(self, embed_data, monkeypatch):
         if sys.platform != 'win32':
             return
@@ -1161,6 +1387,164 @@ class Test:
         Compare(found_files, assert_found_files)
 
 
+    def testIterFindFiles(self, embed_data):
+        base_dir = embed_data['complex_tree']
+
+        # Same results (and order) as os.walk
+        expected = []
+        for dir_root, directories, filenames in os.walk(base_dir):
+            expected += [os.path.join(dir_root, i) for i in directories + filenames]
+        found_files = IterFindFiles(base_dir)
+        assert not isinstance(found_files, list)
+        assert list(found_files) == expected == FindFiles(base_dir)
+
+        # Many masks, matched like fnmatch
+        found_files = FindFiles(
+            base_dir,
+            ['2*', '1.1.?'],
+            ['*.2'],
+            include_root_dir=False,
+            standard_paths=True,
+        )
+        assert sorted(found_files) == [
+            '2',
+            'subdir_1/subsubdir_1/1.1.1',
+            'subdir_2/2.1',
+        ]
+        assert MatchMasks('1.1.1', ['2*', '1.1.?'])
+        assert MatchMasks('1.1.1', '*')
+        assert not MatchMasks('1.1.1', [])
+        assert not MatchMasks('1.1.10', ['2*', '1.1.?'])
+
+        # Filenames are normalized like the masks (as fnmatch does)
+        import ntpath
+        from ben10.filesystem import _filesystem
+        with PushPopAttr(os.path, 'normcase', ntpath.normcase):
+            with PushPopAttr(_filesystem, '_compiled_masks', {}):
+                assert MatchMasks('Subdir_1/1.1.1', ['subdir_1/*'])
+                assert MatchMasks('subdir_1\\1.1.1', ['SUBDIR_1/*'])
+                assert not MatchMasks('subdir_2/1.1.1', ['subdir_1/*'])
+
+        # Directories matching out_filters are not listed
+        listed = []
+        original_scandir = _filesystem._GetScandir()
+        def Scandir(directory):
+            listed.append(os.path.relpath(directory, base_dir).replace(os.sep, '/'))
+            return original_scandir(directory)
+        with PushPopAttr(_filesystem, '_GetScandir', lambda: Scandir):
+            found_files = FindFiles(base_dir, out_filters=['subdir_1'], include_root_dir=False)
+        assert sorted(found_files) == ['1', '2', 'subdir_2', os.path.join('subdir_2', '2.1')]
+        assert listed == ['.', 'subdir_2']
+
+
+    def testMatchMasksPerformance__flaky(self):
+        '''
+        Matching many filenames against a few masks: MatchMasks (a single cached regular expression)
+        must be faster than calling fnmatch.fnmatch for each mask.
+        '''
+        from ben10.foundation.odict import odict
+        from textwrap import dedent
+        import timeit
+
+        repeat = 3
+        number = 1
+        timing = odict()
+
+        setup = dedent(
+            '''
+            from ben10.filesystem._filesystem import MatchMasks
+            import fnmatch
+            masks = ['*.pyc', '*.pyo', '.svn', '.git', '*.tmp', '*~']
+            filenames = ['file_%d.%s' % (i, ext) for i in xrange(5000) for ext in ('py', 'txt', 'tmp')]
+            '''
+        )
+
+        def Check(name, stmt):
+            timer = timeit.Timer(setup=setup, stmt=dedent(stmt))
+            timing[name] = min(timer.repeat(repeat=repeat, number=number))
+
+        Check(
+            'fnmatch',
+            '''
+            for filename in filenames:
+                any(fnmatch.fnmatch(filename, mask) for mask in masks)
+            '''
+        )
+        Check(
+            'match_masks',
+            '''
+            for filename in filenames:
+                MatchMasks(filename, masks)
+            '''
+        )
+
+        PRINT_PERFORMANCE = False
+        if PRINT_PERFORMANCE:
+            print 'MatchMasks is %.1f times faster than fnmatch.' % (timing['fnmatch'] / timing['match_masks'])
+
+        assert timing['match_masks'] < timing['fnmatch']
+
+
+    def testFindFilesPerformance__flaky(self, embed_data):
+        '''
+        Finding files in a large tree: FindFiles (scandir and precompiled masks) must not be slower
+        than the previous implementation (os.walk and fnmatch.fnmatch for each mask).
+
+        Scaled down from the 100k files benchmark (10k files in 100 directories).
+        '''
+        from ben10.foundation.odict import odict
+        import fnmatch
+        import timeit
+
+        base_dir = embed_data['large_tree']
+        for i in xrange(100):
+            directory = os.path.join(base_dir, 'dir_%d' % i, 'sub_%d' % (i % 10))
+            os.makedirs(directory)
+            for j in xrange(100):
+                extension = ('py', 'pyc', 'txt', 'tmp')[j % 4]
+                with open(os.path.join(directory, 'file_%d.%s' % (j, extension)), 'w'):
+                    pass
+
+        in_filters = ['*.py', '*.txt', 'sub_*']
+        out_filters = ['*.pyc', '*.tmp', 'dir_5*']
+
+        def OldMatchMasks(filename, masks):
+            for i_mask in masks:
+                if fnmatch.fnmatch(filename, i_mask):
+                    return True
+            return False
+
+        def OldFindFiles(dir_):
+            result = []
+            for dir_root, directories, filenames in os.walk(dir_):
+                for i_directory in directories[:]:
+                    if OldMatchMasks(i_directory, out_filters):
+                        directories.remove(i_directory)
+
+                for filename in directories + filenames:
+                    if OldMatchMasks(filename, in_filters) and \
+                            not OldMatchMasks(filename, out_filters):
+                        result.append(os.path.join(dir_root, filename))
+            return result
+
+        def NewFindFiles(dir_):
+            return FindFiles(dir_, in_filters=in_filters, out_filters=out_filters)
+
+        assert NewFindFiles(base_dir) == OldFindFiles(base_dir)
+
+        repeat = 3
+        number = 1
+        timing = odict()
+        for name, find_files in [('os_walk', OldFindFiles), ('find_files', NewFindFiles)]:
+            timer = timeit.Timer(lambda: find_files(base_dir))
+            timing[name] = min(timer.repeat(repeat=repeat, number=number))
+
+        PRINT_PERFORMANCE = False
+        if PRINT_PERFORMANCE:
+            print 'FindFiles is %.1f times faster than os.walk.' % (timing['os_walk'] / timing['find_files'])
+
+        assert timing['find_files'] <= timing['os_walk']
+
 
     @pytest.mark.parametrize(('env_var',), [('ascii',), ('nót-ãscii',), ('кодирование',)])
     def testExpandUser(self, env_var):
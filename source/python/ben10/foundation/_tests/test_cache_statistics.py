@@ -0,0 +1,191 @@
+from __future__ import unicode_literals
+from ben10.foundation.cache_statistics import (EnableCacheStatistics, FormatCacheStatistics,
+    GetCacheStatistics, IsCacheStatisticsEnabled, RegisterCache, UnregisterCache)
+from ben10.foundation.cached_method import (AttributeBasedCachedMethod, CachedMethod,
+    LastResultCachedMethod)
+from ben10.foundation.lru import LRU
+from ben10.foundation.memoize import Memoize
+import json
+import pytest
+
+
+
+#===================================================================================================
+# Test
+#===================================================================================================
+@pytest.mark.usefixtures('cache_statistics')
+class Test(object):
+
+    def _GetStatistics(self, cache):
+        for statistics in GetCacheStatistics():
+            if statistics['kind'] == cache.__class__.__name__ \
+                and statistics == dict(cache.GetCacheStatistics(), kind=statistics['kind']):
+                return statistics
+        return None
+
+
+    def testDisabledStatistics(self):
+        EnableCacheStatistics(False)
+        assert not IsCacheStatisticsEnabled()
+
+        @Memoize(2, Memoize.LRU)
+        def Double(x):
+            return x * 2
+
+        Double(1)
+        Double(1)
+        lru = LRU(2)
+
+        # Caches created while the statistics are disabled are not registered (nor counted).
+        assert [i for i in GetCacheStatistics() if i['name'] == '%s.Double' % (__name__,)] == []
+        assert self._GetStatistics(lru) is None
+        assert Double.ClearCache.__self__.__class__ is LRU  # Not wrapped to count the calls
+
+        assert EnableCacheStatistics() == False
+        assert IsCacheStatisticsEnabled()
+
+
+    def testMemoizeStatistics(self):
+
+        @Memoize(2, Memoize.LRU)
+        def Double(x):
+            return x * 2
+
+        Double(1)
+        Double(1)
+        Double(2)
+        Double(3)
+
+        statistics = [
+            i for i in GetCacheStatistics()
+            if i['name'] == '%s.Double' % (__name__,) and i['kind'] == 'Memoize'
+        ]
+        assert len(statistics) == 1
+        statistics = statistics[0]
+        assert statistics['hits'] == 1
+        assert statistics['misses'] == 3
+        assert statistics['evictions'] == 1
+        assert statistics['size'] == 2
+        assert statistics['memory'] > 0
+
+        # The LRU used internally is reported by the Memoize.
+        assert not [i for i in GetCacheStatistics() if i['kind'] == 'LRU' and i['size'] == 2]
+
+
+    def testMemoizeInstanceMethodStatistics(self):
+
+        class Foo(object):
+
+            @Memoize(1)
+            def Triple(self, x):
+                return x * 3
+
+        foo = Foo()
+        foo.Triple(1)
+        foo.Triple(1)
+        foo.Triple(2)
+        Foo().Triple(1)  # Instance is collected right away (and its cache with it)
+
+        statistics = [
+            i for i in GetCacheStatistics()
+            if i['name'] == '%s.Triple' % (__name__,) and i['kind'] == 'Memoize'
+        ]
+        assert len(statistics) == 1
+        statistics = statistics[0]
+        assert statistics['hits'] == 1
+        assert statistics['misses'] == 3
+        assert statistics['evictions'] == 1
+        assert statistics['size'] == 1
+
+
+    def testLRUStatistics(self):
+        lru = LRU(2)
+        lru[1] = 1
+        lru[2] = 2
+        lru[3] = 3
+        lru.get(1)
+        lru.get(2)
+        with pytest.raises(KeyError):
+            lru[1]
+        lru[3]
+
+        # Hits and misses are not counted by the LRU (only by its users, like Memoize).
+        statistics = self._GetStatistics(lru)
+        assert statistics['kind'] == 'LRU'
+        assert statistics['hits'] is None
+        assert statistics['misses'] is None
+        assert statistics['evictions'] == 1
+        assert statistics['size'] == 2
+
+        UnregisterCache(lru)
+        assert self._GetStatistics(lru) is None
+        RegisterCache(lru)
+        assert self._GetStatistics(lru) is not None
+
+        # Only weak references are kept in the registry.
+        count = len(GetCacheStatistics())
+        del lru
+        assert len(GetCacheStatistics()) == count - 1
+
+
+    def testCachedMethodStatistics(self):
+
+        class Foo(object):
+            def __init__(self):
+                self.x = 1
+
+            def Method(self, value):
+                return value
+
+        foo = Foo()
+        cached_method = CachedMethod(foo.Method)
+        cached_method(1)
+        cached_method(1)
+        cached_method(2)
+        statistics = self._GetStatistics(cached_method)
+        assert statistics['name'] == 'Foo.Method'
+        assert (statistics['hits'], statistics['misses'], statistics['size']) == (1, 2, 2)
+
+        last_result = LastResultCachedMethod(foo.Method)
+        assert self._GetStatistics(last_result)['size'] == 0
+        last_result(1)
+        last_result(2)
+        assert self._GetStatistics(last_result)['size'] == 1
+
+        attribute_based = AttributeBasedCachedMethod(foo.Method, 'x', cache_size=1)
+        attribute_based(1)
+        foo.x = 2
+        attribute_based(1)
+        statistics = self._GetStatistics(attribute_based)
+        assert (statistics['misses'], statistics['evictions'], statistics['size']) == (2, 1, 1)
+
+
+    def testFormatCacheStatistics(self):
+        lru = LRU(2)
+        lru[1] = 1
+
+        table = FormatCacheStatistics()
+        lines = table.splitlines()
+        assert lines[0].split() == ['kind', 'name', 'hits', 'misses', 'evictions', 'size', 'memory']
+        assert len(lines) == len(GetCacheStatistics()) + 1
+        assert ['LRU', '-', '-', '0', '1'] in [i.split()[:5] for i in lines]
+
+        statistics = json.loads(FormatCacheStatistics('json'))
+        assert statistics == GetCacheStatistics()
+
+        with pytest.raises(ValueError):
+            FormatCacheStatistics('unknown')
+
+
+
+#===================================================================================================
+# cache_statistics
+#===================================================================================================
+@pytest.yield_fixture
+def cache_statistics():
+    '''
+    Enables the cache statistics (disabled by default) during the test.
+    '''
+    enabled = EnableCacheStatistics()
+    yield
+    EnableCacheStatistics(enabled)
@@ -0,0 +1,108 @@
+from __future__ import unicode_literals
+from ben10.foundation.disk_cache import DiskCache
+import io
+import os
+import pytest
+
+
+
+#===================================================================================================
+# Test
+#===================================================================================================
+class Test(object):
+
+    def testDiskCache(self, embed_data):
+        directory = embed_data['cache']
+        disk_cache = DiskCache(directory)
+        assert disk_cache.Get('alpha', (1, 'a')) is None
+        assert disk_cache.Get('alpha', (1, 'a'), default=0) == 0
+
+        disk_cache.Set('alpha', (1, 'a'), ['value'])
+        assert disk_cache.Get('alpha', (1, 'a')) == ['value']
+        assert disk_cache.Get('bravo', (1, 'a')) is None
+
+        # Another instance (i.e.: another process) has access to the same entries.
+        assert DiskCache(directory).Get('alpha', (1, 'a')) == ['value']
+
+        disk_cache.Set('alpha', (1, 'a'), ['other value'])
+        assert disk_cache.Get('alpha', (1, 'a')) == ['other value']
+        assert [i for i in os.listdir(os.path.join(directory, 'alpha')) if i.endswith('.tmp')] == []
+
+        disk_cache.Set('bravo', 'key', 'bravo value')
+        disk_cache.Remove('alpha', (1, 'a'))
+        assert disk_cache.Get('alpha', (1, 'a')) is None
+        assert disk_cache.Get('bravo', 'key') == 'bravo value'
+
+        disk_cache.Set('alpha', 'key', 'alpha value')
+        disk_cache.Clear('alpha')
+        assert disk_cache.Get('alpha', 'key') is None
+        assert disk_cache.Get('bravo', 'key') == 'bravo value'
+
+        disk_cache.Clear()
+        assert disk_cache.Get('bravo', 'key') is None
+        assert disk_cache.GetTotalBytes() == 0
+
+        with pytest.raises(ValueError):
+            DiskCache(directory, validate='invalid')
+
+
+    def testDiskCacheCorruptedEntry(self, embed_data):
+        disk_cache = DiskCache(embed_data['cache'])
+        disk_cache.Set('alpha', 'key', 'value')
+
+        filename = disk_cache._GetEntryFilename('alpha', 'key')
+        with io.open(filename, 'wb') as stream:
+            stream.write(b'corrupted')
+
+        assert disk_cache.Get('alpha', 'key') is None
+        assert not os.path.exists(filename)
+
+
+    @pytest.mark.parametrize('validate', [DiskCache.VALIDATE_MTIME, DiskCache.VALIDATE_CONTENTS])
+    def testDiskCacheDependencies(self, embed_data, validate):
+        disk_cache = DiskCache(embed_data['cache'], validate=validate)
+        dependency = embed_data['dependency.txt']
+        with io.open(dependency, 'wb') as stream:
+            stream.write(b'contents')
+
+        disk_cache.Set('alpha', 'key', 'value', dependencies=[dependency])
+        assert disk_cache.Get('alpha', 'key', dependencies=[dependency]) == 'value'
+
+        with io.open(dependency, 'wb') as stream:
+            stream.write(b'changed contents')
+        assert disk_cache.Get('alpha', 'key', dependencies=[dependency]) is None
+
+        disk_cache.Set('alpha', 'key', 'value', dependencies=[dependency])
+        os.remove(dependency)
+        assert disk_cache.Get('alpha', 'key', dependencies=[dependency]) is None
+
+
+    def testDiskCachePrune(self, embed_data):
+        import time
+
+        disk_cache = DiskCache(embed_data['cache'])
+        value = 'x' * 1000
+        for i in xrange(3):
+            disk_cache.Set('alpha', i, value)
+
+        # Entries are removed according to their last access (mtime).
+        now = time.time()
+        for i, access_time in ((0, now - 10), (1, now - 30), (2, now - 20)):
+            filename = disk_cache._GetEntryFilename('alpha', i)
+            os.utime(filename, (access_time, access_time))
+
+        entry_size = disk_cache.GetTotalBytes() // 3
+        disk_cache.max_bytes = entry_size * 2
+        disk_cache.Prune()
+        assert disk_cache.Get('alpha', 0) == value
+        assert disk_cache.Get('alpha', 1) is None
+        assert disk_cache.Get('alpha', 2) == value
+
+        for i, access_time in ((0, now - 20), (2, now - 10)):
+            filename = disk_cache._GetEntryFilename('alpha', i)
+            os.utime(filename, (access_time, access_time))
+        disk_cache.Set('alpha', 3, value)
+        assert disk_cache.Get('alpha', 0) is None
+        assert disk_cache.Get('alpha', 2) == value
+        assert disk_cache.Get('alpha', 3) == value
+        assert disk_cache.GetTotalBytes() <= disk_cache.max_bytes
@@ -1,6 +1,8 @@
 from __future__ import unicode_literals
 from StringIO import StringIO
-from ben10.foundation.hash import DumpDirHashToStringIO, GetRandomHash, IterHashes, Md5Hex
+from ben10.foundation.hash import (DumpDirHashToStringIO, GetRandomHash, HashCache, HashFile,
+    HashStream, HashTree, IterHashes, Md5Hex)
+import os
 import pytest
 
 
@@ -82,5 +84,118 @@ class Test:
         )
 
 
+    def testHashTree(self, embed_data):
+        directory = embed_data.GetDataDirectory()
+        os.mkdir(embed_data['sub'])
+        with open(embed_data['sub/file3.txt'], 'wb') as stream:
+            stream.write(b'file3' * 500000)  # Bigger than the buffer
+
+        hashes = HashTree(directory)
+        assert hashes.items() == [
+            ('file1.txt', '4124bc0a9335c27f086f24ba207a4912'),
+            ('file2.txt', '633de4b0c14ca52ea2432a3c8a5c4c31'),
+            ('sub/file3.txt', Md5Hex(contents=b'file3' * 500000)),
+        ]
+        assert HashTree(directory, max_jobs=1) == hashes
+        assert HashTree(directory, recursive=False).keys() == ['file1.txt', 'file2.txt']
+        assert HashTree(directory, include='*3.txt').keys() == ['sub/file3.txt']
+
+        import hashlib
+        assert HashTree(directory, algorithm='sha256')['sub/file3.txt'] == \
+            hashlib.sha256(b'file3' * 500000).hexdigest()
+        assert HashFile(embed_data['file1.txt'], 'sha1') == hashlib.sha1(b'aa').hexdigest()
+        with pytest.raises(ValueError):
+            HashFile(embed_data['file1.txt'], 'unknown')
+
+        stringio = StringIO()
+        DumpDirHashToStringIO(directory, stringio, 'bin', recursive=True, max_jobs=2)
+        assert sorted(stringio.getvalue().splitlines()) == [
+            'bin/file1.txt=4124bc0a9335c27f086f24ba207a4912',
+            'bin/file2.txt=633de4b0c14ca52ea2432a3c8a5c4c31',
+            'bin/sub/file3.txt=' + hashes['sub/file3.txt'],
+        ]
+
+
+    def testHashCache(self, embed_data, monkeypatch, tmpdir):
+        import ben10.foundation.hash
+        directory = embed_data.GetDataDirectory()
+        cache_filename = unicode(tmpdir.join('cache', 'hashes.cache'))
+        for i_filename in ['file1.txt', 'file2.txt']:
+            os.utime(embed_data[i_filename], (0, 1000))
+
+        hashed = []
+        original_hash_file = ben10.foundation.hash.HashFile
+        def HashFile(filename, algorithm='md5'):
+            hashed.append((os.path.basename(filename), algorithm))
+            return original_hash_file(filename, algorithm)
+        monkeypatch.setattr(ben10.foundation.hash, 'HashFile', HashFile)
+
+        cache = HashCache(cache_filename)
+        hashes = HashTree(directory, cache=cache)
+        assert sorted(hashed) == [('file1.txt', 'md5'), ('file2.txt', 'md5')]
+        cache.Save()
+        assert os.path.isfile(cache_filename)
+
+        # Unchanged files are not read again (also in other processes, with the saved cache)
+        del hashed[:]
+        assert HashTree(directory, cache=HashCache(cache_filename)) == hashes
+        assert hashed == []
+
+        # Changed files and other algorithms
+        with open(embed_data['file1.txt'], 'wb') as stream:
+            stream.write(b'changed')
+        os.utime(embed_data['file1.txt'], (0, 2000))
+        assert HashTree(directory, cache=cache)['file1.txt'] == Md5Hex(contents=b'changed')
+        HashTree(directory, algorithm='sha1', cache=cache)
+        assert sorted(hashed) == [('file1.txt', 'md5'), ('file1.txt', 'sha1'), ('file2.txt', 'sha1')]
+        assert len(cache) == 4
+
+        # Files just modified are not cached
+        with open(embed_data['file2.txt'], 'wb') as stream:
+            stream.write(b'just changed')
+        del hashed[:]
+        HashTree(directory, cache=cache)
+        HashTree(directory, cache=cache)
+        assert hashed == [('file2.txt', 'md5'), ('file2.txt', 'md5')]
+
+        # Entries of removed files are dropped (only for the directory listed)
+        cache.Set('/other/file.txt', os.stat(embed_data['file1.txt']), 'md5', 'digest')
+        assert len(cache) == 5
+        os.remove(embed_data['file1.txt'])
+        HashTree(directory, cache=cache)
+        assert len(cache) == 3
+        cache.Save()
+        assert set(HashCache(cache_filename)._entries) == set([
+            ('/other/file.txt', 'md5'),
+            (os.path.abspath(embed_data['file2.txt']), 'md5'),
+            (os.path.abspath(embed_data['file2.txt']), 'sha1'),
+        ])
+
+        # Invalid files are ignored
+        with open(cache_filename, 'wb') as stream:
+            stream.write(b'invalid')
+        assert len(HashCache(cache_filename)) == 0
+
+
     def testMd5Hex(self):
         assert Md5Hex(contents='alpha, bravo') == '2c0d78abb6e32d1614a17c6d0e4391c0'
+
+        import io
+        assert Md5Hex(stream=io.BytesIO(b'alpha, bravo')) == '2c0d78abb6e32d1614a17c6d0e4391c0'
+
+
+    def testHashStream(self):
+        import hashlib
+        import io
+
+        contents = b'alpha, bravo' * 200000  # Bigger than the buffer
+        read_sizes = []
+        class Stream(io.BytesIO):
+            def read(self, size=-1):
+                read_sizes.append(size)
+                return io.BytesIO.read(self, size)
+
+        tee = io.BytesIO()
+        assert HashStream(Stream(contents), 'sha256', tee=tee) == hashlib.sha256(contents).hexdigest()
+        assert tee.getvalue() == contents
+        assert read_sizes and all(0 < i <= 1024 * 1024 for i in read_sizes)
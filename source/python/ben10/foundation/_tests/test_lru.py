@@ -1,5 +1,5 @@
 from __future__ import unicode_literals
-from ben10.foundation.lru import LRU, LRUWithRemovalMemo, _DictWithRemovalMemo, _Node
+from ben10.foundation.lru import HeapLRU, LRU, LRUWithRemovalMemo, _DictWithRemovalMemo, _Node
 import pytest
 
 
@@ -195,6 +195,213 @@ class Test:
         assert 1 in lru
         assert 2 in lru
 
+
+    def testLRUMatchesHeapLRU(self):
+        from random import Random
+        r = Random(1)
+
+        def GetSize(obj):
+            return obj % 3 + 1
+
+        lru = LRU(20, get_size=GetSize)
+        heap_lru = HeapLRU(20, get_size=GetSize)
+        for _i in xrange(5000):
+            key = r.randint(0, 30)
+            op = r.randint(0, 3)
+            if op == 0:
+                assert lru.get(key) == heap_lru.get(key)
+            elif op == 1:
+                assert lru.pop(key, None) == heap_lru.pop(key, None)
+            else:
+                value = r.randint(0, 100)
+                lru[key] = value
+                heap_lru[key] = value
+
+            assert lru._currsize == heap_lru._currsize
+            assert lru.keys() == heap_lru.keys()
+            assert lru.values() == heap_lru.values()
+
+
+    def testLRUWithRemovalMemoOnReplace(self):
+        lru = LRUWithRemovalMemo(3)
+        lru[1] = 1
+        lru[2] = 2
+        lru[3] = 3
+        assert lru[1] == 1  # 1 is now the most recently used
+        lru[4] = 4
+        assert lru.GetAndClearRemovedItems() == [2]
+        assert lru.keys() == [3, 1, 4]
+
+
+    def testPerformance__flaky(self):
+        '''
+        Mixed read/write load (each eviction happens after reads) with a big cache: the HeapLRU
+        has to heapify the whole heap on each eviction.
+        '''
+        from ben10.foundation.odict import odict
+        from textwrap import dedent
+        import timeit
+
+        repeat = 3
+        number = 1
+        timing = odict()
+
+        def Check(name, lru_class):
+            timer = timeit.Timer(
+                setup=dedent(
+                    '''
+                    from ben10.foundation.lru import %s
+                    lru = %s(5000)
+                    for i in xrange(5000):
+                        lru[i] = i
+                    ''' % (lru_class, lru_class)
+                ),
+                stmt=dedent(
+                    '''
+                    for i in xrange(5000, 5300):
+                        lru[i - 2500]
+                        lru[i] = i
+                    '''
+                ),
+            )
+            timing[name] = min(timer.repeat(repeat=repeat, number=number))
+
+        Check('heap_lru', 'HeapLRU')
+        Check('lru', 'LRU')
+
+        PRINT_PERFORMANCE = False
+        if PRINT_PERFORMANCE:
+            print 'HeapLRU is %.1f times slower than LRU.' % (timing['heap_lru'] / timing['lru'])
+
+        assert timing['lru'] < timing['heap_lru']
+
+
+    def testConcurrentLRU(self):
+        from ben10.foundation.lru import ConcurrentLRU
+
+        with pytest.raises(ValueError):
+            ConcurrentLRU(0)
+        with pytest.raises(ValueError):
+            ConcurrentLRU(10, segments=0)
+
+        lru = ConcurrentLRU(4, segments=2)
+        assert len(lru) == 0
+
+        lru[0] = 'zero'
+        lru[1] = 'one'
+        assert lru[0] == 'zero'
+        assert lru.get(1) == 'one'
+        assert lru.get(2) is None
+        with pytest.raises(KeyError):
+            lru[2]
+        assert 0 in lru
+        assert 2 not in lru
+        assert sorted(lru.keys()) == [0, 1]
+        assert lru.GetStatistics() == dict(hits=2, misses=2, evictions=0, size=2)
+
+        # Each segment has a capacity of 2 (ints are sharded by their value).
+        lru[2] = 'two'
+        lru[4] = 'four'
+        assert 0 not in lru
+        assert sorted(lru.keys()) == [1, 2, 4]
+        assert lru.GetStatistics()['evictions'] == 1
+
+        assert lru.pop(1) == 'one'
+        assert lru.pop(1, None) is None
+        with pytest.raises(KeyError):
+            lru.pop(1)
+        del lru[2]
+        assert lru.keys() == [4]
+
+        lru.ResetStatistics()
+        assert lru.GetStatistics() == dict(hits=0, misses=0, evictions=0, size=1)
+
+        lru.clear()
+        assert len(lru) == 0
+
+
+    def testConcurrentLRUWeighted(self):
+        from ben10.foundation.lru import ConcurrentLRU
+
+        # Each segment has a capacity of 3.
+        lru = ConcurrentLRU(6, segments=2, get_size=len)
+        lru[0] = 'aa'
+        lru[1] = 'bbb'
+        assert lru.GetStatistics()['size'] == 5
+        lru[2] = 'c'
+        assert sorted(lru.keys()) == [0, 1, 2]
+        lru[4] = 'dd'
+        assert sorted(lru.keys()) == [1, 2, 4]
+        assert lru.GetStatistics() == dict(hits=0, misses=0, evictions=1, size=6)
+
+        # Items bigger than a segment are not stored (the other items of the segment are kept).
+        lru[3] = 'eeee'
+        assert sorted(lru.keys()) == [1, 2, 4]
+        lru[4] = 'dddd'
+        assert sorted(lru.keys()) == [1, 2]
+        assert lru.GetStatistics() == dict(hits=0, misses=0, evictions=1, size=4)
+
+
+    def testConcurrentLRUSegments(self):
+        from ben10.foundation.lru import ConcurrentLRU
+
+        # Small caches use fewer segments by default (instead of tiny ones).
+        assert len(ConcurrentLRU(50)._segments) == 1
+        assert len(ConcurrentLRU(640)._segments) == 10
+        assert len(ConcurrentLRU(10000)._segments) == 16
+        assert len(ConcurrentLRU(50, segments=4)._segments) == 4
+
+        lru = ConcurrentLRU(50)
+        for i in xrange(50):
+            lru[i] = i
+        assert len(lru) == 50
+        assert lru.GetStatistics()['evictions'] == 0
+
+
+    def testConcurrentLRUGetOrCompute(self):
+        from ben10.foundation.lru import ConcurrentLRU
+        import threading
+        import time
+
+        lru = ConcurrentLRU(100, segments=4)
+        calls = []
+        def Factory():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'computed'
+
+        results = []
+        def Get():
+            results.append(lru.get_or_compute('key', Factory))
+
+        threads = [threading.Thread(target=Get) for _i in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == ['computed'] * 8
+        assert len(calls) == 1
+        statistics = lru.GetStatistics()
+        assert statistics['misses'] == 1
+        assert statistics['hits'] == 7
+
+        # If the factory fails, the error is raised and nothing is stored.
+        def Error():
+            raise RuntimeError('error')
+        with pytest.raises(RuntimeError):
+            lru.get_or_compute('other', Error)
+        assert 'other' not in lru
+        assert lru.get_or_compute('other', lambda: 'ok') == 'ok'
+
+        # The factory may get other keys, but asking for the key being computed is an error
+        # (instead of waiting for itself forever).
+        assert lru.get_or_compute('outer', lambda: lru.get_or_compute('inner', lambda: 1) + 1) == 2
+        with pytest.raises(RuntimeError):
+            lru.get_or_compute('recursive', lambda: lru.get_or_compute('recursive', lambda: 1))
+        assert 'recursive' not in lru
+        assert lru.get_or_compute('recursive', lambda: 'ok') == 'ok'
+
 #     def profile(self):
 #         @ProfileMethod('test.prof')
 #         def Check():
@@ -0,0 +1,43 @@
+from __future__ import unicode_literals
+from ben10.foundation.thread_pool import RunInThreads
+import pytest
+import threading
+
+
+
+#===================================================================================================
+# Test
+#===================================================================================================
+class Test:
+
+    def testRunInThreads(self):
+        results = {}
+        thread_names = set()
+        def Square(value):
+            thread_names.add(threading.current_thread().name)
+            results[value] = value * value
+
+        RunInThreads(Square, [(i,) for i in xrange(20)], max_jobs=4)
+        assert results == dict((i, i * i) for i in xrange(20))
+        assert threading.current_thread().name not in thread_names
+
+        # Runs in the calling thread with max_jobs=1
+        thread_names.clear()
+        RunInThreads(Square, [(2,), (3,)], max_jobs=1)
+        assert thread_names == set([threading.current_thread().name])
+
+        RunInThreads(Square, [], max_jobs=4)
+
+
+    def testRunInThreadsError(self):
+        called = []
+        def Fail(value):
+            called.append(value)
+            if value == 0:
+                raise ValueError(value)
+
+        with pytest.raises(ValueError):
+            RunInThreads(Fail, [(i,) for i in xrange(100)], max_jobs=2)
+
+        # Calls not started are skipped after the first error
+        assert len(called) < 100
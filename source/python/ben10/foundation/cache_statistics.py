@@ -0,0 +1,178 @@
+from __future__ import unicode_literals
+'''
+Registry of the live caches (Memoize, CachedMethod and LRU instances) and their statistics.
+
+Statistics are disabled by default, so caches don't pay for them (see EnableCacheStatistics). Caches
+created while enabled register themselves (only weak references are kept, so, the registry doesn't
+keep caches alive) and must implement a GetCacheStatistics method which returns a dict with:
+
+    'name': unicode (a description of what's being cached)
+    'hits': int|None (None if not counted by the cache)
+    'misses': int|None
+    'evictions': int
+    'size': int (number of entries)
+    'memory': int (estimated memory used by the entries, in bytes)
+
+Usage:
+    from ben10.foundation.cache_statistics import EnableCacheStatistics, FormatCacheStatistics
+    EnableCacheStatistics()  # Before creating the caches (i.e.: before importing the modules)
+    ...
+    print FormatCacheStatistics()  # or FormatCacheStatistics('json')
+'''
+import weakref
+
+
+
+_enabled = False
+
+_registered_caches = weakref.WeakValueDictionary()  # id(cache) -> cache
+
+STATISTICS_COLUMNS = ['kind', 'name', 'hits', 'misses', 'evictions', 'size', 'memory']
+
+
+#===================================================================================================
+# EnableCacheStatistics
+#===================================================================================================
+def EnableCacheStatistics(enabled=True):
+    '''
+    Enables (or disables) the statistics of the caches created from now on: only those are
+    registered, and only Memoize decorators applied while enabled count their hits and misses.
+
+    :param bool enabled:
+        True to enable the statistics, False to disable them.
+
+    :rtype: bool
+    :returns:
+        True if the statistics were enabled before this call.
+    '''
+    global _enabled
+    result = _enabled
+    _enabled = enabled
+    return result
+
+
+
+#===================================================================================================
+# IsCacheStatisticsEnabled
+#===================================================================================================
+def IsCacheStatisticsEnabled():
+    '''
+    :rtype: bool
+    :returns:
+        True if the caches created now should register themselves (and count their statistics).
+    '''
+    return _enabled
+
+
+
+#===================================================================================================
+# RegisterCache
+#===================================================================================================
+def RegisterCache(cache):
+    '''
+    Registers a cache so that its statistics are available in GetCacheStatistics.
+
+    :param object cache:
+        An object with a GetCacheStatistics method (only a weak reference to it is kept).
+    '''
+    _registered_caches[id(cache)] = cache
+
+
+
+#===================================================================================================
+# UnregisterCache
+#===================================================================================================
+def UnregisterCache(cache):
+    '''
+    Removes a cache from the registry (i.e.: when its statistics are reported by another cache).
+
+    :param object cache:
+        The cache previously registered.
+    '''
+    _registered_caches.pop(id(cache), None)
+
+
+
+#===================================================================================================
+# EstimateMemory
+#===================================================================================================
+def EstimateMemory(container, items):
+    '''
+    Estimates the memory used by a container and the (shallow) size of its items.
+
+    :param object container:
+        The container (i.e.: the dict where the items are stored).
+
+    :param iterable(tuple(object,object)) items:
+        The (key, value) pairs in the container.
+
+    :rtype: int
+    :returns:
+        The estimated memory in bytes.
+    '''
+    import sys
+    getsizeof = sys.getsizeof
+
+    result = getsizeof(container)
+    for key, value in items:
+        result += getsizeof(key) + getsizeof(value)
+    return result
+
+
+
+#===================================================================================================
+# GetCacheStatistics
+#===================================================================================================
+def GetCacheStatistics():
+    '''
+    :rtype: list(dict(unicode,object))
+    :returns:
+        The statistics of each live cache registered (see module docs), with an additional 'kind'
+        entry (the name of the cache class), sorted by kind and name.
+    '''
+    result = []
+    for cache in _registered_caches.values():
+        statistics = cache.GetCacheStatistics()
+        statistics['kind'] = cache.__class__.__name__
+        result.append(statistics)
+
+    result.sort(key=lambda statistics: (statistics['kind'], statistics['name']))
+    return result
+
+
+
+#===================================================================================================
+# FormatCacheStatistics
+#===================================================================================================
+def FormatCacheStatistics(format='table'):
+    '''
+    :param unicode format:
+        'table' (a text table with one cache per line) or 'json'.
+
+    :rtype: unicode
+    :returns:
+        The statistics of all the live caches in the given format.
+    '''
+    statistics = GetCacheStatistics()
+
+    if format == 'json':
+        import json
+        return json.dumps(statistics, indent=4, sort_keys=True)
+
+    if format != 'table':
+        raise ValueError('Unknown format: %s' % (format,))
+
+    def Format(value):
+        if value is None:
+            return '-'  # Not counted
+        return unicode(value)
+
+    lines = [STATISTICS_COLUMNS]
+    for cache_statistics in statistics:
+        lines.append([Format(cache_statistics[column]) for column in STATISTICS_COLUMNS])
+
+    widths = [max(len(line[i]) for line in lines) for i in xrange(len(STATISTICS_COLUMNS))]
+    return '\n'.join(
+        '  '.join(value.ljust(width) for value, width in zip(line, widths)).rstrip()
+        for line in lines
+    )
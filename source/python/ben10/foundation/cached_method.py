@@ -1,4 +1,5 @@
 from __future__ import unicode_literals
+from .cache_statistics import EstimateMemory, IsCacheStatisticsEnabled, RegisterCache
 from .immutable import AsImmutable
 from .odict import odict
 from .types_ import Method
@@ -20,6 +21,8 @@ class AbstractCachedMethod(Method):
         self._method = WeakMethodRef(cached_method)
         self.enabled = True
         self.ResetCounters()
+        if IsCacheStatisticsEnabled():
+            RegisterCache(self)
 
 
     def __call__(self, *args, **kwargs):
@@ -77,12 +80,49 @@ class AbstractCachedMethod(Method):
         self.call_count = 0
         self.hit_count = 0
         self.miss_count = 0
+        self.eviction_count = 0
 
 
     def _GetCacheResult(self, key, result):
         raise NotImplementedError()
 
 
+    def _GetCacheItems(self):
+        '''
+        :rtype: tuple(object, list(tuple(object,object)))
+        :returns:
+            The container where results are stored and its (key, result) items (used for the
+            statistics).
+        '''
+        raise NotImplementedError()
+
+
+    def GetCacheStatistics(self):
+        '''
+        :rtype: dict(unicode,object)
+        :returns:
+            The statistics of this cache (see ben10.foundation.cache_statistics).
+        '''
+        method = self._method()
+        im_class = getattr(method, 'im_class', None)
+        if method is None:
+            name = ''
+        elif im_class is None:
+            name = getattr(method, '__name__', '')
+        else:
+            name = '%s.%s' % (im_class.__name__, method.__name__)
+
+        container, items = self._GetCacheItems()
+        return dict(
+            name=name,
+            hits=self.hit_count,
+            misses=self.miss_count,
+            evictions=self.eviction_count,
+            size=len(items),
+            memory=EstimateMemory(container, items),
+        )
+
+
 
 #===================================================================================================
 # CachedMethod
@@ -113,6 +153,10 @@ class CachedMethod(AbstractCachedMethod):
         return self._results[key]
 
 
+    def _GetCacheItems(self):
+        return self._results, self._results.items()
+
+
 
 #===================================================================================================
 # ImmutableParamsCachedMethod
@@ -163,6 +207,12 @@ class LastResultCachedMethod(AbstractCachedMethod):
         return self._result
 
 
+    def _GetCacheItems(self):
+        if self._key is None and self._result is None:
+            return self, []
+        return self, [(self._key, self._result)]
+
+
 #===================================================================================================
 # AttributeBasedCachedMethod
 #===================================================================================================
@@ -207,3 +257,4 @@ class AttributeBasedCachedMethod(CachedMethod):
         if len(self._results) > self._cache_size:
             key0 = self._results.keys()[0]
             del self._results[key0]
+            self.eviction_count += 1
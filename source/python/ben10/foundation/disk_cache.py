@@ -0,0 +1,270 @@
+from __future__ import unicode_literals
+'''
+A persistent cache stored in a local directory, which may be shared by concurrent processes.
+
+Each entry is a pickle file in a sub-directory for its namespace. Entries are written to a temporary
+file and atomically renamed, so, readers never see partial entries. The modification time of the
+entry files is used as their last access time: when the total size of the cache exceeds its
+maximum, the least recently used entries are removed.
+
+Entries may depend on files: the signature of those files (mtime and size or md5 of the contents)
+is stored with the entry and the entry is considered invalid when the signature changes.
+'''
+import os
+
+
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_ENTRY_EXTENSION = '.cache'
+
+
+#===================================================================================================
+# DiskCache
+#===================================================================================================
+class DiskCache(object):
+    '''
+    Usage:
+        disk_cache = DiskCache('/home/user/.cache/terraformer')
+
+        disk_cache.Set('Factory', ('alpha.py',), value, dependencies=['alpha.py'])
+        disk_cache.Get('Factory', ('alpha.py',), dependencies=['alpha.py'])
+
+    Or as a Memoize backend (see Memoize.disk_cache).
+
+    Keys must be picklable (and pickle to the same value in different processes: i.e.: avoid dicts
+    and sets in keys) and values must be picklable.
+    '''
+
+    VALIDATE_MTIME = 'mtime'
+    VALIDATE_CONTENTS = 'contents'
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, validate=VALIDATE_MTIME):
+        '''
+        :param unicode directory:
+            The directory where entries are stored (created if needed).
+
+        :param int max_bytes:
+            The maximum size of the cache (the least recently used entries are removed when this
+            size is exceeded).
+
+        :param unicode validate:
+            How the files an entry depends on are checked: VALIDATE_MTIME (modification time and
+            size) or VALIDATE_CONTENTS (md5 of the contents).
+        '''
+        if validate not in (self.VALIDATE_MTIME, self.VALIDATE_CONTENTS):
+            raise ValueError('Invalid validate: %s' % (validate,))
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._validate = validate
+
+        # Estimated size of the cache: computed when first needed and updated on Set.
+        self._total_bytes = None
+
+
+    def _GetEntryFilename(self, namespace, key):
+        '''
+        :rtype: unicode
+        :returns:
+            The filename for the given entry.
+        '''
+        import cPickle
+        import hashlib
+
+        key_hash = hashlib.sha1(cPickle.dumps(key, cPickle.HIGHEST_PROTOCOL)).hexdigest()
+        return os.path.join(self.directory, namespace, key_hash + _ENTRY_EXTENSION)
+
+
+    def _GetSignature(self, dependencies):
+        '''
+        :param list(unicode) dependencies:
+            Filenames.
+
+        :rtype: list(tuple)
+        :returns:
+            The signature of the given files (None for a file that doesn't exist).
+        '''
+        result = []
+        for filename in dependencies:
+            try:
+                if self._validate == self.VALIDATE_MTIME:
+                    stat = os.stat(filename)
+                    signature = (stat.st_mtime, stat.st_size)
+                else:
+                    from ben10.foundation.hash import Md5Hex
+                    signature = Md5Hex(filename)
+            except (IOError, OSError):
+                signature = None
+            result.append((filename, signature))
+        return result
+
+
+    _SENTINEL = []
+
+    def Get(self, namespace, key, dependencies=(), default=None):
+        '''
+        :param unicode namespace:
+            The namespace of the entry (i.e.: the name of the function cached).
+
+        :param object key:
+            The key of the entry.
+
+        :param list(unicode) dependencies:
+            The files the entry depends on.
+
+        :param object default:
+            Returned if the entry is not available (or is not valid anymore).
+
+        :rtype: object
+        :returns:
+            The value stored for the given entry or the default value passed.
+        '''
+        import cPickle
+
+        filename = self._GetEntryFilename(namespace, key)
+        try:
+            with open(filename, 'rb') as stream:
+                stored_key, signature, value = cPickle.load(stream)
+        except (IOError, OSError):
+            return default
+        except Exception:
+            # Corrupted entry (i.e.: written by an incompatible version): just remove it.
+            self._RemoveFile(filename)
+            return default
+
+        if stored_key != key or signature != self._GetSignature(dependencies):
+            return default
+
+        # Mark as recently used.
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return value
+
+
+    def Set(self, namespace, key, value, dependencies=()):
+        '''
+        Stores an entry (atomically replacing any previous entry with the same key).
+
+        :param unicode namespace:
+            The namespace of the entry (i.e.: the name of the function cached).
+
+        :param object key:
+            The key of the entry.
+
+        :param object value:
+            The value to store.
+
+        :param list(unicode) dependencies:
+            The files the entry depends on.
+        '''
+        from ben10.filesystem import CreateFileAtomically
+        import cPickle
+
+        contents = cPickle.dumps(
+            (key, self._GetSignature(dependencies), value),
+            cPickle.HIGHEST_PROTOCOL
+        )
+
+        # Atomic, so that concurrent processes never read partially written entries.
+        CreateFileAtomically(self._GetEntryFilename(namespace, key), contents)
+
+        if self._total_bytes is None:
+            self._total_bytes = self.GetTotalBytes()
+        else:
+            self._total_bytes += len(contents)
+
+        if self._total_bytes > self.max_bytes:
+            self.Prune()
+
+
+    def Remove(self, namespace, key):
+        '''
+        Removes an entry (if available).
+
+        :param unicode namespace:
+            The namespace of the entry.
+
+        :param object key:
+            The key of the entry.
+        '''
+        self._RemoveFile(self._GetEntryFilename(namespace, key))
+
+
+    def Clear(self, namespace=None):
+        '''
+        Removes all the entries from the cache.
+
+        :param unicode namespace:
+            If given, only the entries of the given namespace are removed.
+        '''
+        for filename, _size, _mtime in self._ListEntries(namespace):
+            self._RemoveFile(filename)
+        self._total_bytes = None
+
+
+    def GetTotalBytes(self):
+        '''
+        :rtype: int
+        :returns:
+            The size (in bytes) of all the entries in the cache.
+        '''
+        return sum(size for _filename, size, _mtime in self._ListEntries())
+
+
+    def Prune(self):
+        '''
+        Removes the least recently used entries until the size of the cache is below its maximum.
+        '''
+        entries = self._ListEntries()
+        total_bytes = sum(size for _filename, size, _mtime in entries)
+
+        entries.sort(key=lambda entry: entry[2])
+        for filename, size, _mtime in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            self._RemoveFile(filename)
+            total_bytes -= size
+
+        self._total_bytes = total_bytes
+
+
+    def _ListEntries(self, namespace=None):
+        '''
+        :rtype: list(tuple(unicode,int,float))
+        :returns:
+            The (filename, size, mtime) of the entries in the cache.
+        '''
+        if namespace is None:
+            directories = []
+            if os.path.isdir(self.directory):
+                directories = [
+                    os.path.join(self.directory, i) for i in os.listdir(self.directory)
+                ]
+        else:
+            directories = [os.path.join(self.directory, namespace)]
+
+        result = []
+        for directory in directories:
+            if not os.path.isdir(directory):
+                continue
+            for basename in os.listdir(directory):
+                if not basename.endswith(_ENTRY_EXTENSION):
+                    continue
+                filename = os.path.join(directory, basename)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue  # Removed by another process
+                result.append((filename, stat.st_size, stat.st_mtime))
+        return result
+
+
+    @classmethod
+    def _RemoveFile(cls, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
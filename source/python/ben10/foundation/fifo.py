@@ -19,6 +19,7 @@ class FIFO(odict):
         '''
         odict.__init__(self)
         self._maxsize = maxsize
+        self.evictions = 0
 
 
     def __setitem__(self, key, value):
@@ -39,6 +40,7 @@ class FIFO(odict):
             l -= 1
             # Pop the first item created
             self.popitem(0)
+            self.evictions += 1
 
         odict.__setitem__(self, key, value)
 
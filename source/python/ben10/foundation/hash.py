@@ -1,12 +1,31 @@
 from __future__ import unicode_literals
 import io
+import threading
+
+
+
+# Size of the buffer used to read files when hashing them.
+HASH_BUFFER_SIZE = 1024 * 1024
+
+# Default number of files hashed at the same time by HashTree.
+DEFAULT_HASH_JOBS = 4
 
 
 
 #===================================================================================================
 # DumpDirHashToStringIO
 #===================================================================================================
-def DumpDirHashToStringIO(directory, stringio, base='', exclude=None, include=None):
+def DumpDirHashToStringIO(
+        directory,
+        stringio,
+        base='',
+        exclude=None,
+        include=None,
+        recursive=False,
+        algorithm='md5',
+        max_jobs=1,
+        cache=None,
+    ):
     '''
     Helper to iterate over the files in a directory putting those in the passed StringIO in ini
     format.
@@ -20,38 +39,371 @@ def DumpDirHashToStringIO(directory, stringio, base='', exclude=None, include=No
     :param unicode base:
         If provided should be added (along with a '/') before the name=hash of file.
 
+    Files are written in the order they are found (os.listdir order in each directory, directories
+    top-down), as before HashTree was used here.
+
     :param unicode exclude:
         Pattern to match files to exclude from the hashing. E.g.: *.gz
 
     :param unicode include:
         Pattern to match files to include in the hashing. E.g.: *.zip
+
+    :param bool recursive:
+    :param unicode algorithm:
+    :param int max_jobs:
+    :param HashCache cache:
+        .. seealso:: HashTree
+    '''
+    hashes = _HashTree(directory, exclude, include, recursive, algorithm, max_jobs, cache)
+    for filename, digest in hashes:
+        if base:
+            stringio.write('%s/%s=%s\n' % (base, filename, digest))
+        else:
+            stringio.write('%s=%s\n' % (filename, digest))
+
+
+
+#===================================================================================================
+# HashTree
+#===================================================================================================
+def HashTree(
+        directory,
+        exclude=None,
+        include=None,
+        recursive=True,
+        algorithm='md5',
+        max_jobs=DEFAULT_HASH_JOBS,
+        cache=None,
+    ):
+    '''
+    Computes the hash of the files in a directory (and its sub-directories).
+
+    :param unicode directory:
+        The directory for which the hash should be done.
+
+    :param unicode exclude:
+        Pattern to match files (full path) to exclude from the hashing. E.g.: *.gz
+
+    :param unicode include:
+        Pattern to match files (full path) to include in the hashing. E.g.: *.zip
+
+    :param bool recursive:
+        If True, also hashes the files in sub-directories (without following links to directories).
+
+    :param unicode algorithm:
+        .. seealso:: HashFile
+
+    :param int max_jobs:
+        The maximum number of files hashed at the same time. Hashing is usually waiting for the
+        disk, and both reading and hashing release the GIL, so threads help even with one cpu.
+
+    :param HashCache cache:
+        If given, files with the same size, modification time and inode as when last hashed are not
+        read again. Entries of files that were in the directory but weren't found now (removed) are
+        dropped from the cache.
+
+    :rtype: odict(unicode,unicode)
+    :returns:
+        The hex digest of each file, by path relative to the directory (using "/" as separator),
+        sorted by path.
+    '''
+    from ben10.foundation.odict import odict
+
+    hashes = _HashTree(directory, exclude, include, recursive, algorithm, max_jobs, cache)
+    return odict(sorted(hashes))
+
+
+def _HashTree(directory, exclude, include, recursive, algorithm, max_jobs, cache):
+    '''
+    Implementation of HashTree.
+
+    :rtype: list(tuple(unicode,unicode))
+    :returns:
+        The (relative path, hex digest) of each file, in the order found by os.walk.
     '''
+    from ben10.foundation.thread_pool import RunInThreads
     import fnmatch
     import os
+    import stat
 
-    files = [(os.path.join(directory, i), i) for i in os.listdir(directory)]
-    files = [i for i in files if os.path.isfile(i[0])]
-    for fullname, filename in files:
-        if include is not None:
-            if not fnmatch.fnmatch(fullname, include):
-                continue
+    files = []
+    found_filenames = set()
+    for dir_root, _directories, filenames in os.walk(directory):
+        for i_filename in filenames:
+            fullname = os.path.join(dir_root, i_filename)
+            if cache is not None:
+                found_filenames.add(os.path.abspath(fullname))
+
+            if include is not None:
+                if not fnmatch.fnmatch(fullname, include):
+                    continue
+
+            if exclude is not None:
+                if fnmatch.fnmatch(fullname, exclude):
+                    continue
 
-        if exclude is not None:
-            if fnmatch.fnmatch(fullname, exclude):
+            try:
+                file_stat = os.stat(fullname)
+            except OSError:
+                continue  # Broken link or removed while walking
+            if not stat.S_ISREG(file_stat.st_mode):
                 continue
 
-        md5 = Md5Hex(fullname)
-        if base:
-            stringio.write('%s/%s=%s\n' % (base, filename, md5))
-        else:
-            stringio.write('%s=%s\n' % (filename, md5))
+            relative_filename = os.path.relpath(fullname, directory).replace(os.sep, '/')
+            files.append((relative_filename, fullname, file_stat))
+
+        if not recursive:
+            break
+
+    digests = {}
+
+    def Hash(relative_filename, fullname, file_stat):
+        digest = None
+        if cache is not None:
+            digest = cache.Get(fullname, file_stat, algorithm)
+        if digest is None:
+            digest = HashFile(fullname, algorithm)
+            if cache is not None:
+                cache.Set(fullname, file_stat, algorithm, digest)
+        digests[relative_filename] = digest
+
+    RunInThreads(Hash, files, max_jobs)
+
+    if cache is not None:
+        cache.Prune(directory, found_filenames, recursive)
+
+    return [(i, digests[i]) for i, _fullname, _file_stat in files]
+
+
+
+#===================================================================================================
+# HashFile
+#===================================================================================================
+def HashFile(filename, algorithm='md5'):
+    '''
+    :param unicode filename:
+        The file from which the hash should be calculated.
+
+    :param unicode algorithm:
+        The name of an algorithm accepted by hashlib.new (e.g.: md5, sha1, sha256). Also accepts
+        blake2b and blake2s when hashlib doesn't provide them (Python < 3.6) but the pyblake2 package
+        is available.
+
+    :rtype: unicode
+    :returns:
+        Returns a string with the hex digest of the file contents.
+
+    :raises ValueError:
+        If the algorithm is not available.
+    '''
+    hash_ = _CreateHash(algorithm)
+
+    # Reads into a buffer reused by all the calls in the same thread (the memoryview slices passed to
+    # update are not copies).
+    buffer_ = getattr(_thread_buffers, 'buffer', None)
+    if buffer_ is None:
+        buffer_ = _thread_buffers.buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer_)
+
+    with io.open(filename, 'rb', buffering=0) as stream:
+        while True:
+            size = stream.readinto(buffer_)
+            if not size:
+                break
+            hash_.update(view[:size])
+
+    return unicode(hash_.hexdigest())
+
+
+_thread_buffers = threading.local()
+
+
+
+#===================================================================================================
+# HashStream
+#===================================================================================================
+def HashStream(stream, algorithm='md5', tee=None):
+    '''
+    Computes the hash of the contents of a file-like object, reading it in fixed-size chunks, so that
+    the memory used doesn't depend on the size of the contents (e.g.: for remote files).
+
+    :param file stream:
+        Any object with a read(size) method returning bytes (e.g.: files open in binary mode, urllib
+        responses or ftputil files).
+
+    :param unicode algorithm:
+        .. seealso:: HashFile
+
+    :param file|None tee:
+        If given, all contents read are also written to this file-like object (e.g.: to save a
+        download while hashing it).
+
+    :rtype: unicode
+    :returns:
+        Returns a string with the hex digest of the contents.
+    '''
+    hash_ = _CreateHash(algorithm)
+    while True:
+        data = stream.read(HASH_BUFFER_SIZE)
+        if not data:
+            break
+        hash_.update(data)
+        if tee is not None:
+            tee.write(data)
+    return unicode(hash_.hexdigest())
+
+
+def _CreateHash(algorithm):
+    import hashlib
+    try:
+        return hashlib.new(algorithm)
+    except ValueError:
+        if algorithm not in ('blake2b', 'blake2s'):
+            raise
+        try:
+            import pyblake2
+        except ImportError:
+            raise ValueError('unsupported hash type ' + algorithm)
+        return getattr(pyblake2, algorithm)()
+
+
+
+#===================================================================================================
+# HashCache
+#===================================================================================================
+class HashCache(object):
+    '''
+    The digests of files, by their path, size, modification time and inode, so that unchanged files
+    don't have to be hashed again (see HashTree).
+
+    Usage:
+        cache = HashCache('/home/user/.cache/hashes.cache')
+        HashTree('/home/user/project', cache=cache)
+        cache.Save()
+
+    Files modified less than RACY_SECONDS before being hashed are not cached, since changes made in
+    the same second would not change their modification time in filesystems with coarse timestamps.
+    '''
+
+    # Format of the file written by Save: files with other versions are ignored.
+    FORMAT_VERSION = 1
+
+    RACY_SECONDS = 2
+
+    def __init__(self, filename=None):
+        '''
+        :param unicode|None filename:
+            The file where the cache is stored (read now, if it exists, and written by Save). If
+            None, the cache is kept only in memory.
+        '''
+        import cPickle
+
+        self.filename = filename
+        self._entries = {}
+        self._modified = False
+
+        if filename is not None:
+            try:
+                with open(filename, 'rb') as stream:
+                    version, entries = cPickle.load(stream)
+            except Exception:
+                pass
+            else:
+                if version == self.FORMAT_VERSION:
+                    self._entries = entries
+
+
+    def Get(self, filename, file_stat, algorithm):
+        '''
+        :param unicode filename:
+        :param os.stat_result file_stat:
+            The current stat of the file.
+        :param unicode algorithm:
+
+        :returns unicode|None:
+            The digest of the file, or None if not in the cache (or changed).
+        '''
+        import os
+        entry = self._entries.get((os.path.abspath(filename), algorithm))
+        if entry is None or entry[0] != self._GetSignature(file_stat):
+            return None
+        return entry[1]
+
+
+    def Set(self, filename, file_stat, algorithm, digest):
+        '''
+        :param unicode filename:
+        :param os.stat_result file_stat:
+            The stat of the file when hashed.
+        :param unicode algorithm:
+        :param unicode digest:
+        '''
+        import os
+        import time
+        if file_stat.st_mtime >= time.time() - self.RACY_SECONDS:
+            return
+        self._entries[(os.path.abspath(filename), algorithm)] = (self._GetSignature(file_stat), digest)
+        self._modified = True
+
+
+    def Prune(self, directory, found_filenames, recursive=True):
+        '''
+        Removes the entries of files in a directory that were not found when listing it (e.g.
+        removed files), so that the cache doesn't grow with files that don't exist anymore.
+
+        :param unicode directory:
+        :param set(unicode) found_filenames:
+            The absolute paths of all the files found in the directory.
+        :param bool recursive:
+            If True, also removes the entries of files in sub-directories that are not in
+            found_filenames.
+        '''
+        import os
+        directory = os.path.abspath(directory)
+        prefix = os.path.join(directory, '')
+
+        removed = [
+            i for i in self._entries
+            if i[0] not in found_filenames and i[0].startswith(prefix)
+            and (recursive or os.path.dirname(i[0]) == directory)
+        ]
+        for i_key in removed:
+            del self._entries[i_key]
+        if removed:
+            self._modified = True
+
+
+    def Save(self):
+        '''
+        Writes the cache to its file (atomically), if it was changed.
+        '''
+        from ben10.filesystem import CreateFileAtomically
+        import cPickle
+
+        if self.filename is None or not self._modified:
+            return
+
+        CreateFileAtomically(
+            self.filename,
+            cPickle.dumps((self.FORMAT_VERSION, self._entries), cPickle.HIGHEST_PROTOCOL),
+        )
+        self._modified = False
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    @classmethod
+    def _GetSignature(cls, file_stat):
+        return (file_stat.st_size, file_stat.st_mtime, file_stat.st_ino)
 
 
 
 #===================================================================================================
 # Md5Hex
 #===================================================================================================
-def Md5Hex(filename=None, contents=None):
+def Md5Hex(filename=None, contents=None, stream=None):
     '''
     :param unicode filename:
         The file from which the md5 should be calculated. If the filename is given, the contents
@@ -61,27 +413,23 @@ def Md5Hex(filename=None, contents=None):
         The contents for which the md5 should be calculated. If the contents are given, the filename
         should NOT be given.
 
+    :param file stream:
+        A file-like object from which the md5 should be calculated (read in chunks, see HashStream).
+        If the stream is given, the filename and contents should NOT be given.
+
     :rtype: unicode
     :returns:
         Returns a string with the hex digest of the stream.
     '''
-    import hashlib
-    md5 = hashlib.md5()
-
     if filename:
-        stream = io.open(filename, 'rb')
-        try:
-            while True:
-                data = stream.read(md5.block_size * 128)
-                if not data:
-                    break
-                md5.update(data)
-        finally:
-            stream.close()
+        return HashFile(filename, 'md5')
 
-    else:
-        md5.update(contents)
+    if stream is not None:
+        return HashStream(stream, 'md5')
 
+    import hashlib
+    md5 = hashlib.md5()
+    md5.update(contents)
     return unicode(md5.hexdigest())
 
 
@@ -1,11 +1,17 @@
 from __future__ import unicode_literals
 '''
-LRU module. Based around heapq.
+LRU module.
+
+The default LRU is based on a dict plus an intrusive doubly-linked list (O(1) get, set and evict).
+The HeapLRU is the previous implementation, based around heapq.
 '''
 
+from ben10.foundation.cache_statistics import (EstimateMemory, IsCacheStatisticsEnabled,
+    RegisterCache, UnregisterCache)
 from ben10.foundation.decorators import Override
 from heapq import heapify, heappop, heappush
 import itertools
+import sys
 
 DEFAULT_LRU_SIZE = 50
 
@@ -75,14 +81,17 @@ class _Node(object):
 
 
 #===================================================================================================
-# LRU
+# HeapLRU
 #===================================================================================================
-class LRU(object):
+class HeapLRU(object):
     '''
     Least Recently Used (LRU) cache.
 
     Based on heapq module (which is used to guarantee that the 1st item in _heap is
     always the item that has the lowest access time).
+
+    Note that evicting items after accesses requires a heapify (O(n)), so, LRU should be preferred
+    (this implementation is kept mostly for comparison purposes).
     '''
 
     def __init__(self, size=DEFAULT_LRU_SIZE, internal_dict=None, get_size=lambda x:1):
@@ -391,6 +400,379 @@ class LRU(object):
         return list(self.itervalues())
 
 
+#===================================================================================================
+# _LinkedNode
+#===================================================================================================
+class _LinkedNode(object):
+    '''
+    Node of the doubly-linked list used in the LRU (holds the key, object and its size).
+    '''
+
+    __slots__ = 'prev next key obj size'.split()
+
+    def __init__(self, key, obj, size):
+        '''
+        :param object key:
+            The key this node is storing
+
+        :param object obj:
+            The object this node is storing
+
+        :param int size:
+            The size of this object
+        '''
+        self.prev = None
+        self.next = None
+        self.key = key
+        self.obj = obj
+        self.size = size
+
+
+    def __repr__(self):
+        '''
+        :rtype: unicode
+        :returns:
+            The representation of the item
+        '''
+        return '_LinkedNode(key=%r)' % (self.key,)
+
+
+
+#===================================================================================================
+# LRU
+#===================================================================================================
+class LRU(object):
+    '''
+    Least Recently Used (LRU) cache.
+
+    Based on a dict (key -> node) and a circular doubly-linked list of nodes ordered by access
+    time: the node right after the root is the least recently used and the node right before the
+    root is the most recently used. Getting, setting and evicting items are all O(1).
+    '''
+
+    def __init__(self, size=DEFAULT_LRU_SIZE, internal_dict=None, get_size=lambda x:1):
+        '''
+        :param int size:
+            The maximum size for this cache.
+
+        :param dict internal_dict:
+            If passed, this will be used as the internal dictionary in this LRU.
+
+        :param callable get_size:
+            Callable which receives an object and returns its size (by default each object has
+            size 1).
+        '''
+        if size <= 0:
+            raise ValueError('Size must be > 0. Found: %s' % (size,))
+
+        root = self._root = _LinkedNode(None, None, 0)
+        root.prev = root.next = root
+
+        if internal_dict is None:
+            self._dict = {}
+        else:
+            self._dict = internal_dict
+
+        self._maxsize = size
+        self._currsize = 0
+        self._get_size = get_size
+
+        # Statistics (see GetCacheStatistics)
+        self.evictions = 0
+
+        # For speed
+        self._dict_get = self._dict.get
+
+        if IsCacheStatisticsEnabled():
+            RegisterCache(self)
+
+
+    def clear(self):
+        '''
+        Clears the LRU also reseting internal variables. The final state after a clear is the same
+        as if the LRU was recently created (except for the statistics).
+        '''
+        root = self._root
+        root.prev = root.next = root
+        self._dict.clear()
+        self._currsize = 0
+
+
+    def __len__(self):
+        '''
+        :rtype: int
+        :returns:
+            The current size of the cache
+        '''
+        return len(self._dict)
+
+
+    def __contains__(self, key):
+        '''
+        :rtype: bool
+        :returns:
+            True if the key is in the cache and False otherwise.
+        '''
+        return key in self._dict
+
+
+    has_key = __contains__
+
+
+    def _MoveToEnd(self, node):
+        '''
+        Marks the given node as the most recently used.
+
+        :param _LinkedNode node:
+            A node which is already linked.
+        '''
+        root = self._root
+        if node.next is not root:
+            # Unlink...
+            node.prev.next = node.next
+            node.next.prev = node.prev
+
+            # ... and link before the root.
+            last = root.prev
+            last.next = root.prev = node
+            node.prev = last
+            node.next = root
+
+
+    def _PopOldest(self):
+        '''
+        Removes the least recently used node (the caller must guarantee that there's at least one
+        node).
+
+        :rtype: _LinkedNode
+        :returns:
+            The node removed.
+        '''
+        root = self._root
+        lru = root.next
+        root.next = lru.next
+        lru.next.prev = root
+        self.evictions += 1
+        return self._dict.pop(lru.key)
+
+
+    def __setitem__(self, key, obj):
+        '''
+        Sets an item in the cache (with the proper access time)
+
+        :param object key:
+            The key to be gotten
+
+        :param object obj:
+            The value to be stored for the given key
+        '''
+        node = self._dict_get(key, None)
+        add_size = self._get_size(obj)
+        if add_size <= 0:
+            raise ValueError('Size for object may not be 0. Key: %s' % (key,))
+
+        maxsize = self._maxsize
+        currsize = self._currsize
+
+        if node is not None:
+            currsize += add_size - node.size
+            node.obj = obj
+            node.size = add_size
+            self._MoveToEnd(node)
+
+            # Make it smaller (note that the node itself may be removed if it doesn't fit).
+            while currsize > maxsize:
+                currsize -= self._PopOldest().size
+
+        else:
+            # Handle special case where we're inserting a value which can not fit in the LRU.
+            if add_size > maxsize:
+                self.clear()
+                return
+
+            # Make it smaller before putting the new item.
+            while currsize + add_size > maxsize:
+                currsize -= self._PopOldest().size
+
+            node = _LinkedNode(key, obj, add_size)
+            root = self._root
+            last = root.prev
+            last.next = root.prev = node
+            node.prev = last
+            node.next = root
+            currsize += add_size
+            self._dict[key] = node
+
+        self._currsize = currsize
+
+
+    def __getitem__(self, key):
+        '''
+        Gets an item from the cache (and updates the access time)
+
+        :param object key:
+            The key to be gotten
+
+        :rtype: object
+        :returns:
+            The value that was stored for the given item
+
+        :raises KeyError:
+            If the key is not available
+        '''
+        node = self._dict[key]  # Can throw error here
+        self._MoveToEnd(node)
+        return node.obj
+
+
+    def get(self, key, default=None):
+        '''
+        Gets an item from the cache (and updates the access time if it exists)
+
+        :param object key:
+            The key to be gotten
+
+        :param object default:
+            This is the value to be returned if the key doesn't exist.
+
+        :rtype: object
+        :returns:
+            The value that was stored for the given item or the default value passed.
+        '''
+        node = self._dict_get(key, None)
+        if node is None:
+            return default
+
+        self._MoveToEnd(node)
+        return node.obj
+
+
+    def __delitem__(self, key):
+        '''
+        Deletes an item from the cache
+
+        :param object key:
+            The key to be removed
+
+        :rtype: object
+        :returns:
+            The value that was stored for the given item
+
+        :raises KeyError:
+            If the key is not available
+        '''
+        node = self._dict.pop(key)  # can throw KeyError here
+        self._currsize -= node.size
+
+        node.prev.next = node.next
+        node.next.prev = node.prev
+
+        return node.obj
+
+
+    _SENTINEL = []
+
+    def pop(self, key, default=_SENTINEL):
+        try:
+            return self.__delitem__(key)
+        except KeyError:
+            if default is not self._SENTINEL:
+                return default
+            raise
+
+
+    #--- Iterating
+    def iternodes(self):
+        '''
+        :rtype: iterator(_LinkedNode)
+        :returns:
+            Iterator that traverses nodes according to LRU
+            (the ones with lowest access time come before)
+        '''
+        root = self._root
+        node = root.next
+        while node is not root:
+            next_node = node.next
+            yield node
+            node = next_node
+
+
+    def __iter__(self):
+        '''
+        :rtype: iterator(key)
+        :returns:
+            Iterator that traverses keys according to LRU
+            (the ones with lowest access time come before)
+        '''
+        for node in self.iternodes():
+            yield node.key
+
+
+    iterkeys = __iter__
+
+    def iteritems(self):
+        '''
+        :rtype: iterator(key, value)
+        :returns:
+            Iterator that traverses (key, value) according to LRU
+            (the ones with lowest access time come before)
+        '''
+        for node in self.iternodes():
+            yield node.key, node.obj
+
+
+    def itervalues(self):
+        '''
+        :rtype: iterator(value)
+        :returns:
+            Iterator that passes values according to LRU
+            (the ones with lowest access time come before)
+        '''
+        for node in self.iternodes():
+            yield node.obj
+
+
+    #--- Getting keys or values
+    def keys(self):
+        '''
+        :rtype: list
+        :returns:
+            List of keys according to LRU
+            (the ones with lowest access time come before)
+        '''
+        return list(self.iterkeys())
+
+
+    def values(self):
+        '''
+        :rtype: list
+        :returns:
+            List of values according to LRU
+            (the ones with lowest access time come before)
+        '''
+        return list(self.itervalues())
+
+
+    #--- Statistics
+    def GetCacheStatistics(self):
+        '''
+        :rtype: dict(unicode,object)
+        :returns:
+            The statistics of this cache (see ben10.foundation.cache_statistics). Hits and misses
+            are not counted (to keep gets fast): Memoize and ConcurrentLRU count them.
+        '''
+        memory = EstimateMemory(self._dict, self.iteritems())
+        memory += len(self._dict) * sys.getsizeof(self._root)
+        return dict(
+            name='',
+            hits=None,
+            misses=None,
+            evictions=self.evictions,
+            size=len(self._dict),
+            memory=memory,
+        )
+
+
 #===================================================================================================
 # _DictWithRemovalMemo
 #===================================================================================================
@@ -452,4 +834,347 @@ class LRUWithRemovalMemo(LRU):
 
 
 
+#===================================================================================================
+# _Segment
+#===================================================================================================
+class _Segment(object):
+    '''
+    A segment of the ConcurrentLRU: an LRU with its own lock, statistics and the events (and
+    threads) for the keys currently being computed in get_or_compute.
+    '''
+
+    __slots__ = 'lock lru size get_size computing hits misses evictions'.split()
+
+    def __init__(self, size, get_size):
+        import threading
+
+        self.lock = threading.Lock()
+        self.lru = LRU(size, get_size=get_size)
+        UnregisterCache(self.lru)  # Reported by the ConcurrentLRU
+        self.size = size
+        self.get_size = get_size
+        self.computing = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def Set(self, key, obj):
+        '''
+        Sets an item in the LRU of this segment, counting the items evicted.
+
+        An item bigger than the segment is not stored (instead of evicting all the items of the
+        segment, as the LRU would do), and removes the previous item of the key (if any).
+
+        Must be called with the lock acquired.
+        '''
+        lru = self.lru
+        if self.get_size(obj) > self.size:
+            lru.pop(key, None)
+            return
+        expected_len = len(lru)
+        if key not in lru:
+            expected_len += 1
+        lru[key] = obj
+        self.evictions += expected_len - len(lru)
+
+
+
+#===================================================================================================
+# ConcurrentLRU
+#===================================================================================================
+class ConcurrentLRU(object):
+    '''
+    A thread-safe LRU cache.
+
+    Keys are sharded across independently locked segments (each one a LRU with its own weighted
+    capacity), so, threads accessing keys in different segments don't contend for the same lock.
+
+    Note that the LRU order is kept per segment (so, the item evicted is the least recently used in
+    its segment and not necessarily in the whole cache), and items bigger than a segment are not
+    stored.
+    '''
+
+    # Maximum number of segments used by default.
+    DEFAULT_SEGMENTS = 16
+
+    # Minimum capacity of each segment when the number of segments is chosen by default (so small
+    # caches use fewer segments, instead of tiny ones).
+    MIN_SEGMENT_SIZE = 64
+
+    def __init__(self, size=DEFAULT_LRU_SIZE, segments=None, get_size=lambda x:1):
+        '''
+        :param int size:
+            The maximum size for this cache (each segment has a capacity of size / segments,
+            rounded up).
+
+        :param int|None segments:
+            The number of segments (independent locks) to use. If None, uses up to DEFAULT_SEGMENTS
+            segments, each one with a capacity of at least MIN_SEGMENT_SIZE (a single segment for
+            caches smaller than that).
+
+        :param callable get_size:
+            Callable which receives an object and returns its size (by default each object has
+            size 1).
+        '''
+        if size <= 0:
+            raise ValueError('Size must be > 0. Found: %s' % (size,))
+        if segments is None:
+            segments = max(1, min(self.DEFAULT_SEGMENTS, size // self.MIN_SEGMENT_SIZE))
+        elif segments <= 0:
+            raise ValueError('Segments must be > 0. Found: %s' % (segments,))
+
+        segment_size = -(-size // segments)
+        self._segments = [_Segment(segment_size, get_size) for _i in xrange(segments)]
+        self._segments_count = segments
+
+        if IsCacheStatisticsEnabled():
+            RegisterCache(self)
+
+
+    def _GetSegment(self, key):
+        return self._segments[hash(key) % self._segments_count]
+
+
+    def clear(self):
+        '''
+        Clears all the items in the cache (statistics are kept, see ResetStatistics).
+        '''
+        for segment in self._segments:
+            with segment.lock:
+                segment.lru.clear()
+
 
+    def __len__(self):
+        '''
+        :rtype: int
+        :returns:
+            The current number of items in the cache
+        '''
+        return sum(len(segment.lru) for segment in self._segments)
+
+
+    def __contains__(self, key):
+        '''
+        :rtype: bool
+        :returns:
+            True if the key is in the cache and False otherwise.
+        '''
+        segment = self._GetSegment(key)
+        with segment.lock:
+            return key in segment.lru
+
+
+    has_key = __contains__
+
+
+    def __setitem__(self, key, obj):
+        '''
+        Sets an item in the cache (with the proper access time)
+
+        :param object key:
+            The key to be set
+
+        :param object obj:
+            The value to be stored for the given key
+        '''
+        segment = self._GetSegment(key)
+        with segment.lock:
+            segment.Set(key, obj)
+
+
+    def __getitem__(self, key):
+        '''
+        Gets an item from the cache (and updates the access time)
+
+        :param object key:
+            The key to be gotten
+
+        :rtype: object
+        :returns:
+            The value that was stored for the given item
+
+        :raises KeyError:
+            If the key is not available
+        '''
+        segment = self._GetSegment(key)
+        with segment.lock:
+            try:
+                obj = segment.lru[key]
+            except KeyError:
+                segment.misses += 1
+                raise
+            segment.hits += 1
+            return obj
+
+
+    _SENTINEL = []
+
+    def get(self, key, default=None):
+        '''
+        Gets an item from the cache (and updates the access time if it exists)
+
+        :param object key:
+            The key to be gotten
+
+        :param object default:
+            This is the value to be returned if the key doesn't exist.
+
+        :rtype: object
+        :returns:
+            The value that was stored for the given item or the default value passed.
+        '''
+        segment = self._GetSegment(key)
+        with segment.lock:
+            obj = segment.lru.get(key, self._SENTINEL)
+            if obj is self._SENTINEL:
+                segment.misses += 1
+                return default
+            segment.hits += 1
+            return obj
+
+
+    def get_or_compute(self, key, factory):
+        '''
+        Gets an item from the cache or computes it with the given factory (and stores it).
+
+        When multiple threads ask for the same key at the same time, the factory is called only
+        once and the other threads wait for its result (if the factory raises an exception, the
+        exception is raised only in the thread that called it and a waiting thread will call the
+        factory again).
+
+        The factory may get other keys from this cache, but not the key being computed.
+
+        :param object key:
+            The key to be gotten
+
+        :param callable factory:
+            Callable without parameters which returns the value for the given key.
+
+        :rtype: object
+        :returns:
+            The value that was stored (or computed) for the given item.
+
+        :raises RuntimeError:
+            If the factory asks for the key being computed (which would wait for itself forever).
+        '''
+        import threading
+
+        segment = self._GetSegment(key)
+        thread = threading.current_thread()
+        while True:
+            with segment.lock:
+                obj = segment.lru.get(key, self._SENTINEL)
+                if obj is not self._SENTINEL:
+                    segment.hits += 1
+                    return obj
+
+                computing = segment.computing.get(key)
+                if computing is None:
+                    event = threading.Event()
+                    segment.computing[key] = (event, thread)
+                    segment.misses += 1
+                    break
+
+                event, computing_thread = computing
+                if computing_thread is thread:
+                    raise RuntimeError('Recursive computation of key: %r' % (key,))
+
+            # Some other thread is computing it: wait for it and check again.
+            event.wait()
+
+        try:
+            obj = factory()
+            with segment.lock:
+                segment.Set(key, obj)
+        finally:
+            with segment.lock:
+                del segment.computing[key]
+            event.set()
+
+        return obj
+
+
+    def __delitem__(self, key):
+        '''
+        Deletes an item from the cache
+
+        :param object key:
+            The key to be removed
+
+        :rtype: object
+        :returns:
+            The value that was stored for the given item
+
+        :raises KeyError:
+            If the key is not available
+        '''
+        segment = self._GetSegment(key)
+        with segment.lock:
+            return segment.lru.__delitem__(key)
+
+
+    def pop(self, key, default=_SENTINEL):
+        segment = self._GetSegment(key)
+        with segment.lock:
+            if default is self._SENTINEL:
+                return segment.lru.pop(key)
+            return segment.lru.pop(key, default)
+
+
+    def keys(self):
+        '''
+        :rtype: list
+        :returns:
+            List of keys (according to LRU inside each segment)
+        '''
+        result = []
+        for segment in self._segments:
+            with segment.lock:
+                result.extend(segment.lru.iterkeys())
+        return result
+
+
+    #--- Statistics
+    def GetStatistics(self):
+        '''
+        :rtype: dict(unicode,int)
+        :returns:
+            The statistics aggregated from all the segments: 'hits', 'misses', 'evictions' and
+            'size' (the current weighted size of the cache).
+        '''
+        result = dict(hits=0, misses=0, evictions=0, size=0)
+        for segment in self._segments:
+            with segment.lock:
+                result['hits'] += segment.hits
+                result['misses'] += segment.misses
+                result['evictions'] += segment.evictions
+                result['size'] += segment.lru._currsize
+        return result
+
+
+    def GetCacheStatistics(self):
+        '''
+        :rtype: dict(unicode,object)
+        :returns:
+            The statistics of this cache (see ben10.foundation.cache_statistics).
+        '''
+        result = dict(name='', hits=0, misses=0, evictions=0, size=0, memory=0)
+        for segment in self._segments:
+            with segment.lock:
+                lru_statistics = segment.lru.GetCacheStatistics()
+                result['hits'] += segment.hits
+                result['misses'] += segment.misses
+                result['evictions'] += segment.evictions
+                result['size'] += lru_statistics['size']
+                result['memory'] += lru_statistics['memory']
+        return result
+
+
+    def ResetStatistics(self):
+        '''
+        Resets the hits, misses and evictions counters.
+        '''
+        for segment in self._segments:
+            with segment.lock:
+                segment.hits = segment.misses = segment.evictions = 0
@@ -1,4 +1,7 @@
 from __future__ import unicode_literals
+from ben10.foundation.cache_statistics import (EstimateMemory, IsCacheStatisticsEnabled,
+    RegisterCache)
+import weakref
 
 
 
@@ -23,6 +26,11 @@ class Memoize(object):
         def double(x):
             return x * 2
 
+        or
+        @Memoize(100, Memoize.LRU, ttl=30)  # entries are recomputed 30 seconds after being cached.
+        def GetStatus(path):
+            ...
+
     This implementation supposes that the arguments are already immutable and won't change.
     If some function needs special behavior, this class should be subclassed and _GetCacheKey
     should be overridden.
@@ -32,6 +40,11 @@ class Memoize(object):
     instance method is used). If this behavior is not wanted, the memo_target must be forced
     to MEMO_INSTANCE_METHOD or MEMO_FUNCTION.
 
+    With MEMO_INSTANCE_METHOD each instance has its own cache (so, maxsize is per instance). With
+    MEMO_WEAK_INSTANCE_METHOD the entries of all instances share a single cache (so, maxsize is a
+    global cap on the entries of all instances) and the entries of an instance are removed as soon
+    as it's garbage-collected (instances must be weak-referenceable).
+
     Note that non-declared keyword arguments (`**kwargs`) are forbidden. Offer proper support for it may cause a
     prohibitive overhead.
     '''
@@ -42,6 +55,7 @@ class Memoize(object):
     LRU = 'LRU'
 
     MEMO_INSTANCE_METHOD = 'instance_method'
+    MEMO_WEAK_INSTANCE_METHOD = 'weak_instance_method'
     MEMO_FUNCTION = 'function'
     MEMO_FROM_ARGSPEC = 'from_argspec'
 
@@ -69,27 +83,60 @@ class Memoize(object):
         return ret
 
 
-    def __init__(self, maxsize=50, prune_method=FIFO, memo_target=MEMO_FROM_ARGSPEC):
+    def __init__(
+            self,
+            maxsize=50,
+            prune_method=FIFO,
+            memo_target=MEMO_FROM_ARGSPEC,
+            ttl=None,
+            disk_cache=None,
+            disk_cache_dependencies=None,
+        ):
         '''
         :param int maxsize:
             The maximum size of the internal cache (default is 50).
 
         :param unicode prune_method:
-            This is according to the way used to prune entries. Right now only
-            pruning the oldest entry is supported (FIFO), but different ways could be
-            available (e.g.: pruning LRU seems a natural addition)
+            This is according to the way used to prune entries: FIFO prunes the oldest entry
+            added and LRU prunes the least recently used entry.
 
         :param unicode memo_target:
-            One of the constants MEMO_INSTANCE_METHOD or MEMO_FUNCTION or MEMO_FROM_ARGSPEC.
+            One of the constants MEMO_INSTANCE_METHOD, MEMO_WEAK_INSTANCE_METHOD, MEMO_FUNCTION or
+            MEMO_FROM_ARGSPEC.
             When from argspec it'll try to see if the 1st parameter is 'self' and if it is,
             it'll fall to using the MEMO_INSTANCE_METHOD (otherwise the MEMO_FUNCTION is used)
             If the signature of the function is 'special' and doesn't follow the conventions,
             the memo_target MUST be specified.
+
+        :param float ttl:
+            If given, the time-to-live (in seconds) of each entry: entries older than that are
+            considered expired and are recomputed when accessed (the expiration is lazy: no
+            background work is done to remove expired entries).
+
+        :param DiskCache disk_cache:
+            If given, entries are also stored in this ben10.foundation.disk_cache.DiskCache, so
+            that they're available to other processes (and later runs). Only available for
+            functions (MEMO_FUNCTION) and the arguments and results must be picklable.
+
+        :param callable disk_cache_dependencies:
+            Callable which receives the cache key (a tuple with all the arguments, including the
+            default values) and returns the files the result depends on (when those change, the
+            entry in the disk cache is recomputed).
         '''
 
         self._prune_method = prune_method
         self._maxsize = maxsize
         self._memo_target = memo_target
+        self._ttl = ttl
+        self._disk_cache = disk_cache
+        self._disk_cache_dependencies = disk_cache_dependencies
+
+        # Statistics (see GetCacheStatistics)
+        self._name = ''
+        self._statistics = False
+        self._caches = weakref.WeakValueDictionary()  # id(cache) -> cache
+        self._calls = 0
+        self._misses = 0
 
 
     def _GetCacheKey(self, args, kwargs):
@@ -167,7 +214,7 @@ class Memoize(object):
             defaults = ()
         else:
             has_defaults = True
-        if self._memo_target == self.MEMO_INSTANCE_METHOD:
+        if self._memo_target in (self.MEMO_INSTANCE_METHOD, self.MEMO_WEAK_INSTANCE_METHOD):
             args = args[1:]  # Ignore self when dealing with instance method
         first_default = len(args) - len(defaults)
         for i, arg in enumerate(args):
@@ -209,14 +256,23 @@ class Memoize(object):
                     # be used as a part of the cache key, so, all should work properly).
                     self._memo_target = self.MEMO_FUNCTION
 
+        if self._disk_cache is not None and self._memo_target != self.MEMO_FUNCTION:
+            raise TypeError('Memoize disk_cache is only available for functions.')
+
         # Register argspec details, these are used to normalize cache keys
         self._argspec = self._GetArgspecObject(*inspect.getargspec(func))
 
+        self._name = '%s.%s' % (func.__module__, func.__name__)
+        self._statistics = IsCacheStatisticsEnabled()
+
         # Create call wrapper, and make it look like the real function
         call = self._CreateCallWrapper(func)
         call.func_name = func.func_name
         call.__name__ = func.__name__
         call.__doc__ = func.__doc__
+
+        if self._statistics:
+            RegisterCache(self)
         return call
 
 
@@ -232,15 +288,173 @@ class Memoize(object):
         '''
         if self._prune_method == self.FIFO:
             from ben10.foundation.fifo import FIFO
-            return FIFO(self._maxsize)
+            cache = FIFO(self._maxsize)
 
         elif self._prune_method == self.LRU:
+            from ben10.foundation.cache_statistics import UnregisterCache
             from ben10.foundation.lru import LRU
-            return LRU(self._maxsize)
+            cache = LRU(self._maxsize)
+            UnregisterCache(cache)  # Reported by the Memoize
 
         else:
             raise AssertionError('Memoize prune method not supported: %s' % self._prune_method)
 
+        if self._statistics:
+            self._caches[id(cache)] = cache
+
+        if self._disk_cache is not None:
+            cache = _DiskBackedCache(
+                cache, self._disk_cache, self._name, self._disk_cache_dependencies)
+
+        if self._statistics:
+            cache = _CacheWithStatistics(cache, self)
+        return cache
+
+
+    def GetCacheStatistics(self):
+        '''
+        :rtype: dict(unicode,object)
+        :returns:
+            The statistics of this cache (see ben10.foundation.cache_statistics). When used in
+            instance methods, the size, memory and evictions are the sum for the caches of all
+            the live instances.
+
+            Only counted if the statistics were enabled when decorating the function (see
+            ben10.foundation.cache_statistics.EnableCacheStatistics).
+        '''
+        size = evictions = memory = 0
+        for cache in self._caches.values():
+            size += len(cache)
+            evictions += getattr(cache, 'evictions', 0)
+            memory += EstimateMemory(cache, cache.iteritems())
+        return dict(
+            name=self._name,
+            hits=self._calls - self._misses,
+            misses=self._misses,
+            evictions=evictions,
+            size=size,
+            memory=memory,
+        )
+
+
+    _FAST_CALL_TEMPLATE = {
+        MEMO_FUNCTION : '''
+def Call(%(params)s):
+    _memoize_key = %(key)s
+    _memoize_res = _memoize_cache_get(_memoize_key, _memoize_sentinel)
+    if _memoize_res is _memoize_sentinel:
+        _memoize_res = _memoize_func(%(params)s)
+        _memoize_cache[_memoize_key] = _memoize_res
+    return _memoize_res
+''',
+        MEMO_INSTANCE_METHOD : '''
+def Call(%(params)s):
+    _memoize_cache = getattr(%(self)s, _memoize_cache_name, None)
+    if _memoize_cache is None:
+        _memoize_cache = _memoize_create_cache()
+        setattr(%(self)s, _memoize_cache_name, _memoize_cache)
+    _memoize_key = %(key)s
+    _memoize_res = _memoize_cache.get(_memoize_key, _memoize_sentinel)
+    if _memoize_res is _memoize_sentinel:
+        _memoize_res = _memoize_func(%(params)s)
+        _memoize_cache[_memoize_key] = _memoize_res
+    return _memoize_res
+''',
+    }
+
+    def _CreateFastCallWrapper(self, func):
+        '''
+        Creates a call wrapper specialized for the signature of the given function, so that the
+        cache key is built directly from the arguments (without going through _GetCacheKey).
+
+        This is only possible when the function only has explicit arguments without default values
+        (and subclasses don't customize the cache key): in this case, the key is a tuple with
+        the arguments (or the argument itself if there's only one or a constant if there are no
+        arguments).
+
+        :param object func:
+            This is the function that is being cached.
+
+        :rtype: function|NoneType
+        :returns:
+            The call wrapper or None if the function signature is not supported.
+        '''
+        import inspect
+
+        if type(self)._GetCacheKey.im_func is not Memoize._GetCacheKey.im_func \
+            or type(self)._GetArgspecObject.im_func is not Memoize._GetArgspecObject.im_func:
+            return None
+
+        if self._disk_cache is not None:
+            # The disk cache dependencies receive the normalized cache key.
+            return None
+
+        if not inspect.isfunction(func):
+            return None
+
+        args, trail, kwargs, defaults = inspect.getargspec(func)
+        if trail is not None or kwargs is not None or defaults:
+            return None
+
+        for arg in args:
+            # Nested arguments (i.e.: def Foo((a, b))) or names clashing with the ones we use.
+            if not isinstance(arg, basestring) or arg.startswith('_memoize_'):
+                return None
+
+        namespace = {
+            '_memoize_func' : func,
+            '_memoize_sentinel' : [],
+        }
+        params = ', '.join(args)
+        if self._memo_target == self.MEMO_INSTANCE_METHOD:
+            if not args:
+                return None
+            self_arg, args = args[0], args[1:]
+            namespace['_memoize_cache_name'] = str('__%s_cache__' % func.__name__)
+            namespace['_memoize_create_cache'] = self._CreateCacheObject
+
+        elif self._memo_target == self.MEMO_FUNCTION:
+            self_arg = None
+            cache = self._CreateCacheObject()
+            namespace['_memoize_cache'] = cache
+            namespace['_memoize_cache_get'] = cache.get
+
+        else:
+            return None
+
+        if not args:
+            key = '()'
+        elif len(args) == 1:
+            key = args[0]
+        else:
+            key = '(%s)' % ', '.join(args)
+
+        source = self._FAST_CALL_TEMPLATE[self._memo_target] % {
+            'self' : self_arg,
+            'params' : params,
+            'key' : key,
+        }
+
+        code = compile(source, '<Memoize %s>' % (func.__name__,), 'exec')
+        exec code in namespace
+        Call = namespace['Call']
+
+        if self_arg is None:
+            Call.ClearCache = cache.clear
+        else:
+            cache_name = namespace['_memoize_cache_name']
+            def ClearCache(self):
+                '''
+                Clears the cache for a given instance (note that self must be passed as a parameter).
+                '''
+                cache = getattr(self, cache_name, None)
+                if cache is not None:
+                    cache.clear()
+
+            Call.ClearCache = ClearCache
+
+        return Call
+
 
     def _CreateCallWrapper(self, func):
         '''
@@ -250,24 +464,48 @@ class Memoize(object):
             This is the function that is being cached.
         '''
         SENTINEL = []
+        ttl = self._ttl
+        if ttl is None:
+            call = self._CreateFastCallWrapper(func)
+            if call is not None:
+                return call
+        else:
+            import time
+
         if self._memo_target == self.MEMO_INSTANCE_METHOD:
 
             outer_self = self
             cache_name = '__%s_cache__' % func.__name__
 
-            def Call(self, *args, **kwargs):
-                cache = getattr(self, cache_name, None)
-                if cache is None:
-                    cache = outer_self._CreateCacheObject()
-                    setattr(self, cache_name, cache)
-
-                #--- GetFromCacheOrCreate: inlined for speed
-                key = outer_self._GetCacheKey(args, kwargs)
-                res = cache.get(key, SENTINEL)
-                if res is SENTINEL:
-                    res = func(self, *args, **kwargs)
-                    cache[key] = res
-                return res
+            if ttl is None:
+                def Call(self, *args, **kwargs):
+                    cache = getattr(self, cache_name, None)
+                    if cache is None:
+                        cache = outer_self._CreateCacheObject()
+                        setattr(self, cache_name, cache)
+
+                    #--- GetFromCacheOrCreate: inlined for speed
+                    key = outer_self._GetCacheKey(args, kwargs)
+                    res = cache.get(key, SENTINEL)
+                    if res is SENTINEL:
+                        res = func(self, *args, **kwargs)
+                        cache[key] = res
+                    return res
+            else:
+                def Call(self, *args, **kwargs):
+                    cache = getattr(self, cache_name, None)
+                    if cache is None:
+                        cache = outer_self._CreateCacheObject()
+                        setattr(self, cache_name, cache)
+
+                    # Entries are stored as (expiration time, result)
+                    key = outer_self._GetCacheKey(args, kwargs)
+                    entry = cache.get(key, SENTINEL)
+                    if entry is SENTINEL or entry[0] <= time.time():
+                        res = func(self, *args, **kwargs)
+                        cache[key] = (time.time() + ttl, res)
+                        return res
+                    return entry[1]
 
             def ClearCache(self):
                 '''
@@ -284,19 +522,226 @@ class Memoize(object):
 
             # When it's a function, we can use the same cache the whole time (i.e.: it's global)
             cache = self._CreateCacheObject()
-            def Call(*args, **kwargs):
-                #--- GetFromCacheOrCreate: inlined for speed
-                key = self._GetCacheKey(args, kwargs)
+            if ttl is None:
+                def Call(*args, **kwargs):
+                    #--- GetFromCacheOrCreate: inlined for speed
+                    key = self._GetCacheKey(args, kwargs)
+                    res = cache.get(key, SENTINEL)
+                    if res is SENTINEL:
+                        res = func(*args, **kwargs)
+                        cache[key] = res
+                    return res
+            else:
+                def Call(*args, **kwargs):
+                    # Entries are stored as (expiration time, result)
+                    key = self._GetCacheKey(args, kwargs)
+                    entry = cache.get(key, SENTINEL)
+                    if entry is SENTINEL or entry[0] <= time.time():
+                        res = func(*args, **kwargs)
+                        cache[key] = (time.time() + ttl, res)
+                        return res
+                    return entry[1]
+
+            Call.ClearCache = cache.clear
+            return Call
+
+        elif self._memo_target == self.MEMO_WEAK_INSTANCE_METHOD:
+            outer_self = self
+            maxsize = self._maxsize
+
+            # A single cache for all the instances, keyed by (id(instance), key)
+            cache = self._CreateCacheObject()
+
+            # id(instance) -> [weakref(instance), set(keys in the cache for the instance), number of
+            # keys that triggers the next pruning of the keys already removed from the cache]
+            instances_keys = {}
+
+            def RemoveInstanceEntries(instance_id):
+                entry = instances_keys.pop(instance_id, None)
+                if entry is not None:
+                    for key in entry[1]:
+                        cache.pop(key, None)
+
+            def AddInstanceKey(instance, key):
+                instance_id = key[0]
+                entry = instances_keys.get(instance_id)
+                if entry is None:
+                    # Note: the callback is called before the id of the instance can be reused.
+                    ref = weakref.ref(instance, lambda ref: RemoveInstanceEntries(instance_id))
+                    entry = instances_keys[instance_id] = [ref, set(), maxsize]
+
+                keys = entry[1]
+                keys.add(key)
+                if len(keys) > entry[2]:
+                    # Forget the keys already pruned from the cache. Pruning again only after the
+                    # number of keys doubles keeps the cost of the scan constant per call.
+                    keys.intersection_update([k for k in keys if k in cache])
+                    entry[2] = max(maxsize, 2 * len(keys))
+
+            def Call(self, *args, **kwargs):
+                key = (id(self), outer_self._GetCacheKey(args, kwargs))
                 res = cache.get(key, SENTINEL)
-                if res is SENTINEL:
-                    res = func(*args, **kwargs)
+                if res is not SENTINEL:
+                    if ttl is None:
+                        return res
+
+                    # Entries are stored as (expiration time, result)
+                    if res[0] > time.time():
+                        return res[1]
+
+                res = func(self, *args, **kwargs)
+                if ttl is None:
                     cache[key] = res
+                else:
+                    cache[key] = (time.time() + ttl, res)
+                AddInstanceKey(self, key)
                 return res
 
-            Call.ClearCache = cache.clear
+            def ClearCache(self):
+                '''
+                Clears the cache for a given instance (note that self must be passed as a parameter).
+                '''
+                RemoveInstanceEntries(id(self))
+
+            Call.ClearCache = ClearCache
             return Call
 
         else:
             raise AssertionError("Don't know how to deal with memo target: %s" % self._memo_target)
 
 
+
+#===================================================================================================
+# _CacheWithStatistics
+#===================================================================================================
+class _CacheWithStatistics(object):
+    '''
+    Cache used by Memoize when the cache statistics are enabled: each call gets its key from the
+    cache (counted as a call) and sets it only when it's missing or expired (counted as a miss), so
+    the call wrappers don't count anything themselves.
+    '''
+
+    def __init__(self, cache, memoize):
+        '''
+        :param object cache:
+            The cache (FIFO, LRU or _DiskBackedCache).
+
+        :param Memoize memoize:
+            The Memoize where the calls and misses are counted.
+        '''
+        self._cache = cache
+        self._memoize = memoize
+
+
+    def get(self, key, default=None):
+        self._memoize._calls += 1
+        return self._cache.get(key, default)
+
+
+    def __setitem__(self, key, value):
+        self._memoize._misses += 1
+        self._cache[key] = value
+
+
+    def pop(self, key, default=None):
+        return self._cache.pop(key, default)
+
+
+    def clear(self):
+        self._cache.clear()
+
+
+    def __contains__(self, key):
+        return key in self._cache
+
+
+    def __len__(self):
+        return len(self._cache)
+
+
+    def iteritems(self):
+        return self._cache.iteritems()
+
+
+
+#===================================================================================================
+# _DiskBackedCache
+#===================================================================================================
+class _DiskBackedCache(object):
+    '''
+    Cache used by Memoize when a disk cache is given: entries are kept in the memory cache and in
+    the disk cache (which is only accessed when an entry is not available in memory).
+    '''
+
+    _SENTINEL = []
+
+    def __init__(self, cache, disk_cache, namespace, get_dependencies):
+        '''
+        :param object cache:
+            The memory cache (FIFO or LRU).
+
+        :param DiskCache disk_cache:
+            The disk cache.
+
+        :param unicode namespace:
+            The namespace of the entries in the disk cache.
+
+        :param callable get_dependencies:
+            Callable which receives a key and returns the files the entry depends on (or None).
+        '''
+        self._cache = cache
+        self._disk_cache = disk_cache
+        self._namespace = namespace
+        self._get_dependencies = get_dependencies
+
+
+    def _GetDependencies(self, key):
+        if self._get_dependencies is None:
+            return ()
+        return self._get_dependencies(key)
+
+
+    def get(self, key, default=None):
+        result = self._cache.get(key, self._SENTINEL)
+        if result is self._SENTINEL:
+            result = self._disk_cache.Get(
+                self._namespace, key, self._GetDependencies(key), self._SENTINEL)
+            if result is self._SENTINEL:
+                return default
+            self._cache[key] = result
+        return result
+
+
+    def __setitem__(self, key, value):
+        self._cache[key] = value
+        try:
+            self._disk_cache.Set(self._namespace, key, value, self._GetDependencies(key))
+        except (IOError, OSError):
+            pass  # The disk cache is just an optimization: go on with the memory cache.
+
+
+    def pop(self, key, default=None):
+        self._disk_cache.Remove(self._namespace, key)
+        return self._cache.pop(key, default)
+
+
+    def clear(self):
+        self._cache.clear()
+        self._disk_cache.Clear(self._namespace)
+
+
+    def __contains__(self, key):
+        return key in self._cache
+
+
+    def __len__(self):
+        return len(self._cache)
+
+
+    def iteritems(self):
+        return self._cache.iteritems()
+
+
+    @property
+    def evictions(self):
+        return getattr(self._cache, 'evictions', 0)
@@ -0,0 +1,71 @@
+from __future__ import unicode_literals
+'''
+Runs many calls of a function using a few threads (for work that is mostly waiting for the disk, the
+network or other processes).
+'''
+import sys
+
+
+
+#===================================================================================================
+# RunInThreads
+#===================================================================================================
+def RunInThreads(function, calls, max_jobs):
+    '''
+    Calls function for each tuple of arguments in calls, using up to max_jobs threads.
+
+    Usage:
+        results = {}
+        def Hash(filename):
+            results[filename] = HashFile(filename)
+        RunInThreads(Hash, [(i,) for i in filenames], max_jobs=4)
+
+    :param callable function:
+        Called with each tuple of arguments. Return values are ignored (store results from the
+        function itself).
+
+    :param list(tuple) calls:
+        The arguments of each call. Calls are started in this order.
+
+    :param int max_jobs:
+        The maximum number of calls running at the same time. With 1 (or less), calls run in the
+        calling thread.
+
+    :raises Exception:
+        The first exception raised by function (after running calls finish, and without starting
+        new ones).
+    '''
+    if max_jobs <= 1 or len(calls) <= 1:
+        for i_args in calls:
+            function(*i_args)
+        return
+
+    import Queue
+    import threading
+
+    pending = Queue.Queue()
+    for i_args in calls:
+        pending.put(i_args)
+    exceptions = []
+
+    def Worker():
+        while not exceptions:
+            try:
+                args = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                function(*args)
+            except Exception:
+                exceptions.append(sys.exc_info())
+
+    workers = [threading.Thread(target=Worker) for _i in xrange(min(max_jobs, len(calls)))]
+    for i_worker in workers:
+        i_worker.daemon = True
+        i_worker.start()
+    for i_worker in workers:
+        i_worker.join()
+
+    if exceptions:
+        exc_type, exc_value, exc_traceback = exceptions[0]
+        raise exc_type, exc_value, exc_traceback
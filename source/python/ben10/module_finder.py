@@ -100,7 +100,7 @@ class ModuleFinder(object):
 
 
     @classmethod
-    def GetImports(cls, directory, out_filters=[]):
+    def GetImports(cls, directory, out_filters=[], file_tree_index=None):
         '''
         Lists imports made by python files found in the given directory.
 
@@ -113,6 +113,10 @@ class ModuleFinder(object):
             List of filename filters
             .. see:: FindFiles
 
+        :param FileTreeIndex|None file_tree_index:
+            If given, the python files are found using this ben10.filesystem.FileTreeIndex (which
+            must contain the directory), instead of walking the directory.
+
         :rtype: list(unicode)
         :returns:
             List of module imported by python
@@ -120,8 +124,10 @@ class ModuleFinder(object):
         from ben10.filesystem import FindFiles
         from modulefinder import ModuleFinder as Finder
 
+        find_files = FindFiles if file_tree_index is None else file_tree_index.FindFiles
+
         finder = Finder(bytes(directory))
-        for py_filename in FindFiles(directory, in_filters='*.py', out_filters=out_filters):
+        for py_filename in find_files(directory, in_filters='*.py', out_filters=out_filters):
             finder.run_script(py_filename)
 
         return map(unicode, sorted(finder.modules.keys() + finder.badmodules.keys()))
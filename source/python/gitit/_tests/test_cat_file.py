@@ -0,0 +1,96 @@
+# coding: UTF-8
+from __future__ import unicode_literals
+from gitit.cat_file import CatFile, CatFileError, FormatIsoDate, GetSubject, ParseCommit
+import os
+import pytest
+
+
+
+#===================================================================================================
+# Test
+#===================================================================================================
+class Test(object):
+
+    def testCatFile(self):
+        # Only reads from the repository, so uses the original test data.
+        cat_file = CatFile(os.path.join(os.path.dirname(__file__), 'test_git', 'remote.git'))
+        try:
+            object_id, object_type, contents = cat_file.GetObject('HEAD~1')
+            assert object_id == '2a5f12d2ba5dd9fd52df8896e6b18b214db29225'
+            assert object_type == 'commit'
+            assert contents.startswith(b'tree ')
+
+            assert cat_file.GetObjectInfo('HEAD~1') == (object_id, 'commit', len(contents))
+            assert cat_file.GetObjectInfo('HEAD:alpha.txt')[1] == 'blob'
+
+            assert cat_file.GetObject('unknown_ref') is None
+            assert cat_file.GetObjectInfo('unknown_ref') is None
+            assert cat_file.GetObject('bad\nname') is None
+
+            assert cat_file.GetShortObjectId(object_id) == '2a5f12d'
+            assert cat_file.GetShortObjectId(object_id, min_length=10) == '2a5f12d2ba'
+
+            # Sessions are restarted after closing.
+            cat_file.Close()
+            assert cat_file.GetObjectInfo('HEAD~1') == (object_id, 'commit', len(contents))
+
+            # Sessions not closed are closed at exit.
+            from gitit.cat_file import _CloseSessions
+            assert cat_file._processes != {}
+            _CloseSessions()
+            assert cat_file._processes == {}
+        finally:
+            cat_file.Close()
+
+
+    def testCatFileUnavailable(self, embed_data):
+        cat_file = CatFile(embed_data['missing_dir'])
+        with pytest.raises(CatFileError):
+            cat_file.GetObject('HEAD')
+
+
+    def testParseCommit(self):
+        contents = (
+            b'tree 4b825dc642cb6eb9a060e54bf8d69288fbee4904\n'
+            b'parent 59b4124603cbb614437a5896d7a028e9df0df276\n'
+            b'parent 2a5f12d2ba5dd9fd52df8896e6b18b214db29225\n'
+            b'author Jo\xe3o da Silva <joao@example.com> 1342542836 -0300\n'
+            b'committer Maria <maria@example.com> 1342553636 +0100\n'
+            b'encoding latin-1\n'
+            b'gpgsig -----BEGIN PGP SIGNATURE-----\n'
+            b' \n'
+            b' -----END PGP SIGNATURE-----\n'
+            b'\n'
+            b'First line\n'
+            b'second line\n'
+            b'\n'
+            b'Body with a\xe7\xe3o\n'
+        )
+        assert ParseCommit('35ff01222f4c79baeccaf98ece11bebff9bec01c', contents) == {
+            'commit' : '35ff01222f4c79baeccaf98ece11bebff9bec01c',
+            'tree' : '4b825dc642cb6eb9a060e54bf8d69288fbee4904',
+            'parents' : [
+                '59b4124603cbb614437a5896d7a028e9df0df276',
+                '2a5f12d2ba5dd9fd52df8896e6b18b214db29225',
+            ],
+            'author_name' : 'João da Silva',
+            'author_email' : 'joao@example.com',
+            'author_date' : 1342542836,
+            'author_timezone' : '-0300',
+            'committer_name' : 'Maria',
+            'committer_email' : 'maria@example.com',
+            'committer_date' : 1342553636,
+            'committer_timezone' : '+0100',
+            'message' : 'First line\nsecond line\n\nBody with ação\n',
+        }
+
+
+    def testFormatIsoDate(self):
+        assert FormatIsoDate(1342542836, '-0300') == '2012-07-17 13:33:56 -0300'
+        assert FormatIsoDate(1342542836, '+0530') == '2012-07-17 22:03:56 +0530'
+
+
+    def testGetSubject(self):
+        assert GetSubject('Subject\n') == 'Subject'
+        assert GetSubject('\n  Subject in\ntwo lines  \n\nBody\n') == '  Subject in two lines'
+        assert GetSubject('') == ''
@@ -0,0 +1,42 @@
+from __future__ import unicode_literals
+from ben10.foundation.disk_cache import DiskCache
+from gitit.commit_cache import CommitCache
+
+
+
+#===================================================================================================
+# Test
+#===================================================================================================
+class Test(object):
+
+    def testCommitCache(self, embed_data):
+        computed = []
+        def Compute(value):
+            def Result():
+                computed.append(value)
+                return value
+            return Result
+
+        cache = CommitCache(size=2)
+        assert cache.GetOrCompute('objects', 'a' * 40, 'GetAuthor', Compute('alpha')) == 'alpha'
+        assert cache.GetOrCompute('objects', 'a' * 40, 'GetAuthor', Compute('other')) == 'alpha'
+        assert cache.GetOrCompute('objects', 'a' * 40, 'GetMessage', Compute('bravo')) == 'bravo'
+        assert cache.GetOrCompute('other', 'a' * 40, 'GetAuthor', Compute('charlie')) == 'charlie'
+        assert computed == ['alpha', 'bravo', 'charlie']
+        assert len(cache) == 2
+
+        cache.Clear()
+        assert len(cache) == 0
+
+        # Entries in the disk cache are available for other instances.
+        disk_cache = DiskCache(embed_data['disk_cache'])
+        cache = CommitCache(disk_cache=disk_cache)
+        del computed[:]
+        assert cache.GetOrCompute('objects', 'a' * 40, 'GetAuthor', Compute('alpha')) == 'alpha'
+
+        cache = CommitCache(disk_cache=disk_cache)
+        assert cache.GetOrCompute('objects', 'a' * 40, 'GetAuthor', Compute('other')) == 'alpha'
+        assert computed == ['alpha']
+
+        cache.Clear()
+        assert cache.GetOrCompute('objects', 'a' * 40, 'GetAuthor', Compute('other')) == 'other'
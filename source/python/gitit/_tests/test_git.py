@@ -1,11 +1,13 @@
 from __future__ import unicode_literals
 from ben10.filesystem import (CanonicalPath, CreateDirectory, CreateFile, DeleteDirectory,
     DeleteFile, GetFileContents)
+from gitit.commit_cache import CommitCache
 from gitit.git import (BranchAlreadyExistsError, DirtyRepositoryError, Git, GitExecuteError,
     GitRefDoesNotExistError, NotCurrentlyInAnyBranchError, RepositoryAccessError,
     SSHServerCantBeFoundError, TargetDirAlreadyExistsError)
 import os
 import pytest
+import time
 
 
 
@@ -104,6 +106,59 @@ class Test(object):
             '59b4124 Adding alpha and bravo files',
         ]
 
+        # Streaming yields the same lines, without caching them.
+        r = git.Log(working_dir, ('--oneline',), streaming=True)
+        assert not isinstance(r, list)
+        assert list(r) == [
+            '35ff012  "Added new_file"',
+            '2a5f12d Added charlie.txt',
+            '59b4124 Adding alpha and bravo files',
+        ]
+
+        # Cached while the repository doesn't change, or until cleared
+        executed = []
+        original_execute = git.Execute
+        def Execute(command_line, *args, **kwargs):
+            executed.append(command_line)
+            return original_execute(command_line, *args, **kwargs)
+        git.Execute = Execute
+        assert len(git.Log(working_dir, ('--oneline',))) == 3
+        assert executed == []
+        git.Log.ClearCache(git)
+        assert len(git.Log(working_dir, ('--oneline',))) == 3
+        assert len(executed) == 1
+
+        # New commits (even made outside this instance) are detected without ClearCache.
+        original_execute('commit --allow-empty -m "Empty commit"', working_dir)
+        r = git.Log(working_dir, ('--oneline',))
+        assert len(r) == 4
+        assert r[0].endswith(' Empty commit')
+
+
+    def testExecuteStreaming(self, git):
+        working_dir = git.cloned_remote
+
+        output_lines = []
+        r = git.Execute(
+            ['log', '--pretty=format:%h'],
+            working_dir,
+            streaming=True,
+            output_callback=output_lines.append,
+        )
+        assert list(r) == ['35ff012', '2a5f12d', '59b4124']
+        assert output_lines == ['35ff012', '2a5f12d', '59b4124']
+
+        # The error is raised when the iteration ends.
+        r = git.Execute(['log', 'unknown_ref'], working_dir, streaming=True)
+        with pytest.raises(GitExecuteError) as e:
+            list(r)
+        assert 'unknown_ref' in e.value.git_msg
+
+        # Stopping before the end kills git without raising errors.
+        r = git.Execute(['log', '--pretty=format:%h'], working_dir, streaming=True)
+        assert next(r) == '35ff012'
+        r.close()
+
 
     def testShow(self, git):
         working_dir = git.cloned_remote
@@ -299,6 +354,47 @@ class Test(object):
         )
 
 
+    def testCatFile(self, git):
+        git.CreateTag(git.cloned_remote, name='tag1', message='tag_message\nother line')
+
+        def GetMetadata():
+            result = []
+            for i_revision in ('HEAD', 'HEAD~1', 'tag1', '59b4124603cbb614437a5896d7a028e9df0df276'):
+                result.append(git.GetAuthor(git.cloned_remote, i_revision))
+                result.append(git.GetAuthorEmail(git.cloned_remote, i_revision))
+                result.append(git.GetMessage(git.cloned_remote, i_revision))
+            for i_revision in ('HEAD', 'HEAD~1', '59b4124603cbb614437a5896d7a028e9df0df276'):
+                result.append(git.GetCommitDict(git.cloned_remote, i_revision))
+            result.append(git.GetTagMessage(git.cloned_remote, 'tag1'))
+            return result
+
+        # The cat-file session gives the same results as executing git for each query.
+        git.commit_cache = None
+        assert git.USE_CAT_FILE
+        cat_file_metadata = GetMetadata()
+        assert os.path.abspath(git.cloned_remote) in git._cat_files
+        git.CloseCatFiles()
+        assert git._cat_files == {}
+
+        git.USE_CAT_FILE = False
+        assert GetMetadata() == cat_file_metadata
+        assert git._cat_files == {}
+
+        # Errors are still reported by git.
+        git.USE_CAT_FILE = True
+        with pytest.raises(GitExecuteError):
+            git.GetAuthor(git.cloned_remote, 'unknown_ref')
+
+        # The least recently used sessions are closed.
+        git.MAX_CAT_FILES = 1
+        assert git.GetCommitDict(git.cloned_remote) == cat_file_metadata[12]
+        cloned_remote_cat_file = git._cat_files[os.path.abspath(git.cloned_remote)]
+        assert cloned_remote_cat_file._processes != {}
+        assert git.GetCommitDict(git.remote)['commit'] == cat_file_metadata[12]['commit']
+        assert git._cat_files.keys() == [os.path.abspath(git.remote)]
+        assert cloned_remote_cat_file._processes == {}
+
+
     def testChangedPaths(self, git):
         assert git.GetChangedPaths(git.cloned_remote, 'HEAD') == set(['new_file'])
         assert git.GetChangedPaths(git.cloned_remote, 'HEAD~1') == set(['charlie.txt'])
@@ -318,6 +414,62 @@ class Test(object):
         )
 
 
+    def testCommitCache(self, git, embed_data, monkeypatch):
+        commit_id = '2a5f12d2ba5dd9fd52df8896e6b18b214db29225'
+
+        def GetCommitData(revision):
+            return (
+                git.GetAuthor(git.cloned_remote, revision),
+                git.GetAuthorEmail(git.cloned_remote, revision),
+                git.GetMessage(git.cloned_remote, revision),
+                git.GetChangedPaths(git.cloned_remote, revision),
+                git.GetCommitStats(git.cloned_remote, revision),
+            )
+
+        expected = GetCommitData(commit_id)
+        assert expected[2] == 'Added charlie.txt'
+        assert len(git.commit_cache) == 5
+
+        # Cached data is kept by ClearCache and obtained without executing git.
+        executed = []
+        original_execute = git.Execute
+        def Execute(command_line, *args, **kwargs):
+            executed.append(command_line)
+            return original_execute(command_line, *args, **kwargs)
+        monkeypatch.setattr(git, 'Execute', Execute)
+        git.USE_CAT_FILE = False
+        git.ClearCache()
+
+        assert GetCommitData(commit_id) == expected
+        assert GetCommitData(commit_id.upper()) == expected
+        assert executed == []
+
+        # Callers may change the results.
+        git.GetChangedPaths(git.cloned_remote, commit_id).add('other')
+        assert git.GetChangedPaths(git.cloned_remote, commit_id) == expected[3]
+
+        # Other revision names are not cached.
+        assert GetCommitData('HEAD~1') == expected
+        assert len(executed) == 5
+        assert len(git.commit_cache) == 5
+
+        # Using a disk cache.
+        from ben10.foundation.disk_cache import DiskCache
+        disk_cache = DiskCache(embed_data['disk_cache'])
+        git.commit_cache = CommitCache(disk_cache=disk_cache)
+        assert GetCommitData(commit_id) == expected
+        assert len(executed) == 10
+
+        git.commit_cache = CommitCache(disk_cache=disk_cache)
+        assert GetCommitData(commit_id) == expected
+        assert len(executed) == 10
+
+        git.commit_cache.Clear()
+        assert len(git.commit_cache) == 0
+        assert GetCommitData(commit_id) == expected
+        assert len(executed) == 15
+
+
     def testCheckout(self, git, embed_data):
         # Charlie.txt exists
         assert os.path.isfile(embed_data['cloned_remote/charlie.txt'])
@@ -418,6 +570,82 @@ class Test(object):
         ) == []
 
 
+    def testIterCommits(self, git, embed_data):
+        cloned_complex = embed_data['cloned_complex']
+        git.Clone(embed_data['complex.git'], cloned_complex)
+
+        revisions = dict(
+            r1='6952d5c4c89bc230288fbc4559f8e659ee0f9c6a',
+            r2='f533d1d30dd042b073d30becca7deb7b901f54e7',
+        )
+
+        # Gives the same results as obtaining each field for each revision.
+        def GetCommits(ignore_merges):
+            return [
+                {
+                    'commit' : i_revision,
+                    'author_name' : git.GetAuthor(cloned_complex, i_revision),
+                    'message' : git.GetMessage(cloned_complex, i_revision),
+                    'changed_paths' : git.GetChangedPaths(cloned_complex, i_revision),
+                }
+                for i_revision
+                in git.GetRevisions(cloned_complex, ignore_merges=ignore_merges, **revisions)
+            ]
+
+        commits = git.IterCommits(cloned_complex, **revisions)
+        assert not isinstance(commits, list)
+        commits = list(commits)
+        assert len(commits) == 6
+        assert commits == GetCommits(ignore_merges=False)
+
+        commits = list(git.IterCommits(cloned_complex, ignore_merges=True, **revisions))
+        assert len(commits) == 5
+        assert commits == GetCommits(ignore_merges=True)
+
+        fields = ['commit', 'short_commit', 'summary', 'iso_date', 'author_email']
+        commits = list(git.IterCommits(cloned_complex, fields=fields, **revisions))
+        for i_commit in commits:
+            commit_dict = git.GetCommitDict(cloned_complex, i_commit['commit'])
+            assert i_commit == {
+                'commit' : commit_dict['commit'],
+                'short_commit' : commit_dict['short_commit'],
+                'summary' : commit_dict['summary'],
+                'iso_date' : commit_dict['iso_date'],
+                'author_email' : commit_dict['author'],
+            }
+
+        # Diff fields
+        commits = list(git.IterCommits(cloned_complex, fields=['parents', 'name_status'], **revisions))
+        assert [len(i['parents']) for i in commits] == [1, 1, 1, 1, 2, 1]
+        for i_commit in commits:
+            changed_paths = git.GetChangedPaths(cloned_complex, i_commit['commit'])
+            assert set(j[-1] for j in i_commit['name_status']) == changed_paths
+
+        commits = list(git.IterCommits(cloned_complex, fields=['numstat'], **revisions))
+        for i_commit in commits:
+            changed_paths = git.GetChangedPaths(cloned_complex, i_commit['commit'])
+            assert set(j[-1] for j in i_commit['numstat']) == changed_paths
+
+        # Branch creation and deletion
+        commits = git.IterCommits(
+            cloned_complex,
+            r1=git.ZERO_REVISION,
+            r2=revisions['r2'],
+            ref='refs/heads/master',
+            fields=['commit'],
+        )
+        assert [i['commit'] for i in commits] == git.GetRevisions(
+            cloned_complex,
+            r1=git.ZERO_REVISION,
+            r2=revisions['r2'],
+            ref='refs/heads/master',
+        )
+        assert list(git.IterCommits(cloned_complex, r1=revisions['r2'], r2=git.ZERO_REVISION)) == []
+
+        with pytest.raises(ValueError):
+            git.IterCommits(cloned_complex, fields=['commit', 'unknown'], **revisions)
+
+
     def testAddCommitPush(self, git, embed_data):
         # We start out with 2 commits
         assert git.GetCommitCount(git.cloned_remote) == 3
@@ -454,6 +682,74 @@ class Test(object):
             git.GetCurrentBranch(git.cloned_remote)
 
 
+    def testValidateCache(self, git, embed_data, monkeypatch):
+        executed = []
+        original_execute = git.Execute
+        def Execute(command_line, *args, **kwargs):
+            executed.append(command_line)
+            return original_execute(command_line, *args, **kwargs)
+        monkeypatch.setattr(git, 'Execute', Execute)
+
+        # Git rewrites the index (refreshing file stats) while files were changed in the same second
+        # as the index.
+        time.sleep(1.1)
+        git.GetDirtyFiles(git.cloned_remote)
+
+        assert git.GetCurrentBranch(git.cloned_remote) == 'master'
+        current_ref = git.GetCurrentRef(git.cloned_remote)
+        assert git.GetDirtyFiles(git.cloned_remote) == []
+        del executed[:]
+
+        # Cached while the repository doesn't change.
+        assert git.GetCurrentBranch(git.cloned_remote) == 'master'
+        assert git.GetCurrentRef(git.cloned_remote) == current_ref
+        assert git.GetDirtyFiles(git.cloned_remote) == []
+        assert executed == []
+
+        # Changes made by git (even outside this instance) are detected without ClearCache.
+        original_execute('checkout -b new_branch', git.cloned_remote)
+        assert git.GetCurrentBranch(git.cloned_remote) == 'new_branch'
+
+        CreateFile(embed_data['cloned_remote/alpha.txt'], contents='modified alpha')
+        original_execute('add alpha.txt', git.cloned_remote)
+        assert git.GetDirtyFiles(git.cloned_remote) == [('M', 'alpha.txt')]
+
+        original_execute('commit -m "Modified alpha"', git.cloned_remote)
+        assert git.GetDirtyFiles(git.cloned_remote) == []
+        assert git.GetCurrentRef(git.cloned_remote) != current_ref
+        assert git.GetCurrentRef(git.cloned_remote) == git.GetCommitDict(git.cloned_remote)['commit']
+
+        # Only the entries of the changed repository are computed again.
+        other_repo = embed_data['other_repo']
+        git.Clone(git.remote, other_repo)
+        other_ref = git.GetCurrentRef(other_repo)
+        current_ref = git.GetCurrentRef(git.cloned_remote)
+        original_execute('checkout -b other_branch', git.cloned_remote)
+        del executed[:]
+        assert git.GetCurrentRef(other_repo) == other_ref
+        assert executed == []
+        assert git.GetCurrentRef(git.cloned_remote) == current_ref
+        assert len(executed) == 1
+        assert git.GetCurrentBranch(git.cloned_remote) == 'other_branch'
+
+        # Entries for previous states are replaced (one for each repository and parameters).
+        assert len(git.__dict__['_cache__GetCurrentRef']) == 2
+        assert len(git.__dict__['_cache__GetCurrentBranch']) == 1
+
+        # Without validation, the cache is only cleared by ClearCache.
+        git.VALIDATE_CACHE = False
+        assert git.GetCurrentBranch(git.cloned_remote) == 'other_branch'
+        original_execute('checkout master', git.cloned_remote)
+        assert git.GetCurrentBranch(git.cloned_remote) == 'other_branch'
+        git.ClearCache()
+        assert git.GetCurrentBranch(git.cloned_remote) == 'master'
+
+        original_execute('checkout other_branch', git.cloned_remote)
+        assert git.GetCurrentBranch(git.cloned_remote) == 'master'
+        git.GetCurrentBranch.ClearCache(git)
+        assert git.GetCurrentBranch(git.cloned_remote) == 'other_branch'
+
+
     def testGetRemoteUrl(self, git, embed_data):
         assert (
             CanonicalPath(git.GetRemoteUrl(git.cloned_remote))
@@ -579,6 +875,64 @@ class Test(object):
         assert git.GetTagMessage(git.cloned_remote, tag_name='tag1') == 'tag_message\nother line'
 
 
+    def testReadRefs(self, git, monkeypatch):
+        git.CreateTag(git.cloned_remote, name='tag1', message='tag_message')
+        git.Execute('tag tag2 HEAD~1', git.cloned_remote)
+        git.Execute('branch other HEAD~2', git.cloned_remote)
+        git.Execute('pack-refs --all', git.cloned_remote)
+        git.Execute('tag tag3 HEAD', git.cloned_remote)
+
+        def GetRefsData():
+            git.ClearCache()
+            return [
+                git.GetCurrentBranch(git.cloned_remote),
+                git.ListBranches(git.cloned_remote),
+                git.ListBranches(git.cloned_remote, remote=True),
+                git.BranchExists(git.cloned_remote, 'other'),
+                git.BranchExists(git.cloned_remote, 'unknown'),
+                git.GetTags(git.cloned_remote),
+                git.GetTags(git.cloned_remote, commit='HEAD'),
+                git.GetTags(git.cloned_remote, commit='tag2'),
+                git.GetTags(git.cloned_remote, commit='tag1'),
+                git.GetTags(git.cloned_remote, commit='other'),
+                git.GetTags(git.remote),
+            ]
+
+        # Reading the refs gives the same results as executing git, without executing it.
+        executed = []
+        original_execute = git.Execute
+        def Execute(command_line, *args, **kwargs):
+            executed.append(command_line)
+            return original_execute(command_line, *args, **kwargs)
+        monkeypatch.setattr(git, 'Execute', Execute)
+
+        assert git.READ_REFS
+        refs_data = GetRefsData()
+        assert refs_data[0] == 'master'
+        assert refs_data[1] == ['master', 'other']
+        assert refs_data[6] == set(['tag1', 'tag3'])
+        assert executed == []
+
+        git.READ_REFS = False
+        assert GetRefsData() == refs_data
+        assert executed != []
+
+        # Cases handled by git.
+        git.READ_REFS = True
+        assert git.GetTags(git.cloned_remote, commit='HEAD~1') == set(['tag2'])
+        short_head = original_execute('rev-parse --short HEAD', git.cloned_remote, flat_output=True)
+        del executed[:]
+        assert git.GetTags(git.cloned_remote, commit=short_head) == refs_data[6]
+        assert len(executed) == 1
+
+        git.Checkout(git.cloned_remote, 'HEAD~1')
+        with pytest.raises(NotCurrentlyInAnyBranchError):
+            git.GetCurrentBranch(git.cloned_remote)
+        del executed[:]
+        assert git.ListBranches(git.cloned_remote)[1:] == ['master', 'other']
+        assert len(executed) == 1
+
+
     def testLocalBranch(self, git, embed_data):
         # Initial test
         assert git.GetCurrentBranch(git.cloned_remote) == 'master'
@@ -663,6 +1017,7 @@ def git(embed_data):
     repositories
     '''
     result = Git()
+    result.commit_cache = CommitCache()  # Don't share cached commits between tests.
     result.remote = embed_data['remote.git']
     result.cloned_remote = embed_data['cloned_remote']
     result.Clone(result.remote, result.cloned_remote)
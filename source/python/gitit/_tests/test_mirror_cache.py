@@ -0,0 +1,83 @@
+from __future__ import unicode_literals
+from ben10.filesystem import CreateFile, FileLock
+from gitit.git import Git
+from gitit.mirror_cache import MirrorCache
+import os
+
+
+
+#===================================================================================================
+# Test
+#===================================================================================================
+class Test(object):
+
+    def testMirrorCache(self, embed_data):
+        git = Git()
+        original_remote = os.path.join(os.path.dirname(__file__), 'test_git', 'remote.git')
+        remote = embed_data['remote.git']
+        git.Execute(['clone', '--bare', original_remote, remote])
+
+        mirror_cache = MirrorCache(embed_data['mirrors'], refresh_interval=3600)
+        git.mirror_cache = mirror_cache
+        mirror_dir = mirror_cache.GetMirrorDir(remote)
+        assert os.path.basename(mirror_dir).startswith('remote-')
+        assert mirror_cache.GetMirrorDir(remote) != mirror_cache.GetMirrorDir(original_remote)
+
+        # Clone creates the mirror and copies the objects from it.
+        executed = []
+        original_execute = git.Execute
+        def Execute(command_line, *args, **kwargs):
+            executed.append(command_line[0])
+            return original_execute(command_line, *args, **kwargs)
+        git.Execute = Execute
+
+        git.Clone(remote, embed_data['clone_1'])
+        assert os.path.isdir(mirror_dir)
+        assert executed == ['clone', 'clone']
+        assert git.GetMessage(embed_data['clone_1'], 'HEAD~1') == 'Added charlie.txt'
+        assert git.GetRemoteUrl(embed_data['clone_1']) == remote
+        assert not os.path.isfile(embed_data['clone_1/.git/objects/info/alternates'])
+
+        # The mirror is not updated again before refresh_interval.
+        del executed[:]
+        git.Clone(remote, embed_data['clone_2'])
+        assert executed == ['clone']
+
+        # Many processes (and threads) may use the same mirror at the same time.
+        with mirror_cache.Use(git, remote) as used_mirror_dir:
+            with mirror_cache.Use(git, remote) as other_used_mirror_dir:
+                assert used_mirror_dir == other_used_mirror_dir == mirror_dir
+            assert not FileLock(mirror_dir[:-len('.git')] + '.lock').Acquire(blocking=False)
+        assert executed == ['clone']
+
+        mirror_cache.dissociate = False
+        git.Clone(remote, embed_data['clone_3'])
+        assert os.path.isfile(embed_data['clone_3/.git/objects/info/alternates'])
+
+        # Fetch obtains the new objects through the mirror.
+        CreateFile(embed_data['clone_1/delta.txt'], 'delta')
+        original_execute('add delta.txt', embed_data['clone_1'])
+        original_execute('-c user.name=test -c user.email=test@ben10.com commit -m "Added delta.txt"', embed_data['clone_1'])
+        original_execute('push origin master', embed_data['clone_1'])
+
+        mirror_cache.refresh_interval = 0
+        git.Fetch(embed_data['clone_2'], remote_name='origin')
+        assert git.GetMessage(embed_data['clone_2'], 'origin/master') == 'Added delta.txt'
+        assert git.GetMessage(mirror_dir, 'master') == 'Added delta.txt'
+
+        # Prune removes the least recently used mirrors, except the ones in use.
+        other_remote = embed_data['other.git']
+        git.Execute(['clone', '--bare', original_remote, other_remote])
+        other_mirror_dir = mirror_cache.Update(git, other_remote)
+        assert os.path.isdir(other_mirror_dir)
+
+        mirror_cache.max_bytes = 1
+        with FileLock(mirror_dir[:-len('.git')] + '.lock'):
+            assert mirror_cache.Prune() == [other_mirror_dir]
+        assert os.path.isdir(mirror_dir)
+        assert mirror_cache.Prune(keep=[mirror_dir]) == []
+        assert mirror_cache.Prune() == [mirror_dir]
+
+        mirror_cache.max_bytes = None
+        assert mirror_cache.Update(git, remote) == mirror_dir
+        assert mirror_cache.Prune() == []
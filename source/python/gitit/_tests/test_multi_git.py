@@ -0,0 +1,66 @@
+from __future__ import unicode_literals
+from ben10.filesystem import CreateFile
+from gitit.git import Git, GitExecuteError, NotCurrentlyInAnyBranchError
+from gitit.multi_git import MultiGit
+import os
+
+
+
+#===================================================================================================
+# Test
+#===================================================================================================
+class Test(object):
+
+    def testMultiGit(self, embed_data):
+        git = Git()
+        remote = os.path.join(os.path.dirname(__file__), 'test_git', 'remote.git')
+        repo_paths = [embed_data['repo_%d' % i] for i in xrange(5)]
+        for i_repo_path in repo_paths:
+            git.Clone(remote, i_repo_path)
+
+        CreateFile(os.path.join(repo_paths[1], 'alpha.txt'), 'changed')
+        git.Checkout(repo_paths[2], 'HEAD~1')
+        not_a_repo = embed_data['not_a_repo']
+        CreateFile(os.path.join(not_a_repo, '.git'), 'gitdir: invalid')
+
+        multi_git = MultiGit(git, max_jobs=2)
+
+        results = multi_git.IsDirty(repo_paths)
+        assert results.results.items() == [
+            (repo_paths[0], False),
+            (repo_paths[1], True),
+            (repo_paths[2], False),
+            (repo_paths[3], False),
+            (repo_paths[4], False),
+        ]
+        assert results.errors == {}
+
+        # Errors are reported for each repository, in the same order.
+        results = multi_git.GetCurrentBranch([not_a_repo] + repo_paths)
+        assert results.results.keys() == [repo_paths[0], repo_paths[1], repo_paths[3], repo_paths[4]]
+        assert set(results.results.values()) == set(['master'])
+        assert results.errors.keys() == [not_a_repo, repo_paths[2]]
+        assert isinstance(results.errors[not_a_repo], GitExecuteError)
+        assert isinstance(results.errors[repo_paths[2]], NotCurrentlyInAnyBranchError)
+
+        # The caches of the shared Git instance are thread-safe: one entry for each repository.
+        multi_git.max_jobs = 8
+        for _i in xrange(3):
+            multi_git.GetCurrentBranch(repo_paths)
+        assert len(git.__dict__['_cache__GetCurrentBranch']) == 4
+
+        results = multi_git.Status(repo_paths, flags=['--short'])
+        assert results.results[repo_paths[1]] == ' M alpha.txt'
+        assert results.results[repo_paths[0]] == ''
+
+        # Output is given with the repository.
+        output = []
+        results = multi_git.Fetch(
+            repo_paths,
+            flags=['--verbose'],
+            output_callback=lambda repo_path, line: output.append(repo_path),
+        )
+        assert results.errors == {}
+        assert set(output) == set(repo_paths)
+
+        assert MultiGit().git is Git.GetSingleton()
@@ -0,0 +1,87 @@
+from __future__ import unicode_literals
+from ben10.filesystem import CreateFile
+from gitit.git import Git
+from gitit.refs import FindGitDir, GetCommonDir, Refs, RefsError
+import os
+import pytest
+
+
+
+#===================================================================================================
+# Test
+#===================================================================================================
+class Test(object):
+
+    def testRefs(self, embed_data):
+        git = Git()
+        repo_path = embed_data['cloned_remote']
+        git.Clone(os.path.join(os.path.dirname(__file__), 'test_git', 'remote.git'), repo_path)
+        git.Execute('config --local user.name "test"', repo_path)
+        git.Execute('config --local user.email "test@ben10.com"', repo_path)
+        git.Execute('tag -a annotated -m message HEAD~1', repo_path)
+        git.Execute('tag lightweight HEAD', repo_path)
+        git.Execute('branch other HEAD~2', repo_path)
+
+        def RevParse(name):
+            return git.Execute(['rev-parse', name], repo_path, flat_output=True)
+
+        def Check(refs):
+            expected = {}
+            for i_line in git.Execute(['show-ref'], repo_path):
+                object_id, ref_name = i_line.split(' ')
+                expected[ref_name] = object_id
+            del expected['refs/remotes/origin/HEAD']  # Symbolic refs are not included
+            assert refs.GetRefs() == expected
+            assert refs.GetRefs('refs/heads/') == {
+                'refs/heads/master' : RevParse('master'),
+                'refs/heads/other' : RevParse('other'),
+            }
+            assert refs.ReadHead() == ('refs/heads/master', RevParse('HEAD'))
+            for i_name in ('HEAD', 'master', 'other', 'annotated', 'lightweight', 'origin/master',
+                'origin', 'refs/heads/other', RevParse('HEAD~1'), RevParse('HEAD~1').upper()):
+                assert refs.Resolve(i_name) == RevParse(i_name).lower(), i_name
+            assert refs.Resolve('HEAD~1') is None
+            assert refs.Resolve('unknown') is None
+
+        refs = Refs.FromPath(os.path.join(repo_path, 'subdir'))
+        assert refs.git_dir == os.path.join(repo_path, '.git')
+        Check(refs)
+        assert refs.GetPeeledRefs() == {}
+
+        # Packed refs (with peeled tags)
+        git.Execute('pack-refs --all', repo_path)
+        assert not os.path.isfile(os.path.join(repo_path, '.git', 'refs', 'heads', 'master'))
+        Check(refs)
+        assert refs.GetPeeledRefs() == {'refs/tags/annotated' : RevParse('annotated^{}')}
+
+        # Loose refs override packed refs
+        git.Execute('branch -f other HEAD~1', repo_path)
+        Check(refs)
+
+        # Detached HEAD
+        git.Execute('checkout --quiet HEAD~1', repo_path)
+        assert refs.ReadHead() == (None, RevParse('HEAD'))
+
+        # Worktrees: HEAD is read from the worktree and the refs from the main repository.
+        worktree = embed_data['worktree']
+        git.Execute(['worktree', 'add', worktree, 'other'], repo_path)
+        refs = Refs.FromPath(worktree)
+        assert GetCommonDir(refs.git_dir) == os.path.join(repo_path, '.git')
+        assert refs.ReadHead() == ('refs/heads/other', RevParse('other'))
+        assert sorted(refs.GetRefs('refs/heads/')) == ['refs/heads/master', 'refs/heads/other']
+
+        # Bare repositories
+        bare = os.path.join(os.path.dirname(__file__), 'test_git', 'remote.git')
+        assert FindGitDir(bare) == bare
+        assert Refs.FromPath(bare).ReadHead()[0] == 'refs/heads/master'
+
+        # Unsupported layouts
+        other_dir = embed_data['other_dir']
+        CreateFile(os.path.join(other_dir, '.git'), 'invalid')
+        assert FindGitDir(other_dir) is None
+        with pytest.raises(RefsError):
+            Refs.FromPath(other_dir)
+
+        CreateFile(os.path.join(repo_path, '.git', 'refs', 'heads', 'invalid'), 'invalid\n')
+        with pytest.raises(RefsError):
+            Refs.FromPath(repo_path).GetRefs('refs/heads/')
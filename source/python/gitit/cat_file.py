@@ -0,0 +1,355 @@
+from __future__ import unicode_literals
+'''
+Long-lived `git cat-file --batch` sessions, answering object lookups over a pipe instead of spawning
+a git process for each query.
+'''
+import atexit
+import datetime
+import os
+import subprocess
+import threading
+import weakref
+
+
+
+# Length of abbreviated object ids when it can't be obtained from git.
+DEFAULT_ABBREV_LENGTH = 7
+
+# The sessions with running processes, finished at exit (see _CloseSessions).
+_running_sessions = weakref.WeakSet()
+
+
+
+#===================================================================================================
+# CatFile
+#===================================================================================================
+class CatFile(object):
+    '''
+    A `git cat-file --batch` (and `--batch-check`) session for a repository.
+
+    Usage:
+        cat_file = CatFile('/home/user/project')
+        object_id, object_type, contents = cat_file.GetObject('HEAD^{commit}')
+        commit = ParseCommit(object_id, contents)
+        cat_file.Close()
+
+    Object names are resolved by git at each query (refs are read again), so the session stays valid
+    when refs change. The processes are started on demand and are thread-safe. Sessions not closed
+    are closed at exit.
+    '''
+
+    def __init__(self, repo_path, git_executable='git'):
+        '''
+        :param unicode repo_path:
+            Path to the repository (local)
+
+        :param unicode git_executable:
+            The git executable used to start the sessions.
+        '''
+        self.repo_path = repo_path
+        self._git_executable = git_executable
+        self._processes = {}
+        self._lock = threading.Lock()
+        self._abbrev_length = None
+
+
+    def GetObject(self, name):
+        '''
+        :param unicode name:
+            Any object name accepted by git (object id, ref, "HEAD~2", "v1.0^{commit}", etc.)
+
+        :rtype: tuple(unicode, unicode, bytes)|None
+        :returns:
+            The object id, the object type and the raw contents of the object, or None if there is
+            no (or more than one) object with the given name.
+
+        :raises CatFileError:
+            If the session is not available (e.g. repo_path is not a git repository).
+        '''
+        with self._lock:
+            process = self._GetProcess('--batch')
+            header = self._Query(process, name)
+            if header is None:
+                return None
+            object_id, object_type, size = header
+            contents = process.stdout.read(size)
+            process.stdout.read(1)  # The eol after the contents
+            if len(contents) != size:
+                self._Kill('--batch')
+                raise CatFileError(self.repo_path, 'Unexpected end of output')
+            return object_id, object_type, contents
+
+
+    def GetObjectInfo(self, name):
+        '''
+        :param unicode name:
+            .. seealso:: GetObject
+
+        :rtype: tuple(unicode, unicode, int)|None
+        :returns:
+            The object id, the object type and the size of the object, or None if there is no (or
+            more than one) object with the given name.
+
+        :raises CatFileError:
+            .. seealso:: GetObject
+        '''
+        with self._lock:
+            return self._Query(self._GetProcess('--batch-check'), name)
+
+
+    def GetShortObjectId(self, object_id, min_length=None):
+        '''
+        :param unicode object_id:
+            A full object id.
+
+        :param int|None min_length:
+            The minimum length of the result. If None, uses the length of the abbreviated object ids
+            in this repository (as given by `git rev-parse --short`, obtained only once).
+
+        :returns unicode:
+            The shortest unique prefix of object_id with at least min_length chars, like git does for
+            abbreviated object ids.
+        '''
+        if min_length is None:
+            min_length = self._GetAbbrevLength(object_id)
+
+        for i_length in xrange(min_length, len(object_id)):
+            info = self.GetObjectInfo(object_id[:i_length])
+            if info is not None and info[0] == object_id:
+                return object_id[:i_length]
+        return object_id
+
+
+    def Close(self):
+        '''
+        Finishes the git processes. The session is started again if used after this.
+        '''
+        with self._lock:
+            for i_mode in self._processes.keys():
+                self._Kill(i_mode)
+
+
+    def _GetAbbrevLength(self, object_id):
+        '''
+        :returns int:
+            The length of abbreviated object ids in the repository, which depends on the git
+            configuration and on the number of objects.
+        '''
+        if self._abbrev_length is None:
+            popen = subprocess.Popen(
+                [self._git_executable, 'rev-parse', '--short', object_id],
+                cwd=self.repo_path,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            )
+            output = popen.communicate()[0].strip()
+            if popen.returncode == 0 and output:
+                self._abbrev_length = len(output)
+            else:
+                self._abbrev_length = DEFAULT_ABBREV_LENGTH
+        return self._abbrev_length
+
+
+    def _GetProcess(self, mode):
+        process = self._processes.get(mode)
+        if process is None:
+            try:
+                with open(os.devnull, 'wb') as devnull:
+                    process = subprocess.Popen(
+                        [self._git_executable, 'cat-file', mode],
+                        cwd=self.repo_path,
+                        stdin=subprocess.PIPE,
+                        stdout=subprocess.PIPE,
+                        stderr=devnull,
+                    )
+            except OSError, e:
+                raise CatFileError(self.repo_path, unicode(e))
+            self._processes[mode] = process
+            _running_sessions.add(self)
+        return process
+
+
+    def _Kill(self, mode):
+        process = self._processes.pop(mode)
+        try:
+            process.stdin.close()
+        except IOError:
+            pass  # The process is already gone.
+        process.stdout.close()
+        process.wait()
+
+
+    def _Query(self, process, name):
+        '''
+        Sends an object name to the given process and reads the header of the answer.
+
+        :rtype: tuple(unicode, unicode, int)|None
+        '''
+        if '\n' in name:
+            return None  # Can't be sent through the batch protocol (and is not a valid name).
+
+        try:
+            process.stdin.write(name.encode('utf-8') + b'\n')
+            process.stdin.flush()
+            header = process.stdout.readline()
+        except IOError, e:
+            header = b''
+            error_message = unicode(e)
+        else:
+            error_message = 'Unexpected end of output'
+
+        if not header.endswith(b'\n'):
+            for i_mode, i_process in self._processes.items():
+                if i_process is process:
+                    self._Kill(i_mode)
+            raise CatFileError(self.repo_path, error_message)
+
+        if header.endswith(b' missing\n') or header.endswith(b' ambiguous\n'):
+            return None
+
+        object_id, object_type, size = header.split()
+        return object_id.decode('ascii'), object_type.decode('ascii'), int(size)
+
+
+
+@atexit.register
+def _CloseSessions():
+    '''
+    Finishes the processes of the sessions not closed (at exit).
+    '''
+    for i_session in list(_running_sessions):
+        i_session.Close()
+
+
+
+#===================================================================================================
+# ParseCommit
+#===================================================================================================
+def ParseCommit(object_id, contents, encoding_errors='replace'):
+    '''
+    Parses the raw contents of a commit object.
+
+    :param unicode object_id:
+        The id of the commit.
+
+    :param bytes contents:
+        The raw contents of the commit (as returned by CatFile.GetObject)
+
+    :param unicode encoding_errors:
+        Error handler for decoding (strict, ignore, replace, etc). The commit is decoded with the
+        encoding in its header, or utf-8.
+
+    :rtype: dict(unicode,object)
+    :returns:
+        ['commit']: The commit id
+        ['tree']: The tree id
+        ['parents']: List of parent commit ids
+        ['author_name'], ['author_email'], ['author_date'], ['author_timezone']
+        ['committer_name'], ['committer_email'], ['committer_date'], ['committer_timezone']
+            The dates are unix timestamps (int) and the time zones are offsets like "-0300".
+        ['message']: The raw commit message
+    '''
+    headers, _separator, message = contents.partition(b'\n\n')
+
+    # Header values may continue in the next lines (starting with a space), e.g. gpgsig.
+    header_lines = []
+    for i_line in headers.split(b'\n'):
+        if i_line.startswith(b' ') and header_lines:
+            header_lines[-1] += b'\n' + i_line[1:]
+        else:
+            header_lines.append(i_line)
+
+    encoding = 'utf-8'
+    for i_line in header_lines:
+        if i_line.startswith(b'encoding '):
+            encoding = i_line.split(b' ', 1)[1].decode('ascii')
+
+    def Decode(value):
+        try:
+            return value.decode(encoding, encoding_errors)
+        except LookupError:  # Unknown encoding in the commit header.
+            return value.decode('utf-8', encoding_errors)
+
+    result = {
+        'commit' : object_id,
+        'parents' : [],
+        'message' : Decode(message),
+    }
+    for i_line in header_lines:
+        key, _separator, value = i_line.partition(b' ')
+        if key == b'tree':
+            result['tree'] = value.decode('ascii')
+        elif key == b'parent':
+            result['parents'].append(value.decode('ascii'))
+        elif key in (b'author', b'committer'):
+            name, email, date, timezone = _ParseIdent(Decode(value))
+            key = key.decode('ascii')
+            result[key + '_name'] = name
+            result[key + '_email'] = email
+            result[key + '_date'] = date
+            result[key + '_timezone'] = timezone
+    return result
+
+
+def _ParseIdent(ident):
+    '''
+    :param unicode ident:
+        An author or committer line, e.g. "John <john@example.com> 1342542836 -0300"
+
+    :rtype: tuple(unicode, unicode, int, unicode)
+    :returns:
+        The name, email, timestamp and time zone.
+    '''
+    name, _separator, rest = ident.partition('<')
+    email, _separator, date = rest.rpartition('>')
+    date = date.split()
+    timestamp = int(date[0]) if date else 0
+    timezone = date[1] if len(date) > 1 else '+0000'
+    return name.strip(), email, timestamp, timezone
+
+
+def FormatIsoDate(timestamp, timezone):
+    '''
+    :param int timestamp:
+        A unix timestamp.
+
+    :param unicode timezone:
+        The time zone offset, like "-0300".
+
+    :returns unicode:
+        The date in the same format used by git for "%ci", e.g. "2012-07-17 13:33:56 -0300"
+    '''
+    sign = -1 if timezone.startswith('-') else 1
+    offset = sign * (int(timezone[1:3]) * 3600 + int(timezone[3:5]) * 60)
+    date = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=timestamp + offset)
+    return '%s %s' % (date.strftime('%Y-%m-%d %H:%M:%S'), timezone)
+
+
+def GetSubject(message):
+    '''
+    :param unicode message:
+        A raw commit message.
+
+    :returns unicode:
+        The subject of the message, like git "%s": the first paragraph in a single line.
+    '''
+    lines = []
+    for i_line in message.lstrip('\n').split('\n'):
+        i_line = i_line.rstrip()
+        if not i_line:
+            break
+        lines.append(i_line)
+    return ' '.join(lines)
+
+
+
+#===================================================================================================
+# CatFileError
+#===================================================================================================
+class CatFileError(RuntimeError):
+    '''
+    Raised when a cat-file session is not available for a repository.
+    '''
+    def __init__(self, repo_path, message):
+        self.repo_path = repo_path
+        RuntimeError.__init__(self, 'git cat-file session for "%s" failed: %s' % (repo_path, message))
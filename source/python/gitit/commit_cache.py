@@ -0,0 +1,100 @@
+from __future__ import unicode_literals
+'''
+A cache for the data of git objects which never changes (i.e.: the author or the changed paths of a
+commit), keyed by the object store of the repository and the full object id.
+'''
+from ben10.foundation.lru import ConcurrentLRU
+
+
+
+DEFAULT_SIZE = 50000
+
+
+#===================================================================================================
+# CommitCache
+#===================================================================================================
+class CommitCache(object):
+    '''
+    Usage:
+        commit_cache = CommitCache(disk_cache=DiskCache('/home/user/.cache/gitit'))
+        author = commit_cache.GetOrCompute(
+            '/home/user/project/.git/objects',
+            '2a5f12d2ba5dd9fd52df8896e6b18b214db29225',
+            'GetAuthor',
+            lambda: ComputeAuthor(),
+        )
+
+    Entries are kept in a (thread-safe) LRU and, optionally, in a DiskCache, so that they are
+    available for later processes. Entries never expire: only use it for data fully determined by
+    the object id.
+
+    Values must be picklable when using a disk cache.
+    '''
+
+    DISK_CACHE_NAMESPACE = 'gitit_commit_cache'
+
+    def __init__(self, size=DEFAULT_SIZE, disk_cache=None):
+        '''
+        :param int size:
+            The maximum number of entries kept in memory.
+
+        :param DiskCache|None disk_cache:
+            If given, entries are also stored in this ben10.foundation.disk_cache.DiskCache.
+        '''
+        self._lru = ConcurrentLRU(size)
+        self.disk_cache = disk_cache
+
+
+    _SENTINEL = []
+
+    def GetOrCompute(self, object_store, object_id, query, compute):
+        '''
+        :param unicode object_store:
+            Path to the objects directory of the repository.
+
+        :param unicode object_id:
+            A full object id.
+
+        :param unicode query:
+            Identifies the data cached for the object (i.e.: the name of the method).
+
+        :param callable compute:
+            Callable without parameters which returns the data when it is not in the cache.
+
+        :rtype: object
+        :returns:
+            The data stored (or computed) for the object.
+        '''
+        key = (object_store, object_id, query)
+
+        def Compute():
+            if self.disk_cache is not None:
+                value = self.disk_cache.Get(self.DISK_CACHE_NAMESPACE, key, default=self._SENTINEL)
+                if value is not self._SENTINEL:
+                    return value
+
+            value = compute()
+
+            if self.disk_cache is not None:
+                self.disk_cache.Set(self.DISK_CACHE_NAMESPACE, key, value)
+            return value
+
+        return self._lru.get_or_compute(key, Compute)
+
+
+    def Clear(self):
+        '''
+        Removes all the entries, including the ones in the disk cache.
+        '''
+        self._lru.clear()
+        if self.disk_cache is not None:
+            self.disk_cache.Clear(self.DISK_CACHE_NAMESPACE)
+
+
+    def __len__(self):
+        '''
+        :rtype: int
+        :returns:
+            The number of entries in memory.
+        '''
+        return len(self._lru)
@@ -1,8 +1,73 @@
 from __future__ import unicode_literals
-from ben10.foundation.memoize import Memoize
 from ben10.foundation.singleton import Singleton
+from gitit.commit_cache import CommitCache
+from gitit.refs import FULL_OBJECT_ID_RE, FindGitDir, GetCommonDir
 import os
 import posixpath
+import threading
+
+
+
+#===================================================================================================
+# _CacheByRepositoryState
+#===================================================================================================
+class _CacheByRepositoryState(object):
+    '''
+    Decorator for Git methods whose last parameter is the repository state (see
+    Git._GetRepositoryState). Caches the results for each Git instance and each set of the other
+    parameters: the entry is used while the state is the same, and replaced when it changes (so
+    entries for previous states don't accumulate).
+
+    Unlike Memoize, it's thread-safe (e.g. for MultiGit). The decorated method has ClearCache(git).
+    '''
+
+    _lock = threading.Lock()
+
+    def __init__(self, maxsize):
+        '''
+        :param int maxsize:
+            The maximum number of entries (for each Git instance).
+        '''
+        self._maxsize = maxsize
+
+
+    def __call__(self, method):
+        from ben10.foundation.fifo import FIFO
+        import functools
+
+        cache_name = '_cache_' + method.__name__
+        lock = self._lock
+        maxsize = self._maxsize
+
+        def GetCache(git):
+            with lock:
+                cache = git.__dict__.get(cache_name)
+                if cache is None:
+                    cache = git.__dict__[cache_name] = FIFO(maxsize)
+                return cache
+
+        @functools.wraps(method)
+        def Cached(git, *args):
+            key, repository_state = args[:-1], args[-1]
+            cache = GetCache(git)
+            with lock:
+                entry = cache.get(key)
+            if entry is not None and entry[0] == repository_state:
+                return entry[1]
+
+            # Not locked while computing: other threads may compute (and store) the same entry.
+            result = method(git, *args)
+            with lock:
+                cache[key] = (repository_state, result)
+            return result
+
+        def ClearCache(git):
+            cache = GetCache(git)
+            with lock:
+                cache.clear()
+
+        Cached.ClearCache = ClearCache
+        return Cached
 
 
 
@@ -13,8 +78,10 @@ class Git(Singleton):
     '''
     Python interface to git commands. Uses git executable available in the current environment.
 
-    Some functions use Memoize for cache, and assume that files in a repository will not change
-    during the lifetime of a Git instance.
+    Some functions use a cache, and assume that files in a repository will not change
+    during the lifetime of a Git instance. The cache of Log, GetCurrentBranch, GetCurrentRef and
+    GetDirtyFiles for a repository is discarded when its HEAD, index or current branch change (see
+    VALIDATE_CACHE), but changes in working tree files are not detected.
 
     If you want to ensure that no cache is used, create a new instance of Git whenever necessary,
 
@@ -29,20 +96,293 @@ class Git(Singleton):
     # commands to fail because someone is using the wrong encoding.
     OUTPUT_ENCODING_ERRORS = 'replace'
 
+    # Number of output lines kept to report errors when streaming the output of a git command.
+    STREAMING_ERROR_LINES = 100
+
+    # Fields available for Git.IterCommits, with their `git log` format placeholders.
+    COMMIT_FORMAT_FIELDS = {
+        'commit' : '%H',
+        'short_commit' : '%h',
+        'parents' : '%P',
+        'author_name' : '%an',
+        'author_email' : '%ae',
+        'iso_date' : '%ci',
+        'summary' : '%s',
+        'message' : '%B',
+    }
+
+    # Diff fields available for Git.IterCommits, with their `git log` option.
+    COMMIT_DIFF_FIELDS = {
+        'changed_paths' : '--name-only',
+        'name_status' : '--name-status',
+        'numstat' : '--numstat',
+    }
+
+    DEFAULT_COMMIT_FIELDS = ('commit', 'author_name', 'message', 'changed_paths')
+
+    # If True, commit and tag metadata queries (GetAuthor, GetMessage, GetCommitDict, etc) are
+    # answered by a long-lived `git cat-file --batch` session per repository instead of starting a
+    # new git process for each query.
+    USE_CAT_FILE = True
+
+    # The maximum number of cat-file sessions (each one with up to 2 git processes) kept by each
+    # instance: the least recently used session is closed when a new one is needed. Sessions still
+    # open are closed at exit.
+    MAX_CAT_FILES = 8
+
+    # Cache for data fully determined by a commit id (author, message, changed paths and stats),
+    # used when the revision is given as a full commit id. Shared by all instances and kept by
+    # ClearCache, since this data never changes. Replace it by a CommitCache with a disk_cache to
+    # keep the data between processes, or by None to disable it.
+    commit_cache = CommitCache()
+
+    # If given, a gitit.mirror_cache.MirrorCache with local mirrors of remote repositories, used by
+    # Clone and Fetch to obtain objects from the mirror instead of downloading them again.
+    mirror_cache = None
+
+    # If True, Log, GetCurrentBranch, GetCurrentRef and GetDirtyFiles check the modification times
+    # of HEAD, index, packed-refs and the current branch ref in the git directory (without executing
+    # git) and compute their results again when any of those changed (e.g. after a commit, checkout
+    # or reset).
+    VALIDATE_CACHE = True
+
+    # If True, GetCurrentBranch, ListBranches (and BranchExists) and GetTags read HEAD and refs
+    # directly from the git directory (see gitit.refs), executing git only for cases not handled
+    # there (detached HEAD, branches without commits, revision expressions, etc).
+    READ_REFS = True
+
     # Constants for common refs
     ZERO_REVISION = '0' * 40
     REFS_HEADS = 'refs/heads/'
     REFS_TAGS = 'refs/tags/'
 
 
+    def __init__(self):
+        from ben10.foundation.odict import odict
+        self._cat_files = odict()  # Least recently used first
+        self._cat_files_lock = threading.Lock()
+        self._object_stores = {}
+
+
     def ClearCache(self):
         '''
-        Clears Memoize cache from all our methods
+        Clears the cache from all our methods
+        '''
+        self._Log.ClearCache(self)
+        self._GetCurrentBranch.ClearCache(self)
+        self._GetCurrentRef.ClearCache(self)
+        self._GetDirtyFiles.ClearCache(self)
+
+
+    def CloseCatFiles(self):
+        '''
+        Finishes the `git cat-file` sessions used by metadata queries (see USE_CAT_FILE). They are
+        started again when needed.
+        '''
+        with self._cat_files_lock:
+            cat_files = self._cat_files.values()
+            self._cat_files.clear()
+        for i_cat_file in cat_files:
+            i_cat_file.Close()
+
+
+    def _GetCatFileObject(self, repo_path, name):
+        '''
+        :param unicode repo_path:
+            Path to the repository (local)
+
+        :param unicode name:
+            Object name, resolved by git.
+
+        :rtype: tuple(unicode, unicode, bytes)|None
+        :returns:
+            The object id, type and raw contents (see CatFile.GetObject), or None if the cat-file
+            session is disabled or can't answer. Callers then execute git, which also reports the
+            errors as usual.
+        '''
+        return self._QueryCatFile(repo_path, 'GetObject', name)
+
+
+    def _GetCatFileObjectInfo(self, repo_path, name):
+        '''
+        :rtype: tuple(unicode, unicode, int)|None
+        :returns:
+            The object id, type and size (see CatFile.GetObjectInfo), or None.
+
+        .. seealso:: _GetCatFileObject
+        '''
+        return self._QueryCatFile(repo_path, 'GetObjectInfo', name)
+
+
+    def _QueryCatFile(self, repo_path, method_name, name):
+        if not self.USE_CAT_FILE:
+            return None
+
+        from gitit.cat_file import CatFileError
+
+        try:
+            return getattr(self._GetCatFile(repo_path), method_name)(name)
+        except CatFileError:
+            return None
+
+
+    def _GetCatFile(self, repo_path):
+        '''
+        :param unicode repo_path:
+            Path to the repository (local)
+
+        :rtype: CatFile
+        :returns:
+            The cat-file session for the repository (created if needed, closing the least recently
+            used one if there are more than MAX_CAT_FILES).
+        '''
+        from gitit.cat_file import CatFile
+
+        cat_file_path = os.path.abspath(repo_path or '.')
+        closed = []
+        with self._cat_files_lock:
+            cat_file = self._cat_files.pop(cat_file_path, None)
+            if cat_file is None:
+                cat_file = CatFile(cat_file_path)
+            self._cat_files[cat_file_path] = cat_file
+            while len(self._cat_files) > self.MAX_CAT_FILES:
+                closed.append(self._cat_files.popitem(0)[1])
+
+        for i_cat_file in closed:
+            i_cat_file.Close()
+        return cat_file
+
+
+    def _GetCatFileCommit(self, repo_path, revision):
+        '''
+        :rtype: dict(unicode,object)|None
+        :returns:
+            The commit pointed by revision, parsed by cat_file.ParseCommit, or None.
+
+        .. seealso:: _GetCatFileObject
+        '''
+        commit_object = self._GetCatFileObject(repo_path, revision + '^{commit}')
+        if commit_object is None:
+            return None
+
+        from gitit.cat_file import ParseCommit
+        commit_id, _object_type, contents = commit_object
+        return ParseCommit(commit_id, contents, encoding_errors=self.OUTPUT_ENCODING_ERRORS)
+
+
+    def _GetObjectStore(self, repo_path):
+        '''
+        :param unicode repo_path:
+            Path to the repository (local)
+
+        :returns unicode:
+            The objects directory of the repository (shared by all its worktrees), obtained only once
+            for each repo_path.
+        '''
+        repo_path = os.path.abspath(repo_path or '.')
+        result = self._object_stores.get(repo_path)
+        if result is None:
+            git_dir = self.Execute(['rev-parse', '--git-dir'], repo_path, flat_output=True)
+            git_dir = os.path.normpath(os.path.join(repo_path, git_dir))
+            result = self._object_stores[repo_path] = os.path.join(GetCommonDir(git_dir), 'objects')
+        return result
+
+
+    def _ReadRefs(self, path, read):
+        '''
+        :param unicode path:
+            Path within a Git repository.
+
+        :param callable read:
+            Receives a gitit.refs.Refs for the repository and returns the result, or None if it can't
+            be obtained from the refs.
+
+        :returns object|None:
+            The result of read, or None if READ_REFS is False or the refs can't be read. Callers then
+            execute git.
         '''
-        self.Log.ClearCache(self)
-        self.GetCurrentBranch.ClearCache(self)
-        self.GetCurrentRef.ClearCache(self)
-        self.GetDirtyFiles.ClearCache(self)
+        if not self.READ_REFS:
+            return None
+
+        from gitit.refs import Refs, RefsError
+        try:
+            return read(Refs.FromPath(path))
+        except RefsError:
+            return None
+
+
+    def _GetRepositoryState(self, path, index=True):
+        '''
+        Obtains (without executing git) a value that changes whenever HEAD, the current branch or the
+        index of a repository change. Used to validate the cache of Log, GetCurrentBranch,
+        GetCurrentRef and GetDirtyFiles: entries computed for a previous state are replaced (see
+        _CacheByRepositoryState).
+
+        :param unicode path:
+            Path within a Git repository.
+
+        :param bool index:
+            If False, ignores the index (which is also rewritten by git when refreshing file stats,
+            e.g. by `git status`).
+
+        :rtype: tuple|None
+        :returns:
+            The contents of HEAD and the (modification time, size, inode) of the files HEAD,
+            packed-refs, the ref pointed by HEAD and index. None if VALIDATE_CACHE is False or if the
+            git directory is not found.
+        '''
+        if not self.VALIDATE_CACHE:
+            return None
+
+        git_dir = FindGitDir(path)
+        if git_dir is None:
+            return None
+        common_dir = GetCommonDir(git_dir)
+
+        head_filename = os.path.join(git_dir, 'HEAD')
+        try:
+            with open(head_filename, 'rb') as head_file:
+                head = head_file.read().strip()
+        except IOError:
+            head = None
+
+        filenames = [head_filename, os.path.join(common_dir, 'packed-refs')]
+        if head is not None and head.startswith(b'ref: '):
+            filenames.append(os.path.join(common_dir, head[5:].decode('utf-8', 'replace')))
+        if index:
+            filenames.append(os.path.join(git_dir, 'index'))
+
+        return (head,) + tuple(_GetFileState(i) for i in filenames)
+
+
+    def _GetCommitData(self, repo_path, revision, query, compute):
+        '''
+        Obtains data fully determined by a commit id through commit_cache.
+
+        :param unicode repo_path:
+            Path to the repository (local)
+
+        :param unicode revision:
+            The revision. Only full commit ids are cached, any other name (refs, "HEAD~1", short
+            ids) may point to other commits later.
+
+        :param unicode query:
+            Identifies the data in the cache.
+
+        :param callable compute:
+            Obtains the data when it is not in the cache.
+
+        :returns object:
+            A copy of the data, so that callers may change it.
+        '''
+        if self.commit_cache is None or FULL_OBJECT_ID_RE.match(revision) is None:
+            return compute()
+
+        import copy
+        result = self.commit_cache.GetOrCompute(
+            self._GetObjectStore(repo_path), revision.lower(), query, compute
+        )
+        return copy.copy(result)
 
 
     def Execute(
@@ -50,6 +390,7 @@ class Git(Singleton):
         command_line,
         repo_path=None,
         flat_output=False,
+        streaming=False,
         **kwargs
         ):
         '''
@@ -66,12 +407,23 @@ class Git(Singleton):
         :param bool flat_output:
             If True, joins the output lines with '\n' (returning a single string)
 
+        :param bool streaming:
+            If True, returns an iterator that yields the output lines as git generates them, instead
+            of keeping the whole output in memory. Git runs as the iterator is consumed and
+            GitExecuteError is raised when it ends.
+
+            The return code is only checked when the whole output is consumed: if the iteration
+            stops earlier (the iterator is closed or garbage collected), git is killed and no error
+            is raised.
+
+            Can't be used with flat_output.
+
         :param kwargs:
             .. seealso:: ben10.execute.Execute
 
-        :returns list(unicode)|unicode:
+        :returns list(unicode)|unicode|iter(unicode):
             List of lines output from git command, or the complete output if parameter flat_output
-            is True
+            is True, or an iterator over the lines if parameter streaming is True
 
         :raises GitExecuteError:
             If the git executable returns an error code
@@ -85,6 +437,24 @@ class Git(Singleton):
         output_encoding = kwargs.pop('output_encoding', self.OUTPUT_ENCODING)
         output_encoding_errors = kwargs.pop('output_encoding_errors', self.OUTPUT_ENCODING_ERRORS)
 
+        # TODO: BEN-31: Refactor System.Execute and derivates (git, scons, etc)
+        if clean_eol:
+            output_joiner = '\n'
+        else:
+            output_joiner = ''
+
+        if streaming:
+            assert not flat_output, 'flat_output is not supported when streaming'
+            return self._IterExecute(
+                command_line,
+                repo_path,
+                output_joiner,
+                clean_eol=clean_eol,
+                output_encoding=output_encoding,
+                output_encoding_errors=output_encoding_errors,
+                **kwargs
+            )
+
         from ben10.execute import Execute2
         output, retcode = Execute2(
             command_line,
@@ -95,12 +465,6 @@ class Git(Singleton):
             **kwargs
         )
 
-        # TODO: BEN-31: Refactor System.Execute and derivates (git, scons, etc)
-        if clean_eol:
-            output_joiner = '\n'
-        else:
-            output_joiner = ''
-
         if retcode != 0:
             raise GitExecuteError(' '.join(command_line), retcode, output_joiner.join(output))
 
@@ -109,6 +473,46 @@ class Git(Singleton):
 
         return output
 
+
+    def _IterExecute(self, command_line, repo_path, output_joiner, output_callback=None, **kwargs):
+        '''
+        Generator used by Execute when streaming.
+
+        GitExecuteError is raised only after the last line: when the caller stops earlier,
+        IterExecute kills git and its (killed) return code is ignored.
+
+        :param list(unicode) command_line:
+            The complete command line, including 'git'.
+
+        :param unicode output_joiner:
+            Used to join the last output lines in the GitExecuteError message.
+
+        .. seealso:: Execute
+        '''
+        import collections
+        from ben10.execute import IterExecute
+
+        return_code = [None]
+
+        def CallbackReturnCode(ret):
+            return_code[0] = ret
+
+        # Only the last lines are kept, to report them in case of errors.
+        last_lines = collections.deque(maxlen=self.STREAMING_ERROR_LINES)
+        for line in IterExecute(
+                command_line,
+                cwd=repo_path,
+                return_code_callback=CallbackReturnCode,
+                **kwargs
+            ):
+            if output_callback:
+                output_callback(line)
+            last_lines.append(line)
+            yield line
+
+        if return_code[0] != 0:
+            raise GitExecuteError(' '.join(command_line), return_code[0], output_joiner.join(last_lines))
+
     # call shortcut
     __call__ = Execute
 
@@ -153,6 +557,8 @@ class Git(Singleton):
         '''
         Clone a repository_url
 
+        If mirror_cache is set, uses the objects in the mirror of repository_url.
+
         :param unicode repository_url:
             The path to the repository_url.
             e.g. git@yoda:something.git, X:/.git_repos/something.git
@@ -194,12 +600,21 @@ class Git(Singleton):
                     cmdline += ['-n']
                 elif branch is not None:
                     cmdline += ['-b', branch]
-                cmdline += [repository_url, target_dir]
-                self.Execute(
-                    cmdline,
-                    output_callback=output_callback,
-                    clean_eol=False
-                )
+
+                if self.mirror_cache is None:
+                    self.Execute(
+                        cmdline + [repository_url, target_dir],
+                        output_callback=output_callback,
+                        clean_eol=False
+                    )
+                else:
+                    mirror_cache = self.mirror_cache
+                    with mirror_cache.Use(self, repository_url, output_callback) as mirror_dir:
+                        self.Execute(
+                            cmdline + mirror_cache.GetCloneFlags(mirror_dir) + [repository_url, target_dir],
+                            output_callback=output_callback,
+                            clean_eol=False
+                        )
 
             # Clear cache since we could have changed ref/branch/dirty files.
             self.ClearCache()
@@ -311,6 +726,18 @@ class Git(Singleton):
             ['summary']
             ['iso_date']
         '''
+        commit = self._GetCatFileCommit(repo_path, ref)
+        if commit is not None:
+            from gitit.cat_file import FormatIsoDate, GetSubject
+            cat_file = self._GetCatFile(repo_path)
+            return {
+                'commit' : commit['commit'],
+                'short_commit' : cat_file.GetShortObjectId(commit['commit']),
+                'author' : commit['author_email'],
+                'summary' : GetSubject(commit['message']),
+                'iso_date' : FormatIsoDate(commit['committer_date'], commit['committer_timezone']),
+            }
+
         result_format = "commit:%H%nshort_commit:%h%nauthor:%ae%nsummary:%s%niso_date:%ci"
         result = self.Execute(
             ['show', ref, '-s', '--pretty=format:%s' % result_format],
@@ -452,9 +879,16 @@ class Git(Singleton):
         :return unicode:
             The author's name
         '''
-        return self.Execute(
-            ['log', revision, '-1', '--pretty=format:%an'], repo_path, flat_output=True
-        )
+        def Compute():
+            commit = self._GetCatFileCommit(repo_path, revision)
+            if commit is not None:
+                return commit['author_name']
+
+            return self.Execute(
+                ['log', revision, '-1', '--pretty=format:%an'], repo_path, flat_output=True
+            )
+
+        return self._GetCommitData(repo_path, revision, 'GetAuthor', Compute)
 
 
     def GetAuthorEmail(self, repo_path, revision):
@@ -468,9 +902,16 @@ class Git(Singleton):
         :return unicode:
             The author's email
         '''
-        return self.Execute(
-            ['log', revision, '-1', '--pretty=format:%ae'], repo_path, flat_output=True
-        )
+        def Compute():
+            commit = self._GetCatFileCommit(repo_path, revision)
+            if commit is not None:
+                return commit['author_email']
+
+            return self.Execute(
+                ['log', revision, '-1', '--pretty=format:%ae'], repo_path, flat_output=True
+            )
+
+        return self._GetCommitData(repo_path, revision, 'GetAuthorEmail', Compute)
 
 
     def GetMessage(self, repo_path, revision):
@@ -484,9 +925,16 @@ class Git(Singleton):
         :return unicode:
             The commit message
         '''
-        return self.Execute(
-            ['log', revision, '-1', '--pretty=format:%B'], repo_path, flat_output=True
-        )
+        def Compute():
+            commit = self._GetCatFileCommit(repo_path, revision)
+            if commit is not None:
+                return _FlatOutput(commit['message'])
+
+            return self.Execute(
+                ['log', revision, '-1', '--pretty=format:%B'], repo_path, flat_output=True
+            )
+
+        return self._GetCommitData(repo_path, revision, 'GetMessage', Compute)
 
 
     def GetChangedPaths(self, repo_path, revision, previous_revision=None):
@@ -509,14 +957,19 @@ class Git(Singleton):
         if previous_revision is not None:
             revision_string = previous_revision + '..' + revision
 
-        # Use git show to list paths
-        changed_paths = self.Execute(
-            ['show', '-m', '--pretty=format:', '--name-only', revision_string], repo_path)
+        def Compute():
+            # Use git show to list paths
+            changed_paths = self.Execute(
+                ['show', '-m', '--pretty=format:', '--name-only', revision_string], repo_path)
+
+            changed_paths = set(changed_paths)
+            changed_paths.discard('')
 
-        changed_paths = set(changed_paths)
-        changed_paths.discard('')
+            return changed_paths
 
-        return changed_paths
+        if previous_revision is not None:
+            return Compute()
+        return self._GetCommitData(repo_path, revision, 'GetChangedPaths', Compute)
 
 
     def GetCommitStats(self, repo_path, revision):
@@ -541,17 +994,20 @@ class Git(Singleton):
                 return 0
             return int(result.group(1))
 
-        stats = self.Execute(
-            ['show', revision, '--shortstat', '--pretty=format:'],
-            repo_path,
-        )
+        def Compute():
+            stats = self.Execute(
+                ['show', revision, '--shortstat', '--pretty=format:'],
+                repo_path,
+            )
 
-        stats = stats[-1]
-        changed = ExtractValue(stats, '(\d+) file[s]? changed')
-        insertions = ExtractValue(stats, '(\d+) insertion[s]?')
-        deletions = ExtractValue(stats, '(\d+) deletion')
+            stats = stats[-1]
+            changed = ExtractValue(stats, '(\d+) file[s]? changed')
+            insertions = ExtractValue(stats, '(\d+) insertion[s]?')
+            deletions = ExtractValue(stats, '(\d+) deletion')
 
-        return (changed, insertions, deletions)
+            return (changed, insertions, deletions)
+
+        return self._GetCommitData(repo_path, revision, 'GetCommitStats', Compute)
 
 
     def Checkout(self, repo_path, ref):
@@ -617,9 +1073,27 @@ class Git(Singleton):
             A list of all revision hashes that are reachable by r2, but not by r1.
             Orders from earliest to latest.
         '''
+        revision_args = self._GetRevisionsArgs(repo_path, r1, r2, ref, ignore_merges)
+        if revision_args is None:
+            return []
+
+        hashes = self.Execute(['log', '--pretty=format:%H'] + revision_args, repo_path)
+        hashes.reverse()
+
+        return hashes
+
+
+    def _GetRevisionsArgs(self, repo_path, r1, r2, ref, ignore_merges):
+        '''
+        .. seealso:: GetRevisions for the parameters.
+
+        :return list(unicode)|None:
+            The arguments for `git log` selecting the revisions reachable by r2, but not by r1, or
+            None if there are no revisions (branch deletion).
+        '''
         # Handle branch deletion (no commits here)
         if r2 == self.ZERO_REVISION:
-            return []
+            return None
 
         # Handle new branches, or first pushes to a repository
         if r1 == self.ZERO_REVISION:
@@ -635,21 +1109,108 @@ class Git(Singleton):
             heads.remove(ref)
 
             # Find all commits reachable by r2, that can't be reached in any other branch
-            command_line = ['log', r2, "--pretty=%H", "--not"] + heads
-
-            if ignore_merges:
-                command_line += ['--no-merges']
-            hashes = self.Execute(command_line, repo_path)
+            result = [r2, "--not"] + heads
         else:
             # Simple case
-            command_line = ['log', '--pretty=format:%H', '%s..%s' % (r1, r2)]
-            if ignore_merges:
-                command_line += ['--no-merges']
-            hashes = self.Execute(command_line, repo_path)
+            result = ['%s..%s' % (r1, r2)]
 
-        hashes.reverse()
+        if ignore_merges:
+            result += ['--no-merges']
+        return result
 
-        return hashes
+
+    def IterCommits(self, repo_path, r1, r2, ref=None, ignore_merges=False, fields=None):
+        '''
+        Obtains the metadata of many commits at once: runs a single `git log` and parses the commits
+        as its output is generated.
+
+        :param unicode repo_path:
+            Path to the repository (local)
+
+        :param unicode r1:
+        :param unicode r2:
+        :param unicode ref:
+        :param bool ignore_merges:
+            Select the commits, .. seealso:: GetRevisions
+
+        :param list(unicode)|None fields:
+            The fields obtained for each commit, from COMMIT_FORMAT_FIELDS and COMMIT_DIFF_FIELDS
+            (only one of the diff fields can be requested). If None, uses DEFAULT_COMMIT_FIELDS.
+
+            The fields give the same values as:
+                'author_name': GetAuthor
+                'author_email': GetAuthorEmail
+                'message': GetMessage
+                'changed_paths': GetChangedPaths
+                'commit', 'short_commit', 'summary', 'iso_date': GetCommitDict
+                'parents': list of the parent commits
+                'name_status': list of tuple(status, path), e.g. ('M', 'alpha.txt').
+                    Renames and copies give tuple(status, old_path, new_path).
+                'numstat': list of tuple(lines added, lines deleted, path). The number of lines is None
+                    for binary files.
+
+        :rtype: iter(dict(unicode,object))
+        :returns:
+            The commits reachable by r2, but not by r1, from earliest to latest (the same order as
+            GetRevisions).
+        '''
+        if fields is None:
+            fields = self.DEFAULT_COMMIT_FIELDS
+
+        format_fields = [i for i in fields if i in self.COMMIT_FORMAT_FIELDS and i != 'commit']
+        diff_fields = [i for i in fields if i in self.COMMIT_DIFF_FIELDS]
+        unknown_fields = set(fields).difference(format_fields, diff_fields, ['commit'])
+        if unknown_fields:
+            raise ValueError('Unknown commit fields: %s' % ', '.join(sorted(unknown_fields)))
+        assert len(diff_fields) <= 1, 'Only one of the diff fields can be requested.'
+
+        revision_args = self._GetRevisionsArgs(repo_path, r1, r2, ref, ignore_merges)
+        if revision_args is None:
+            return iter(())
+
+        # One record for each commit: a mark followed by the fields separated by NUL. With -z, the
+        # diff entries are also separated by NUL.
+        log_format = _LOG_RECORD_MARK + '%x00'.join(
+            ['%H'] + [self.COMMIT_FORMAT_FIELDS[i] for i in format_fields]
+        )
+        command_line = ['log', '--reverse', '-z', '--format=' + log_format]
+        if diff_fields:
+            # -m: show the changes of merges against each parent, like GetChangedPaths.
+            command_line += [self.COMMIT_DIFF_FIELDS[diff_fields[0]], '-m']
+        command_line += revision_args
+
+        output = self.Execute(command_line, repo_path, streaming=True, clean_eol=False)
+        return self._IterCommits(output, format_fields, diff_fields)
+
+
+    def _IterCommits(self, output, format_fields, diff_fields):
+        '''
+        Generator used by IterCommits to parse the git log output.
+        '''
+        commit = None
+        for i_values, i_diff_tokens in _IterLogRecords(output, len(format_fields) + 1):
+            if commit is not None and commit['commit'] == i_values[0]:
+                # With -m, merges are repeated for each parent.
+                commit[diff_fields[0]] = _MergeDiffField(
+                    diff_fields[0], commit[diff_fields[0]], i_diff_tokens
+                )
+                continue
+
+            if commit is not None:
+                yield commit
+
+            commit = {'commit' : i_values[0]}
+            for j_field, j_value in zip(format_fields, i_values[1:]):
+                if j_field == 'parents':
+                    j_value = j_value.split()
+                elif j_field == 'message':
+                    j_value = _FlatOutput(j_value)
+                commit[j_field] = j_value
+            if diff_fields:
+                commit[diff_fields[0]] = _MergeDiffField(diff_fields[0], None, i_diff_tokens)
+
+        if commit is not None:
+            yield commit
 
 
     def Add(self, repo_path, filename):
@@ -711,10 +1272,12 @@ class Git(Singleton):
         return self.Execute(command_line, repo_path)
 
 
-    def Fetch(self, repo_path, remote_name=None, ref=None, tags=False, flags=[]):
+    def Fetch(self, repo_path, remote_name=None, ref=None, tags=False, flags=[], output_callback=None):
         '''
         Fetches information from a remote
 
+        If mirror_cache is set, fetches from the mirror of the remote first.
+
         :param unicode repo_path:
             Path to the repository (local)
 
@@ -730,6 +1293,9 @@ class Git(Singleton):
         :param list(unicode) flags:
             Additional flags passed to git fetch
 
+        :param output_callback:
+            .. seealso:: self.Execute
+
         :return list(unicode):
             Returns the command execution output.
         '''
@@ -746,7 +1312,33 @@ class Git(Singleton):
 
         command_line += flags
 
-        return self.Execute(command_line, repo_path)
+        if self.mirror_cache is not None:
+            self._FetchFromMirror(repo_path, remote_name or 'origin', output_callback)
+
+        return self.Execute(command_line, repo_path, output_callback=output_callback)
+
+
+    def _FetchFromMirror(self, repo_path, remote_name, output_callback):
+        '''
+        Fetches the refs of a remote from its mirror in mirror_cache (updating the mirror first), so
+        that fetching from the remote afterwards downloads only objects not in the mirror.
+
+        Does nothing if the remote has no url or fetch refspecs.
+        '''
+        try:
+            url = self.GetRemoteUrl(repo_path, remote_name)
+            refspecs = self.Execute(
+                ['config', '--local', '--get-all', 'remote.%s.fetch' % remote_name], repo_path)
+        except GitExecuteError:
+            return
+
+        mirror_cache = self.mirror_cache
+        with mirror_cache.Use(self, url, output_callback) as mirror_dir:
+            self.Execute(
+                ['fetch', '--quiet', mirror_dir] + refspecs,
+                repo_path,
+                output_callback=output_callback,
+            )
 
 
     def Reset(self, repo_path, ref=None):
@@ -826,8 +1418,7 @@ class Git(Singleton):
         )
 
 
-    @Memoize(500)
-    def Log(self, repo_path, flags=()):
+    def Log(self, repo_path, flags=(), streaming=False):
         '''
         :param unicode repo_path:
             Path to the repository (local)
@@ -837,28 +1428,74 @@ class Git(Singleton):
 
             e.g. ('--oneline',)
 
-        :returns list(unicode):
+        :param bool streaming:
+            If True, returns an iterator over the output lines instead of a list. The streamed
+            output is not cached.
+
+            .. seealso:: Execute
+
+        :returns list(unicode)|iter(unicode):
             Returns the command execution output.
+
+        .. note::
+            The cached output is computed again when HEAD, the current branch or packed-refs change
+            (see VALIDATE_CACHE). Changes in other loose refs named in flags (e.g. '--all' or a
+            remote branch) are not detected: use Log.ClearCache in that case.
+        '''
+        if streaming:
+            return self.Execute(('log',) + flags, repo_path, streaming=True)
+        return self._Log(repo_path, flags, self._GetRepositoryState(repo_path, index=False))
+
+
+    @_CacheByRepositoryState(500)
+    def _Log(self, repo_path, flags, _repository_state):
+        '''
+        Cached implementation of Log.
         '''
         return self.Execute(('log',) + flags, repo_path)
 
 
-    @Memoize(500)
     def GetCurrentBranch(self, repo_path, submodule=False):
         '''
         :param repo_path:
             Path to the repository (local)
 
+        :param bool submodule:
+            If True and repo_path is a submodule, returns the current branch of the host repository.
+            Changes in the host repository are not detected by VALIDATE_CACHE.
+
         :returns unicode|None:
             The name of the current branch.
 
         :raises NotCurrentlyInAnyBranchError:
             If not on any branch.
         '''
+        return self._GetCurrentBranch(
+            repo_path, submodule, self._GetRepositoryState(repo_path, index=False)
+        )
+
+
+    @_CacheByRepositoryState(500)
+    def _GetCurrentBranch(self, repo_path, submodule, _repository_state):
+        '''
+        .. seealso:: GetCurrentBranch
+        '''
         # Returns the branch of the host repository if the given repo_path is a submodule.
         if submodule and self._IsSubModule(repo_path):
             repo_path = self._GetTopLevel(os.path.dirname(self._GetTopLevel(repo_path)))
 
+        def ReadCurrentBranch(refs):
+            head_ref, head_id = refs.ReadHead()
+            if head_ref is None:
+                raise NotCurrentlyInAnyBranchError(repo_path)
+            if head_id is None or not head_ref.startswith(self.REFS_HEADS):
+                return None
+            return head_ref[len(self.REFS_HEADS):]
+
+        current_branch = self._ReadRefs(repo_path, ReadCurrentBranch)
+        if current_branch is not None:
+            return current_branch
+
         branches = self.Execute(['branch'], repo_path)
 
         for branch in branches:
@@ -877,7 +1514,6 @@ class Git(Singleton):
         return current_branch
 
 
-    @Memoize(500)
     def GetCurrentRef(self, path, fail_if_dirty=False):
         '''
         :param unicode path:
@@ -886,6 +1522,16 @@ class Git(Singleton):
         :returns unicode:
             Git ref for last commit that changed `path`
         '''
+        return self._GetCurrentRef(
+            path, fail_if_dirty, self._GetRepositoryState(path, index=fail_if_dirty)
+        )
+
+
+    @_CacheByRepositoryState(500)
+    def _GetCurrentRef(self, path, fail_if_dirty, _repository_state):
+        '''
+        .. seealso:: GetCurrentRef
+        '''
         # Just to be safe, make sure that `path` is absolute and standard
         from ben10.filesystem import StandardizePath
 
@@ -905,7 +1551,8 @@ class Git(Singleton):
             if modified_files_in_path:
                 raise DirtyRepositoryError(git_root_dir, modified_files_in_path)
 
-        return self.Log(path, ('-n1', '--pretty=format:%H', '.'))[0]
+        # Not using Log: its cache is not validated when the repository changes.
+        return self.Execute(['log', '-n1', '--pretty=format:%H', '.'], path)[0]
 
 
     def _IsSubModule(self, path):
@@ -1159,6 +1806,23 @@ class Git(Singleton):
         '''
         import re
 
+        def ReadBranches(refs):
+            if remote:
+                prefix = 'refs/remotes/%s/' % remote_name
+                return sorted(i[len(prefix):] for i in refs.GetRefs(prefix))
+
+            # Detached HEAD and branches without commits are listed by git with special names.
+            head_ref, head_id = refs.ReadHead()
+            if head_ref is None or head_id is None or not head_ref.startswith(self.REFS_HEADS):
+                return None
+            current = head_ref[len(self.REFS_HEADS):]
+            branches = [i[len(self.REFS_HEADS):] for i in refs.GetRefs(self.REFS_HEADS)]
+            return [current] + sorted(i for i in branches if i != current)
+
+        branches = self._ReadRefs(repo_path, ReadBranches)
+        if branches is not None:
+            return branches
+
         if remote:
             all_branches = self.Execute(['branch', '-r'], repo_path)
             r_branches = set()
@@ -1214,7 +1878,6 @@ class Git(Singleton):
         return removed_files
 
 
-    @Memoize(500)
     def GetDirtyFiles(self, repo_path, source_dir='.'):
         '''
         Returns modified files from a repository (ignores untracked files).
@@ -1230,6 +1893,14 @@ class Git(Singleton):
         :returns:
             List of (status, path) of modified files in a repository
         '''
+        return self._GetDirtyFiles(repo_path, source_dir, self._GetRepositoryState(repo_path))
+
+
+    @_CacheByRepositoryState(500)
+    def _GetDirtyFiles(self, repo_path, source_dir, _repository_state):
+        '''
+        .. seealso:: GetDirtyFiles
+        '''
         status = self.Status(
             repo_path,
             flags=['--porcelain'],
@@ -1292,11 +1963,53 @@ class Git(Singleton):
         :returns:
             Set of available tag names
         '''
+        def ReadTags(refs):
+            tags = refs.GetRefs(self.REFS_TAGS)
+            if commit is not None:
+                commit_id = refs.Resolve(commit)
+                if commit_id is None:
+                    return None
+                peeled_tags = refs.GetPeeledRefs()
+                for i_tag, i_object_id in tags.items():
+                    if i_object_id != commit_id and self._PeelObject(
+                            repo_path, i_object_id, peeled_tags.get(i_tag)) != commit_id:
+                        del tags[i_tag]
+            return set(i[len(self.REFS_TAGS):] for i in tags)
+
+        tags = self._ReadRefs(repo_path, ReadTags)
+        if tags is not None:
+            return tags
+
         if commit is not None:
             return set(self.Execute(['tag', '--points-at=' + commit], repo_path))
         return set(self.Execute(['tag'], repo_path))
 
 
+    def _PeelObject(self, repo_path, object_id, peeled_id=None):
+        '''
+        :param unicode object_id:
+            The object id of a tag ref.
+
+        :param unicode|None peeled_id:
+            The peeled object id, when known (from packed-refs).
+
+        :returns unicode:
+            The id of the object pointed by an annotated tag object, or object_id for other objects.
+
+        :raises RefsError:
+            If the object can't be read through cat-file (see USE_CAT_FILE).
+        '''
+        if peeled_id is not None:
+            return peeled_id
+
+        from gitit.refs import RefsError
+
+        peeled_object = self._GetCatFileObjectInfo(repo_path, object_id + '^{}')
+        if peeled_object is None:
+            raise RefsError(repo_path, 'can\'t peel object %s' % object_id)
+        return peeled_object[0]
+
+
     def GetTagMessage(self, repo_path, tag_name):
         '''
         :param unicode repo_path:
@@ -1308,7 +2021,13 @@ class Git(Singleton):
         :returns unicode:
             Tag content
         '''
-        tag_output = self.Execute(['cat-file', '-p', tag_name], repo_path, flat_output=True)
+        tag_object = self._GetCatFileObject(repo_path, tag_name)
+        if tag_object is not None and tag_object[1] in ('tag', 'commit'):
+            tag_output = _FlatOutput(
+                tag_object[2].decode(self.OUTPUT_ENCODING, self.OUTPUT_ENCODING_ERRORS)
+            )
+        else:
+            tag_output = self.Execute(['cat-file', '-p', tag_name], repo_path, flat_output=True)
 
         # Output starts with some headers, followed by an empty line and then the tag message
         # e.g.:
@@ -1473,6 +2192,131 @@ class Git(Singleton):
         self.Push(repo_path, remote_name=remote_name, ref=':' + branch_name)
 
 
+    # The caches moved to private methods: e.g. GetCurrentBranch.ClearCache(git) still clears the
+    # cache of GetCurrentBranch.
+    Log.ClearCache = _Log.ClearCache
+    GetCurrentBranch.ClearCache = _GetCurrentBranch.ClearCache
+    GetCurrentRef.ClearCache = _GetCurrentRef.ClearCache
+    GetDirtyFiles.ClearCache = _GetDirtyFiles.ClearCache
+
+
+
+def _GetFileState(filename):
+    '''
+    :rtype: tuple(float,int,int)|None
+    :returns:
+        The modification time, size and inode of a file (git replaces files when changing them, so
+        the inode changes even if the time and size don't), or None if it doesn't exist.
+    '''
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+
+# Marks the start of each commit in the output of IterCommits' git log (can't be in the fields).
+_LOG_RECORD_MARK = '%x01'
+
+
+def _IterLogRecords(output, field_count):
+    '''
+    Parses the output of IterCommits' git log.
+
+    :param iter(unicode) output:
+        The output of git log, in any number of pieces.
+
+    :param int field_count:
+        The number of fields in each record.
+
+    :rtype: iter(tuple(list(unicode), list(unicode)))
+    :returns:
+        The fields and the diff entries of each commit record.
+    '''
+    def IterTokens():
+        pending = []
+        for i_piece in output:
+            parts = i_piece.split('\0')
+            for j_part in parts[:-1]:
+                pending.append(j_part)
+                yield ''.join(pending)
+                pending = []
+            pending.append(parts[-1])
+        last = ''.join(pending)
+        if last:
+            yield last
+
+    tokens = IterTokens()
+    record = None
+    for i_token in tokens:
+        if i_token.startswith('\x01'):
+            if record is not None:
+                yield record
+            values = [i_token[1:]] + [next(tokens) for _i in xrange(field_count - 1)]
+            record = (values, [])
+        elif i_token and record is not None:
+            if not record[1] and i_token.startswith('\n'):
+                # The diff entries are separated from the fields by a new line.
+                i_token = i_token[1:]
+            record[1].append(i_token)
+    if record is not None:
+        yield record
+
+
+def _MergeDiffField(field, value, diff_tokens):
+    '''
+    Parses the diff entries of a commit record, adding them to the current value of the field.
+
+    :param unicode field:
+        One of Git.COMMIT_DIFF_FIELDS.
+
+    :param object|None value:
+        The current value, for the repeated records of merges. None for the first record.
+
+    :param list(unicode) diff_tokens:
+        The diff entries from _IterLogRecords.
+    '''
+    tokens = iter(diff_tokens)
+
+    if field == 'changed_paths':
+        result = value or set()
+        result.update(tokens)
+        result.discard('')
+        return result
+
+    result = value or []
+    if field == 'name_status':
+        for i_status in tokens:
+            if i_status[:1] in ('R', 'C'):
+                result.append((i_status, next(tokens), next(tokens)))
+            else:
+                result.append((i_status, next(tokens)))
+    else:  # numstat
+        for i_token in tokens:
+            added, deleted, path = i_token.split('\t', 2)
+            if not path:  # Renames and copies
+                next(tokens)  # old path
+                path = next(tokens)
+            added = int(added) if added.isdigit() else None
+            deleted = int(deleted) if deleted.isdigit() else None
+            result.append((added, deleted, path))
+    return result
+
+
+def _FlatOutput(text):
+    '''
+    :param unicode text:
+        Output from git.
+
+    :returns unicode:
+        The text as returned by Git.Execute with flat_output: lines joined by '\n', without eols.
+    '''
+    lines = text.split('\n')
+    if text.endswith('\n'):
+        lines.pop()
+    return '\n'.join(i.rstrip('\r') for i in lines)
+
+
 
 #===================================================================================================
 # TargetDirAlreadyExistsError
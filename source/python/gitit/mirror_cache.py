@@ -0,0 +1,309 @@
+from __future__ import unicode_literals
+'''
+Local mirrors of remote repositories, shared by all the clones in a machine (e.g. by the jobs of a
+continuous integration agent), so that objects are downloaded only once.
+'''
+import contextlib
+import os
+import time
+
+
+
+# Default maximum size of all the mirrors in a cache directory.
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024 * 1024
+
+# Default number of seconds since the last update of a mirror before updating it again.
+DEFAULT_REFRESH_INTERVAL = 60
+
+
+
+#===================================================================================================
+# MirrorCache
+#===================================================================================================
+class MirrorCache(object):
+    '''
+    Keeps `git clone --mirror` copies of remote repositories in a cache directory.
+
+    Usage:
+        Git.mirror_cache = MirrorCache('/var/cache/git_mirrors')
+
+        # Clones using the objects in the mirror (updated first), downloading only the missing ones.
+        Git().Clone('git@server:project.git', 'project')
+
+        # Fetches the objects from the mirror before fetching from the remote.
+        Git().Fetch('project', remote_name='origin')
+
+    With dissociate=True (the default), clones copy the objects they need from the mirror
+    (`git clone --reference --dissociate`), so removing mirrors (see Prune) never breaks them. With
+    dissociate=False, clones use the objects of the mirror through alternates (faster and using less
+    disk space), but break if the mirror is removed: use only with max_bytes=None.
+
+    Each mirror is locked (see ben10.filesystem.FileLock) exclusively while created or updated, and
+    shared while cloning from it, so that many processes may share the cache directory (and clone
+    from the same mirror at the same time).
+
+    Layout of the cache directory, for each mirror:
+        <name>-<hash of url>.git: The mirror
+        <name>-<hash of url>.lock: Lock file
+        <name>-<hash of url>.used: Touched whenever the mirror is used (see Prune)
+    '''
+
+    def __init__(
+            self,
+            cache_dir,
+            max_bytes=DEFAULT_MAX_BYTES,
+            refresh_interval=DEFAULT_REFRESH_INTERVAL,
+            dissociate=True,
+            lock_timeout=None,
+        ):
+        '''
+        :param unicode cache_dir:
+            Directory with the mirrors.
+
+        :param int|None max_bytes:
+            The least recently used mirrors are removed when all mirrors use more than this. None to
+            never remove mirrors.
+
+        :param float refresh_interval:
+            Mirrors updated less than this number of seconds ago are not updated again (e.g. when
+            many jobs clone the same repository at the same time).
+
+        :param bool dissociate:
+            If clones copy the objects from the mirror (see class docs).
+
+        :param float|None lock_timeout:
+            The maximum number of seconds waiting for another process updating a mirror.
+        '''
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.refresh_interval = refresh_interval
+        self.dissociate = dissociate
+        self.lock_timeout = lock_timeout
+
+
+    def GetMirrorDir(self, repository_url):
+        '''
+        :param unicode repository_url:
+            The url of the remote repository.
+
+        :returns unicode:
+            The directory of the mirror for the repository (which may not exist yet).
+        '''
+        import hashlib
+        name = repository_url.rstrip('/\\').replace('\\', '/').rsplit('/', 1)[-1].rsplit(':', 1)[-1]
+        if name.endswith('.git'):
+            name = name[:-len('.git')]
+        url_hash = hashlib.md5(repository_url.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.cache_dir, '%s-%s.git' % (name or 'repository', url_hash))
+
+
+    def Update(self, git, repository_url, output_callback=None):
+        '''
+        Creates or updates the mirror for a repository (unless updated in the last refresh_interval
+        seconds), and removes other mirrors if the cache is too big (see Prune).
+
+        :param Git git:
+            Used to execute git.
+
+        :param unicode repository_url:
+            The url of the remote repository.
+
+        :param output_callback:
+            .. seealso:: Git.Execute
+
+        :returns unicode:
+            The directory of the mirror.
+
+        :raises GitExecuteError:
+            If the remote repository is not available.
+        '''
+        mirror_dir = self.GetMirrorDir(repository_url)
+        if self._Update(git, repository_url, mirror_dir, output_callback):
+            self.Prune(keep=[mirror_dir])
+        return mirror_dir
+
+
+    @contextlib.contextmanager
+    def Use(self, git, repository_url, output_callback=None):
+        '''
+        Context manager that updates the mirror (like Update) and keeps a shared lock on it while
+        in the context, so that it's not updated or removed by other processes (e.g. while cloning
+        from it). Other processes may use the same mirror at the same time.
+
+        Usage:
+            with mirror_cache.Use(git, repository_url) as mirror_dir:
+                git.Execute(['clone'] + mirror_cache.GetCloneFlags(mirror_dir) + [...])
+
+        .. seealso:: Update
+        '''
+        from ben10.filesystem import FileLock
+
+        mirror_dir = self.GetMirrorDir(repository_url)
+        lock_filename = self._GetLockFilename(mirror_dir)
+        updated = False
+        while True:
+            with FileLock(lock_filename, timeout=self.lock_timeout, shared=True):
+                # Checks again after updating: may be removed by Prune in another process between
+                # the update and the shared lock.
+                if os.path.isdir(mirror_dir) and (updated or not self._IsOutdated(mirror_dir)):
+                    self._Touch(mirror_dir)
+                    yield mirror_dir
+                    break
+
+            # The exclusive lock is only needed (waiting for the processes using the mirror) when
+            # it's missing or outdated.
+            updated = self._Update(git, repository_url, mirror_dir, output_callback) or updated
+
+        if updated:
+            self.Prune(keep=[mirror_dir])
+
+
+    def _Update(self, git, repository_url, mirror_dir, output_callback):
+        '''
+        Creates or updates the mirror (unless updated in the last refresh_interval seconds), with
+        the mirror locked exclusively.
+
+        :returns bool:
+            True if the mirror was created or updated.
+        '''
+        from ben10.filesystem import DeleteDirectory, FileLock
+
+        updated = False
+        with FileLock(self._GetLockFilename(mirror_dir), timeout=self.lock_timeout):
+            self._Touch(mirror_dir)
+
+            if not os.path.isdir(mirror_dir):
+                # Clones in a temporary directory, so an interrupted clone doesn't leave a broken
+                # mirror.
+                temp_dir = mirror_dir + '.tmp'
+                if os.path.isdir(temp_dir):
+                    DeleteDirectory(temp_dir)
+                git.Execute(
+                    ['clone', '--mirror', repository_url, temp_dir],
+                    output_callback=output_callback,
+                    clean_eol=False,
+                )
+                os.rename(temp_dir, mirror_dir)
+                updated = True
+
+            elif self._IsOutdated(mirror_dir):
+                git.Execute(
+                    ['fetch', '--prune', 'origin'],
+                    mirror_dir,
+                    output_callback=output_callback,
+                    clean_eol=False,
+                )
+                updated = True
+
+            if updated:
+                with open(self._GetUpdatedFilename(mirror_dir), 'w'):
+                    pass
+
+        return updated
+
+
+    def GetCloneFlags(self, mirror_dir):
+        '''
+        :param unicode mirror_dir:
+            A mirror directory, as returned by Update.
+
+        :rtype: list(unicode)
+        :returns:
+            The flags for `git clone` to use the objects of the mirror.
+        '''
+        result = ['--reference', mirror_dir]
+        if self.dissociate:
+            result.append('--dissociate')
+        return result
+
+
+    def Prune(self, keep=()):
+        '''
+        Removes the least recently used mirrors until all the mirrors use at most max_bytes. Mirrors
+        being used by other processes are not removed.
+
+        :param list(unicode) keep:
+            Mirror directories that should not be removed.
+
+        :rtype: list(unicode)
+        :returns:
+            The mirror directories removed.
+        '''
+        from ben10.filesystem import DeleteDirectory, FileLock
+
+        if self.max_bytes is None or not os.path.isdir(self.cache_dir):
+            return []
+
+        mirrors = []
+        total_bytes = 0
+        for i_name in os.listdir(self.cache_dir):
+            mirror_dir = os.path.join(self.cache_dir, i_name)
+            if not i_name.endswith('.git') or not os.path.isdir(mirror_dir):
+                continue
+            size = _GetDirectorySize(mirror_dir)
+            total_bytes += size
+            if mirror_dir not in keep:
+                mirrors.append((self._GetLastUsed(mirror_dir), mirror_dir, size))
+
+        result = []
+        for _last_used, mirror_dir, size in sorted(mirrors):
+            if total_bytes <= self.max_bytes:
+                break
+            lock = FileLock(self._GetLockFilename(mirror_dir))
+            if not lock.Acquire(blocking=False):
+                continue
+            try:
+                DeleteDirectory(mirror_dir)
+            finally:
+                lock.Release()
+            total_bytes -= size
+            result.append(mirror_dir)
+        return result
+
+
+    def _GetLockFilename(self, mirror_dir):
+        return mirror_dir[:-len('.git')] + '.lock'
+
+
+    def _GetUpdatedFilename(self, mirror_dir):
+        return os.path.join(mirror_dir, 'mirror_cache_updated')
+
+
+    def _GetLastUpdated(self, mirror_dir):
+        try:
+            return os.path.getmtime(self._GetUpdatedFilename(mirror_dir))
+        except OSError:
+            return 0
+
+
+    def _IsOutdated(self, mirror_dir):
+        return time.time() - self._GetLastUpdated(mirror_dir) >= self.refresh_interval
+
+
+    def _Touch(self, mirror_dir):
+        used_filename = mirror_dir[:-len('.git')] + '.used'
+        with open(used_filename, 'a'):
+            os.utime(used_filename, None)
+
+
+    def _GetLastUsed(self, mirror_dir):
+        try:
+            return os.path.getmtime(mirror_dir[:-len('.git')] + '.used')
+        except OSError:
+            return 0
+
+
+
+def _GetDirectorySize(directory):
+    '''
+    :returns int:
+        The size of all files in the directory.
+    '''
+    result = 0
+    for dirpath, _dirnames, filenames in os.walk(directory):
+        for i_filename in filenames:
+            try:
+                result += os.path.getsize(os.path.join(dirpath, i_filename))
+            except OSError:
+                pass  # Removed while walking
+    return result
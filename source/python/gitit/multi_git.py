@@ -0,0 +1,162 @@
+from __future__ import unicode_literals
+'''
+Runs Git operations over many repositories at the same time.
+'''
+from ben10.foundation.odict import odict
+from ben10.foundation.thread_pool import RunInThreads
+from gitit.git import Git, GitExecuteError, NotCurrentlyInAnyBranchError
+
+
+
+# Default number of repositories handled at the same time. Git operations are mostly waiting for
+# the disk or the network, so this is not related to the number of cpus.
+DEFAULT_MAX_JOBS = 8
+
+
+
+#===================================================================================================
+# MultiGit
+#===================================================================================================
+class MultiGit(object):
+    '''
+    Calls Git methods for many repositories at the same time, using up to max_jobs threads (each one
+    running one git process for a repository at a time).
+
+    Usage:
+        multi_git = MultiGit(max_jobs=16)
+        results = multi_git.Fetch(repo_paths, remote_name='origin')
+        for repo_path, error in results.errors.iteritems():
+            print repo_path, error
+
+    Errors from a repository (REPOSITORY_ERRORS) don't stop the other ones and are reported in the
+    results. Any other exception is raised after all running operations finish.
+
+    All threads use the same Git instance: its caches (see Git.ClearCache) and cat-file sessions are
+    thread-safe.
+    '''
+
+    # Errors reported for each repository in MultiGitResults.errors.
+    REPOSITORY_ERRORS = (GitExecuteError, NotCurrentlyInAnyBranchError)
+
+    def __init__(self, git=None, max_jobs=DEFAULT_MAX_JOBS):
+        '''
+        :param Git|None git:
+            The Git instance used for all repositories. If None, uses Git.GetSingleton()
+
+        :param int max_jobs:
+            The maximum number of repositories handled at the same time.
+        '''
+        if git is None:
+            git = Git.GetSingleton()
+        self.git = git
+        self.max_jobs = max_jobs
+
+
+    def Call(self, method_name, repo_paths, *args, **kwargs):
+        '''
+        Calls a Git method for each repository.
+
+        :param unicode method_name:
+            The name of the Git method, which receives the repository path as the first parameter.
+
+        :param list(unicode) repo_paths:
+            Paths to the repositories (local)
+
+        :param args:
+        :param kwargs:
+            Other parameters passed to the Git method.
+
+            If output_callback is given, it is called with the repository path and the output lines
+            (as output_callback(repo_path, line)). Calls are serialized, so the callback doesn't have
+            to be thread-safe.
+
+        :rtype: MultiGitResults
+        '''
+        import threading
+
+        method = getattr(self.git, method_name)
+        output_callback = kwargs.pop('output_callback', None)
+
+        results = {}
+        errors = {}
+        output_lock = threading.Lock()
+
+        def Run(repo_path):
+            repo_kwargs = kwargs.copy()
+            if output_callback is not None:
+                def RepoOutputCallback(line):
+                    with output_lock:
+                        output_callback(repo_path, line)
+                repo_kwargs['output_callback'] = RepoOutputCallback
+
+            try:
+                results[repo_path] = method(repo_path, *args, **repo_kwargs)
+            except self.REPOSITORY_ERRORS, e:
+                errors[repo_path] = e
+
+        RunInThreads(Run, [(i,) for i in repo_paths], self.max_jobs)
+
+        return MultiGitResults(
+            odict((i, results[i]) for i in repo_paths if i in results),
+            odict((i, errors[i]) for i in repo_paths if i in errors),
+        )
+
+
+    def Status(self, repo_paths, **kwargs):
+        '''
+        .. seealso:: Git.Status
+        .. seealso:: Call
+        '''
+        return self.Call('Status', repo_paths, **kwargs)
+
+
+    def Fetch(self, repo_paths, **kwargs):
+        '''
+        .. seealso:: Git.Fetch
+        .. seealso:: Call
+        '''
+        return self.Call('Fetch', repo_paths, **kwargs)
+
+
+    def Pull(self, repo_paths, **kwargs):
+        '''
+        .. seealso:: Git.Pull
+        .. seealso:: Call
+        '''
+        return self.Call('Pull', repo_paths, **kwargs)
+
+
+    def IsDirty(self, repo_paths):
+        '''
+        .. seealso:: Git.IsDirty
+        .. seealso:: Call
+        '''
+        return self.Call('IsDirty', repo_paths)
+
+
+    def GetCurrentBranch(self, repo_paths, **kwargs):
+        '''
+        .. seealso:: Git.GetCurrentBranch
+        .. seealso:: Call
+        '''
+        return self.Call('GetCurrentBranch', repo_paths, **kwargs)
+
+
+
+#===================================================================================================
+# MultiGitResults
+#===================================================================================================
+class MultiGitResults(object):
+    '''
+    Results of a MultiGit operation.
+
+    :ivar odict(unicode,object) results:
+        The result for each repository that succeeded, in the same order as the repositories.
+
+    :ivar odict(unicode,Exception) errors:
+        The error for each repository that failed, in the same order as the repositories.
+    '''
+
+    def __init__(self, results, errors):
+        self.results = results
+        self.errors = errors
@@ -0,0 +1,306 @@
+from __future__ import unicode_literals
+'''
+Reads HEAD and refs (loose and packed) directly from the git directory, without executing git.
+'''
+import os
+import re
+
+
+
+# Matches full object ids.
+FULL_OBJECT_ID_RE = re.compile('^[0-9a-fA-F]{40}$')
+
+
+
+#===================================================================================================
+# Refs
+#===================================================================================================
+class Refs(object):
+    '''
+    Reads the refs of a repository from its git directory.
+
+    Usage:
+        refs = Refs.FromPath('/home/user/project/source')
+        head_ref, head_id = refs.ReadHead()
+        branches = refs.GetRefs('refs/heads/')
+
+    Nothing is cached: the files are read again on each call. Layouts not supported (e.g. the
+    reftable backend) raise RefsError, so callers may execute git instead.
+    '''
+
+    def __init__(self, git_dir):
+        '''
+        :param unicode git_dir:
+            The git directory (e.g. "/home/user/project/.git"). For worktrees, the refs shared by all
+            worktrees are read from the directory given by its "commondir" file.
+
+        :raises RefsError:
+            If the repository uses a refs backend other than the files backend.
+        '''
+        self.git_dir = git_dir
+        self.common_dir = GetCommonDir(git_dir)
+        if os.path.exists(os.path.join(self.common_dir, 'reftable')):
+            raise RefsError(git_dir, 'reftable refs are not supported')
+
+
+    @classmethod
+    def FromPath(cls, path):
+        '''
+        :param unicode path:
+            Path within a Git repository.
+
+        :rtype: Refs
+
+        :raises RefsError:
+            If the git directory is not found.
+        '''
+        git_dir = FindGitDir(path)
+        if git_dir is None:
+            raise RefsError(path, 'git directory not found')
+        return cls(git_dir)
+
+
+    def ReadHead(self):
+        '''
+        :rtype: tuple(unicode|None, unicode|None)
+        :returns:
+            The ref pointed by HEAD (None if detached) and the object id of HEAD (None if HEAD points
+            to a branch without commits).
+
+        :raises RefsError:
+            If HEAD can't be read.
+        '''
+        value = self._ReadRefFile(os.path.join(self.git_dir, 'HEAD'))
+        if value is None:
+            raise RefsError(self.git_dir, 'HEAD not found')
+
+        if not value.startswith('ref: '):
+            return None, self._CheckObjectId(value)
+
+        head_ref = value[len('ref: '):].strip()
+        return head_ref, self.ReadRef(head_ref)
+
+
+    def ReadRef(self, ref_name, _depth=0):
+        '''
+        :param unicode ref_name:
+            A full ref name (e.g. "refs/heads/master")
+
+        :returns unicode|None:
+            The object id pointed by the ref (following symbolic refs), or None if the ref doesn't
+            exist.
+        '''
+        if _depth > 5:
+            raise RefsError(self.git_dir, 'too many levels of symbolic refs: %s' % ref_name)
+
+        value = self._ReadRefFile(self._GetRefFilename(ref_name))
+        if value is None:
+            return self._GetPackedRefs()[0].get(ref_name)
+
+        if value.startswith('ref: '):
+            return self.ReadRef(value[len('ref: '):].strip(), _depth + 1)
+        return self._CheckObjectId(value)
+
+
+    def GetRefs(self, prefix='refs/'):
+        '''
+        :param unicode prefix:
+            Only returns refs starting with this prefix (which should end with "/").
+
+        :rtype: dict(unicode,unicode)
+        :returns:
+            The object id for each ref name (symbolic refs, like "refs/remotes/origin/HEAD", are not
+            included).
+        '''
+        result = dict(
+            (ref_name, object_id)
+            for ref_name, object_id in self._GetPackedRefs()[0].iteritems()
+            if ref_name.startswith(prefix)
+        )
+
+        # Loose refs override packed refs
+        directory = self._GetRefFilename(prefix.rstrip('/'))
+        for dirpath, _dirnames, filenames in os.walk(directory):
+            for i_filename in filenames:
+                if i_filename.endswith('.lock'):
+                    continue
+                filename = os.path.join(dirpath, i_filename)
+                ref_name = os.path.relpath(filename, self.common_dir).replace(os.sep, '/')
+                value = self._ReadRefFile(filename)
+                if value is None or value.startswith('ref: '):
+                    continue
+                result[ref_name] = self._CheckObjectId(value)
+
+        return result
+
+
+    def GetPeeledRefs(self):
+        '''
+        :rtype: dict(unicode,unicode)
+        :returns:
+            The object id pointed by each annotated tag, when available in packed-refs.
+        '''
+        return self._GetPackedRefs()[1]
+
+
+    def Resolve(self, name):
+        '''
+        :param unicode name:
+            A full object id or a ref name, resolved like git does ("HEAD", "master", "v1.0",
+            "origin/master", "refs/heads/master", etc)
+
+        :returns unicode|None:
+            The object id, or None if the name can't be resolved without executing git (including
+            abbreviated object ids and revision expressions like "HEAD~1").
+        '''
+        if FULL_OBJECT_ID_RE.match(name):
+            return name.lower()
+
+        if name == 'HEAD':
+            return self.ReadHead()[1]
+
+        for i_ref_name in (
+                name,
+                'refs/' + name,
+                'refs/tags/' + name,
+                'refs/heads/' + name,
+                'refs/remotes/' + name,
+                'refs/remotes/' + name + '/HEAD',
+            ):
+            if not i_ref_name.startswith('refs/'):
+                continue
+            result = self.ReadRef(i_ref_name)
+            if result is not None:
+                return result
+        return None
+
+
+    def _GetRefFilename(self, ref_name):
+        if ref_name.startswith('refs/'):
+            return os.path.join(self.common_dir, *ref_name.split('/'))
+        # Pseudo refs (HEAD, FETCH_HEAD, etc) are in the git directory of each worktree.
+        return os.path.join(self.git_dir, ref_name)
+
+
+    def _ReadRefFile(self, filename):
+        '''
+        :returns unicode|None:
+            The contents of the ref file, or None if it doesn't exist.
+        '''
+        try:
+            with open(filename, 'rb') as ref_file:
+                return ref_file.read().decode('utf-8', 'replace').strip()
+        except IOError:
+            return None
+
+
+    def _GetPackedRefs(self):
+        '''
+        :rtype: tuple(dict(unicode,unicode),dict(unicode,unicode))
+        :returns:
+            The object ids and the peeled object ids in the packed-refs file, by ref name.
+        '''
+        packed_refs = {}
+        peeled_refs = {}
+        try:
+            with open(os.path.join(self.common_dir, 'packed-refs'), 'rb') as packed_refs_file:
+                contents = packed_refs_file.read().decode('utf-8', 'replace')
+        except IOError:
+            return packed_refs, peeled_refs
+
+        ref_name = None
+        for i_line in contents.splitlines():
+            if not i_line or i_line.startswith('#'):
+                continue
+            if i_line.startswith('^'):
+                if ref_name is not None:
+                    peeled_refs[ref_name] = self._CheckObjectId(i_line[1:])
+                continue
+            object_id, _separator, ref_name = i_line.partition(' ')
+            packed_refs[ref_name] = self._CheckObjectId(object_id)
+        return packed_refs, peeled_refs
+
+
+    def _CheckObjectId(self, object_id):
+        if not FULL_OBJECT_ID_RE.match(object_id):
+            raise RefsError(self.git_dir, 'unexpected object id: %s' % object_id)
+        return object_id.lower()
+
+
+
+#===================================================================================================
+# FindGitDir
+#===================================================================================================
+def FindGitDir(path):
+    '''
+    :param unicode path:
+        Path within a Git repository.
+
+    :returns unicode|None:
+        The git directory of the repository (found without executing git: looks for ".git" in path
+        and its parents, following ".git" files used by submodules and worktrees, and for bare
+        repositories), or None.
+    '''
+    path = os.path.abspath(path or '.')
+    while True:
+        dot_git = os.path.join(path, '.git')
+        if os.path.isdir(dot_git):
+            return dot_git
+        if os.path.isfile(dot_git):
+            try:
+                with open(dot_git, 'rb') as dot_git_file:
+                    contents = dot_git_file.read().decode('utf-8').strip()
+            except (IOError, UnicodeDecodeError):
+                return None
+            if not contents.startswith('gitdir:'):
+                return None
+            return os.path.normpath(os.path.join(path, contents[len('gitdir:'):].strip()))
+        if _IsGitDir(path):
+            return path
+
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _IsGitDir(path):
+    '''
+    :returns bool:
+        If path looks like a git directory (like the ones of bare repositories), as checked by git.
+    '''
+    return (
+        os.path.isfile(os.path.join(path, 'HEAD'))
+        and os.path.isdir(os.path.join(path, 'objects'))
+        and os.path.isdir(os.path.join(path, 'refs'))
+    )
+
+
+def GetCommonDir(git_dir):
+    '''
+    :param unicode git_dir:
+        A git directory.
+
+    :returns unicode:
+        The directory with the objects and refs shared by all worktrees (given by the "commondir"
+        file in the git directory of worktrees), or git_dir itself.
+    '''
+    commondir_filename = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir_filename):
+        with open(commondir_filename, 'rb') as commondir_file:
+            commondir = commondir_file.read().decode('utf-8').strip()
+        return os.path.normpath(os.path.join(git_dir, commondir))
+    return git_dir
+
+
+
+#===================================================================================================
+# RefsError
+#===================================================================================================
+class RefsError(RuntimeError):
+    '''
+    Raised when the refs of a repository can't be read without executing git.
+    '''
+    def __init__(self, path, message):
+        self.path = path
+        RuntimeError.__init__(self, 'Can\'t read refs of "%s": %s' % (path, message))